@@ -0,0 +1,297 @@
+"""api_metrics.py
+
+Per-endpoint metrics of the Coinbase Pro REST calls: request counts, latency histograms,
+pages of paginated responses, 429 retries, time spent waiting for the rate limiter, and error codes.
+
+The metrics are recorded by rate_limiter.ThrottledAdapter, under the HTTP session of every client
+made by cbpro_client.py, so the scripts do not need to change.  They are off by default, and cost
+nothing then.  Turn them on with METRICS=1 in .env, or the CBPRO_METRICS=1 environment variable.
+
+When on, every process
+- writes log/api_metrics_{script}.prom in the Prometheus text format at exit,
+  e.g. for the node_exporter textfile collector,
+- appends a JSON summary line to log/api_metrics_summary.jsonl at exit,
+- and serves the Prometheus text on http://127.0.0.1:{port}/metrics if METRICS_PORT
+  (or CBPRO_METRICS_PORT) is set, for long-running scripts like roberto_daemon.py.
+
+Example:
+CBPRO_METRICS=1 python cron_roberto.py ETH-USD 1000 5 100
+python api_metrics.py log/api_metrics_summary.jsonl
+"""
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# path segments replaced by a placeholder, so that e.g. every order id is counted under /orders/{id}
+ID_PATTERN = re.compile(r'^(client:.*|[0-9a-fA-F-]{32,36}|\d+)$')
+PRODUCT_PATTERN = re.compile(r'^[A-Z0-9]+-[A-Z0-9]+$')
+
+SUMMARY_FILENAME = "api_metrics_summary.jsonl"
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+#####   Classes   #####
+class EndpointStats:
+    """Counters of one endpoint, e.g. GET /orders"""
+    def __init__(self):
+        self.count = 0
+        self.latency_sum = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self.pages = 0
+        self.retries = 0
+        self.errors = {}
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'latency_sum_seconds': self.latency_sum,
+            'latency_mean_ms': 1000.0 * self.latency_sum / self.count if self.count else None,
+            'latency_p50_ms': self.get_quantile_ms(0.5),
+            'latency_p95_ms': self.get_quantile_ms(0.95),
+            'rate_limit_wait_seconds': self.wait_sum,
+            'continuation_pages': self.pages,
+            'retries_429': self.retries,
+            'errors': dict(self.errors),
+        }
+
+    def get_quantile_ms(self, quantile):
+        """Upper bound of the histogram bucket holding the quantile, in ms, or None without requests"""
+        if self.count == 0:
+            return None
+        rank = quantile * self.count
+        total = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.bucket_counts):
+            total += bucket_count
+            if total >= rank:
+                return 1000.0 * bound
+        return float('inf')
+
+class ApiMetrics:
+    """Metrics of all the endpoints called by this process, safe to record from many threads"""
+    def __init__(self, script_name):
+        self.script_name = script_name
+        self.start_time = time.time()
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def get_stats(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = EndpointStats()
+            self.endpoints[endpoint] = stats
+        return stats
+
+    def record_request(self, endpoint, latency, wait, error=None, continuation_page=False):
+        """Records one HTTP request.
+
+        Inputs:
+        -------
+        endpoint: str
+            e.g. 'GET /orders/{id}', see get_endpoint()
+        latency, wait: float
+            seconds waiting for the response, and waiting for the rate limiter before sending
+        error: str
+            HTTP status code of an error response, or the exception name if there was no response
+        continuation_page: bool
+            True for the second and later pages of a paginated response
+        """
+        bucket = len(LATENCY_BUCKETS)
+        for ii, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                bucket = ii
+                break
+        with self.lock:
+            stats = self.get_stats(endpoint)
+            stats.count += 1
+            stats.latency_sum += latency
+            stats.bucket_counts[bucket] += 1
+            stats.wait_sum += wait
+            if continuation_page:
+                stats.pages += 1
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self.get_stats(endpoint).retries += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'script': self.script_name,
+                'pid': os.getpid(),
+                'start': self.start_time,
+                'end': time.time(),
+                'endpoints': {endpoint: stats.to_dict() for endpoint, stats in sorted(self.endpoints.items())},
+            }
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP calculon_api_requests_total Coinbase Pro REST requests.',
+            '# TYPE calculon_api_requests_total counter',
+        ]
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for endpoint, stats in endpoints:
+                lines.append(f'calculon_api_requests_total{{{get_labels(endpoint)}}} {stats.count}')
+
+            lines.append('# HELP calculon_api_request_duration_seconds Coinbase Pro REST request latency.')
+            lines.append('# TYPE calculon_api_request_duration_seconds histogram')
+            for endpoint, stats in endpoints:
+                labels = get_labels(endpoint)
+                total = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS, stats.bucket_counts):
+                    total += bucket_count
+                    lines.append(f'calculon_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'calculon_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+                lines.append(f'calculon_api_request_duration_seconds_sum{{{labels}}} {stats.latency_sum}')
+                lines.append(f'calculon_api_request_duration_seconds_count{{{labels}}} {stats.count}')
+
+            for name, help_text, attribute in (
+                    ('calculon_api_rate_limit_wait_seconds_total', 'Seconds waited for the client-side rate limiter.', 'wait_sum'),
+                    ('calculon_api_continuation_pages_total', 'Pages after the first of paginated responses.', 'pages'),
+                    ('calculon_api_retries_total', 'Requests retried after HTTP 429.', 'retries')):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{{get_labels(endpoint)}}} {getattr(stats, attribute)}')
+
+            lines.append('# HELP calculon_api_errors_total Coinbase Pro REST errors, by HTTP status or exception.')
+            lines.append('# TYPE calculon_api_errors_total counter')
+            for endpoint, stats in endpoints:
+                for error, error_count in sorted(stats.errors.items()):
+                    lines.append(f'calculon_api_errors_total{{{get_labels(endpoint)},code="{error}"}} {error_count}')
+        return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the Prometheus text of self.server.metrics on /metrics"""
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        data = self.server.metrics.to_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+#####   Functions   #####
+def get_endpoint(method, url):
+    """Endpoint of a request with the ids taken out, e.g. ('DELETE', '.../orders/8c5a...') -> 'DELETE /orders/{id}'"""
+    parts = []
+    for part in urlparse(url).path.split('/'):
+        if not part:
+            continue
+        if PRODUCT_PATTERN.match(part):
+            part = '{product}'
+        elif ID_PATTERN.match(part):
+            part = '{id}'
+        parts.append(part)
+    return f"{method.upper()} /{'/'.join(parts)}"
+
+def is_continuation_page(url):
+    """True if the request asks for a later page of a paginated response"""
+    return 'after' in parse_qs(urlparse(url).query)
+
+def get_labels(endpoint):
+    method, path = endpoint.split(' ', 1)
+    return f'method="{method}",endpoint="{path}"'
+
+def get_log_dir():
+    """Returns the log/ directory next to this script, creating it if needed"""
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+def write_metrics(metrics, log_dir=None):
+    """Writes log/api_metrics_{script}.prom and appends the JSON summary to log/api_metrics_summary.jsonl"""
+    summary = metrics.to_dict()
+    if not summary['endpoints']:
+        return
+    if log_dir is None:
+        log_dir = get_log_dir()
+    prom_filename = os.path.join(log_dir, f"api_metrics_{metrics.script_name}.prom")
+    # write then rename, so a collector never reads half a file
+    with open(prom_filename + ".tmp", "w") as file1:
+        file1.write(metrics.to_prometheus())
+    os.replace(prom_filename + ".tmp", prom_filename)
+    with open(os.path.join(log_dir, SUMMARY_FILENAME), "a") as file1:
+        file1.write(json.dumps(summary) + "\n")
+
+def start_metrics_server(metrics, port):
+    """Serves metrics on http://127.0.0.1:{port}/metrics from a daemon thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def get_metrics(enabled, port=None):
+    """Returns the ApiMetrics of this process if enabled, else None.
+    The first call registers the exit hook, and starts the HTTP endpoint if port is set.
+    """
+    global _metrics
+    if not enabled:
+        return None
+    with _metrics_lock:
+        if _metrics is None:
+            script_name = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+            _metrics = ApiMetrics(script_name)
+            atexit.register(write_metrics, _metrics)
+            if port:
+                start_metrics_server(_metrics, int(port))
+        return _metrics
+
+def print_summaries(summary_filename, last=20):
+    """Prints the per-endpoint numbers of the last runs in a summary file"""
+    with open(summary_filename, "r") as file1:
+        summaries = [json.loads(line) for line in file1 if line.strip()]
+    for summary in summaries[-last:]:
+        start = time.strftime('%Y %m %d, %H:%M:%S', time.localtime(summary['start']))
+        print(f"{summary['script']} (pid {summary['pid']}) at {start}, {summary['end'] - summary['start']:.1f} s")
+        for endpoint, stats in summary['endpoints'].items():
+            errors = ", ".join(f"{code}: {count}" for code, count in stats['errors'].items())
+            print(f"    {endpoint:<36s} {stats['count']:6d} requests  mean {stats['latency_mean_ms']:8.1f} ms  "
+                  f"p95 < {stats['latency_p95_ms']:8.1f} ms  waited {stats['rate_limit_wait_seconds']:6.2f} s  "
+                  f"pages {stats['continuation_pages']:4d}  retries {stats['retries_429']:3d}  {errors}")
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Prints the API metrics summaries written by the scripts.\nExample:\npython api_metrics.py log/api_metrics_summary.jsonl')
+    parser.add_argument('summary_filename', type=str, nargs='?', default=os.path.join(get_log_dir(), SUMMARY_FILENAME),
+                        help='JSON lines summary file.  Default is log/api_metrics_summary.jsonl')
+    parser.add_argument('--last', type=int, default=20,
+                        help='Number of runs to print.  Default is 20')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    summary_filename = args.summary_filename
+    last = args.last
+
+    return summary_filename, last
+
+
+if __name__ == "__main__":
+    summary_filename, last = parse_args()
+    print_summaries(summary_filename, last)
@@ -0,0 +1,272 @@
+"""backtest.py
+
+Backtests the roberto swing strategy, as run every minute by cron_roberto.py, on historical prices.
+
+Every bar plays one cron_roberto.py run: if the low of the bar reached the buy limit order
+or the high of the bar reached the sell limit order, the order fills (maker fee applied),
+the other order of the pair is canceled, and a new pair is set around the close of the bar
+with roberto.calculate_limit_orders(), the same prices and sizes as roberto.set_limit_orders().
+
+A parameter set runs from fill to fill: the next bar touching either order is found
+with a vectorized search over the lows and highs, so the cost grows with the number of cycles,
+not with the number of bars.  The parameter grid is spread over a process pool.
+
+Prices come from a candles CSV file, with columns time, low, high, open, close, volume
+as returned by get_product_historic_rates(), or from ticks recorded with tick_recorder.py.
+
+Example:
+python backtest.py ETH-USD --candles eth_usd_1m.csv --swing 1 2 5 10 --fiat 0 50 100
+python backtest.py ETH-USD --ticks 2021-11-25 2021-11-26 --swing 0.5 1 2
+"""
+import os
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from roberto import calculate_limit_orders, get_product_decimals
+from tick_recorder import load_ticks
+
+# Coinbase Pro maker fee of the lowest volume tier, as a fraction
+MAKER_FEE = 0.005
+
+# bars searched at once for the next fill, doubled up to MAX_SEARCH_CHUNK while nothing fills
+MIN_SEARCH_CHUNK = 256
+MAX_SEARCH_CHUNK = 65536
+
+# candles shared with the worker processes, set by init_worker()
+_worker_candles = None
+
+###   Functions   ###
+def load_candles_csv(filename):
+    """Reads a candles CSV file with a header and columns time, low, high, open, close, volume.
+
+    Output:
+    -------
+    candles: dict
+        'time' (int64 epoch seconds), 'low', 'high', 'close' (float64) arrays, sorted by time
+    """
+    data = np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
+    order = np.argsort(data[:, 0], kind='stable')
+    data = data[order]
+    return {
+        'time': data[:, 0].astype(np.int64),
+        'low': np.ascontiguousarray(data[:, 1]),
+        'high': np.ascontiguousarray(data[:, 2]),
+        'close': np.ascontiguousarray(data[:, 4]),
+    }
+
+def load_tick_candles(product, date_strings, bar_seconds=60, root_dir=None):
+    """Makes candles of bar_seconds from the ticker ticks recorded with tick_recorder.py.
+    Bars without ticks are left out.
+
+    Output:
+    -------
+    candles: dict
+        same format as load_candles_csv()
+    """
+    tick_days = [load_ticks(product, date_string, 'ticker', root_dir) for date_string in date_strings]
+    times_us = np.concatenate([ticks['time_us'] for ticks in tick_days])
+    prices = np.concatenate([ticks['price'] for ticks in tick_days])
+    order = np.argsort(times_us, kind='stable')
+    times_us = times_us[order]
+    prices = prices[order]
+
+    bars = times_us // (bar_seconds * 1000000)
+    starts = np.flatnonzero(np.r_[True, bars[1:] != bars[:-1]]) if len(bars) else np.empty(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(bars)] - 1
+    return {
+        'time': bars[starts] * bar_seconds,
+        'low': np.minimum.reduceat(prices, starts) if len(starts) else prices,
+        'high': np.maximum.reduceat(prices, starts) if len(starts) else prices,
+        'close': prices[ends],
+    }
+
+def find_next_fill(lows, highs, start, buy_price, sell_price):
+    """Index of the first bar from start with low <= buy_price or high >= sell_price, or -1 if there is none"""
+    num_bars = len(lows)
+    chunk = MIN_SEARCH_CHUNK
+    while start < num_bars:
+        end = min(num_bars, start + chunk)
+        hits = (lows[start:end] <= buy_price) | (highs[start:end] >= sell_price)
+        index = hits.argmax()
+        if hits[index]:
+            return start + index
+        start = end
+        chunk = min(2 * chunk, MAX_SEARCH_CHUNK)
+    return -1
+
+def run_backtest(candles, product, buy_amount_usd, swing_percent, fiat_profits_percent, maker_fee=MAKER_FEE, decimals=None):
+    """Backtests one parameter set.
+    Balances start at 0 USD and 0 crypto, and may go negative, the PnL is marked to the last close.
+
+    Inputs:
+    -------
+    candles: dict
+        see load_candles_csv()
+    product, buy_amount_usd, swing_percent, fiat_profits_percent:
+        as in roberto.set_limit_orders()
+    maker_fee: float
+        fee paid on each filled limit order, as a fraction of its value
+    decimals: tuple
+        (price_decimals, size_decimals) of product, looked up with roberto.get_product_decimals() if None
+
+    Output:
+    -------
+    result: dict
+        parameters, 'cycles', 'buys', 'sells', 'fees', 'usd', 'crypto', 'pnl', and the inventory over time:
+        'fill_bars' (index of the bar of each cycle), 'usd_balances' and 'crypto_balances' after each cycle
+    """
+    lows = candles['low']
+    highs = candles['high']
+    closes = candles['close']
+    swing_size = swing_percent / 100.0
+    ratio_profits_in_fiat = fiat_profits_percent / 100.0
+    if decimals is None:
+        decimals = get_product_decimals(product)
+
+    usd = 0.0
+    crypto = 0.0
+    fees = 0.0
+    buys = 0
+    sells = 0
+    fill_bars = []
+    usd_balances = []
+    crypto_balances = []
+
+    bar = 0
+    while len(closes) > 0:
+        # set a new pair of limit orders around the close, like cron_roberto.py does
+        buy_price, buy_size, sell_price, sell_size = calculate_limit_orders(product, closes[bar], buy_amount_usd,
+                                                                            swing_size, ratio_profits_in_fiat, decimals=decimals)
+        bar = find_next_fill(lows, highs, bar + 1, buy_price, sell_price)
+        if bar < 0:
+            break
+
+        # both orders fill if the bar went through both, the cron run only sees the end of the bar
+        if lows[bar] <= buy_price:
+            value = buy_price * buy_size
+            usd -= value + maker_fee * value
+            fees += maker_fee * value
+            crypto += buy_size
+            buys += 1
+        if highs[bar] >= sell_price:
+            value = sell_price * sell_size
+            usd += value - maker_fee * value
+            fees += maker_fee * value
+            crypto -= sell_size
+            sells += 1
+        fill_bars.append(bar)
+        usd_balances.append(usd)
+        crypto_balances.append(crypto)
+
+    last_price = closes[-1] if len(closes) else 0.0
+    return {
+        'product': product,
+        'buy_amount_usd': buy_amount_usd,
+        'swing_percent': swing_percent,
+        'fiat_profits_percent': fiat_profits_percent,
+        'maker_fee': maker_fee,
+        'cycles': len(fill_bars),
+        'buys': buys,
+        'sells': sells,
+        'fees': fees,
+        'usd': usd,
+        'crypto': crypto,
+        'pnl': usd + crypto * last_price,
+        'fill_bars': np.array(fill_bars, dtype=np.int64),
+        'usd_balances': np.array(usd_balances),
+        'crypto_balances': np.array(crypto_balances),
+    }
+
+def init_worker(candles):
+    """Keeps the candles in the worker process, so they are sent once and not with every parameter set"""
+    global _worker_candles
+    _worker_candles = candles
+
+def run_worker_backtest(params):
+    product, buy_amount_usd, swing_percent, fiat_profits_percent, maker_fee, decimals = params
+    return run_backtest(_worker_candles, product, buy_amount_usd, swing_percent, fiat_profits_percent, maker_fee, decimals)
+
+def run_grid(candles, product, buy_amount_usd, swing_percents, fiat_profits_percents, maker_fee=MAKER_FEE, workers=None, decimals=None):
+    """Backtests every swing_percent x fiat_profits_percent combination on a process pool.
+    The decimals of product are looked up once here if not given, not in every worker.
+
+    Output:
+    -------
+    results: list
+        run_backtest() results, in the order of the grid
+    """
+    if decimals is None:
+        decimals = get_product_decimals(product)
+    grid = [(product, buy_amount_usd, swing_percent, fiat_profits_percent, maker_fee, decimals)
+            for swing_percent, fiat_profits_percent in itertools.product(swing_percents, fiat_profits_percents)]
+    if workers == 1:
+        init_worker(candles)
+        return [run_worker_backtest(params) for params in grid]
+
+    if workers is None:
+        workers = os.cpu_count()
+    chunksize = max(1, len(grid) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(candles,)) as executor:
+        return list(executor.map(run_worker_backtest, grid, chunksize=chunksize))
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Backtests roberto limit orders over a grid of parameters.\nExample:\npython backtest.py ETH-USD --candles eth_usd_1m.csv --swing 1 2 5 10 --fiat 0 50 100')
+    parser.add_argument('product', type=str,
+                        help='Cryptocurrency product to backtest, e.g. ETH-USD')
+    parser.add_argument('--candles', type=str, default=None,
+                        help='CSV file of candles with a header and columns time, low, high, open, close, volume')
+    parser.add_argument('--ticks', type=str, nargs='+', default=None,
+                        help='UTC days of ticks recorded with tick_recorder.py to use instead of --candles, e.g. 2021-11-25')
+    parser.add_argument('--buy_amount_usd', type=float, default=1000.0,
+                        help='Central amount of cryptocurrency to trade.  Default is 1000.0')
+    parser.add_argument('--swing', type=float, nargs='+', default=[1.0, 2.0, 5.0, 10.0],
+                        help='swing_percent values to try.  Default is 1 2 5 10')
+    parser.add_argument('--fiat', type=float, nargs='+', default=[0.0, 50.0, 100.0],
+                        help='fiat_profits_percent values to try.  Default is 0 50 100')
+    parser.add_argument('--fee', type=float, default=100 * MAKER_FEE,
+                        help=f'Maker fee in percent.  Default is {100 * MAKER_FEE}')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes.  Default is the number of CPUs')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    product = args.product
+    candles_filename = args.candles
+    tick_dates = args.ticks
+    buy_amount_usd = args.buy_amount_usd
+    swing_percents = args.swing
+    fiat_profits_percents = args.fiat
+    maker_fee = args.fee / 100.0
+    workers = args.workers
+
+    if candles_filename is None and tick_dates is None:
+        parser.error("one of --candles or --ticks is needed")
+
+    return product, candles_filename, tick_dates, buy_amount_usd, swing_percents, fiat_profits_percents, maker_fee, workers
+
+
+if __name__ == "__main__":
+    product, candles_filename, tick_dates, buy_amount_usd, swing_percents, fiat_profits_percents, maker_fee, workers = parse_args()
+
+    if candles_filename is not None:
+        candles = load_candles_csv(candles_filename)
+    else:
+        candles = load_tick_candles(product, tick_dates)
+    print(f"{len(candles['close'])} bars")
+
+    start = time.perf_counter()
+    results = run_grid(candles, product, buy_amount_usd, swing_percents, fiat_profits_percents, maker_fee, workers)
+    print(f"{len(results)} parameter sets in {time.perf_counter() - start:.2f} s")
+
+    print()
+    print("swing %  fiat %   cycles    buys   sells        fees           pnl     crypto")
+    for result in sorted(results, key=lambda result: result['pnl'], reverse=True):
+        print(f"{result['swing_percent']:7.2f} {result['fiat_profits_percent']:7.1f} {result['cycles']:8d} "
+              f"{result['buys']:7d} {result['sells']:7d} {result['fees']:11.2f} {result['pnl']:13.2f} {result['crypto']:10.4f}")
@@ -0,0 +1,633 @@
+"""benchmarks.py
+
+Times the hot paths of Calculon offline, against synthetic data.
+No Coinbase Pro API access is needed: the cron_roberto.py cycle runs against StubAuthClient,
+and the cron invocations against exchange_simulator.py.
+
+The results are saved as JSON in log/, so that runs can be compared over time with --compare.
+
+Example:
+python benchmarks.py
+python benchmarks.py --sizes 10000 100000 1000000
+python benchmarks.py --only cron_cycle animate --compare log/benchmarks_20211125_225229.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import platform
+import datetime
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+import numpy as np
+import matplotlib
+# no display needed, set before the plotting scripts import matplotlib.pyplot
+matplotlib.use('Agg')
+
+import plot_limits_with_market_data
+import backtest
+import roberto
+import cron_roberto
+import trade_journal
+import check_limit_orders
+import profits_calculator
+import plot_market_data
+import pnl_engine
+from open_orders import OpenOrders
+from order_book import OrderBookClient
+from plot_decimation import MinMaxDecimator
+from tick_buffer import TickBuffer
+from ticker_ingest import TickerIngest
+
+# names of the benchmarks, in the order they run
+BENCHMARKS = ('process_account_history', 'print_filled_orders_info', 'order_partitioning', 'websocket_clients',
+              'animate', 'order_book', 'ticker_ingest', 'cron_cycle', 'cron_invocation', 'backtest', 'pnl')
+
+###   Synthetic fixtures   ###
+def make_synthetic_ledger(num_entries, product="ETH-USD", seed=0):
+    """Makes a list of num_entries fake ledger entries, newest first,
+    in the same dict format as auth_client.get_account_history(account_id).
+    """
+    rng = np.random.default_rng(seed)
+    # microseconds, the resolution of the API timestamps, e.g. '2021-11-25T22:52:29.119195Z'
+    start_us = np.datetime64('2021-01-01T00:00:00', 'us').astype(np.int64)
+    steps_us = rng.integers(1, 600 * 10**6, size=num_entries)
+    created_ats = np.datetime_as_string((start_us + np.cumsum(steps_us)).view('datetime64[us]'))
+    amounts = rng.uniform(-5.0, 5.0, size=num_entries)
+    balances = rng.uniform(0.0, 100.0, size=num_entries)
+    type_choices = np.array(['match', 'fee', 'transfer'])
+    types = type_choices[rng.integers(0, 3, size=num_entries)]
+    product_choices = np.array([product, 'BTC-USD'])
+    product_ids = product_choices[rng.integers(0, 2, size=num_entries)]
+
+    ledger = []
+    for ii in range(num_entries - 1, -1, -1):
+        entry = {
+            'id': str(ii + 1),
+            'created_at': f"{created_ats[ii]}Z",
+            'amount': f"{amounts[ii]:.16f}",
+            'balance': f"{balances[ii]:.16f}",
+            'type': str(types[ii]),
+            'details': {},
+        }
+        if entry['type'] != 'transfer':
+            entry['details'] = {'product_id': str(product_ids[ii])}
+        ledger.append(entry)
+    return ledger
+
+def make_synthetic_level2_messages(num_messages, products=("ETH-USD",), num_levels=5000, seed=0):
+    """Makes a level2 "snapshot" message with num_levels price levels per side for each product,
+    followed by num_messages "l2update" messages spread over the products, mostly close to the top of the book.
+    """
+    rng = np.random.default_rng(seed)
+    mid = 2000.0
+    tick = 0.01
+    snapshots = []
+    for product in products:
+        bids = [[f"{mid - tick * (ii + 1):.2f}", f"{size:.8f}"] for ii, size in enumerate(rng.uniform(0.01, 10.0, num_levels))]
+        asks = [[f"{mid + tick * (ii + 1):.2f}", f"{size:.8f}"] for ii, size in enumerate(rng.uniform(0.01, 10.0, num_levels))]
+        snapshots.append({'type': 'snapshot', 'product_id': product, 'bids': bids, 'asks': asks})
+
+    product_indices = rng.integers(0, len(products), size=num_messages)
+    sides = rng.integers(0, 2, size=num_messages)
+    offsets = np.abs(rng.normal(0.0, 50.0, size=num_messages)).astype(int) + 1
+    sizes = rng.uniform(0.0, 10.0, size=num_messages)
+    sizes[rng.random(num_messages) < 0.3] = 0.0
+    updates = []
+    for ii in range(num_messages):
+        if sides[ii] == 0:
+            side = 'buy'
+            price = mid - tick * offsets[ii]
+        else:
+            side = 'sell'
+            price = mid + tick * offsets[ii]
+        updates.append({
+            'type': 'l2update',
+            'product_id': products[product_indices[ii]],
+            'changes': [[side, f"{price:.2f}", f"{sizes[ii]:.8f}"]],
+        })
+    return snapshots, updates
+
+def make_synthetic_ticker_messages(num_messages, products=("ETH-USD",), seed=0):
+    """Makes num_messages "ticker" messages spread over the products, with one tick every ~10 ms
+    """
+    rng = np.random.default_rng(seed)
+    start_us = np.datetime64('2021-11-25T22:00:00', 'us').astype(np.int64)
+    times = np.datetime_as_string((start_us + np.cumsum(rng.integers(1, 20000, size=num_messages))).astype('datetime64[us]'))
+    prices = 4000.0 + np.cumsum(rng.normal(0.0, 0.5, size=num_messages))
+    sizes = rng.uniform(0.0, 2.0, size=num_messages)
+    product_indices = rng.integers(0, len(products), size=num_messages)
+    messages = []
+    for ii in range(num_messages):
+        messages.append({
+            'type': 'ticker',
+            'sequence': ii,
+            'product_id': products[product_indices[ii]],
+            'price': f"{prices[ii]:.2f}",
+            'side': 'buy',
+            'time': f"{times[ii]}Z",
+            'trade_id': ii,
+            'last_size': f"{sizes[ii]:.8f}",
+        })
+    return messages
+
+def make_synthetic_candles(num_bars, seed=0):
+    """Makes num_bars 1-minute candles of a random walk, in the format of backtest.load_candles_csv()
+    """
+    rng = np.random.default_rng(seed)
+    closes = 2000.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, size=num_bars)))
+    opens = np.r_[closes[0], closes[:-1]]
+    wicks = np.abs(rng.normal(0.0, 0.0005, size=(2, num_bars)))
+    return {
+        'time': 1609459200 + 60 * np.arange(num_bars, dtype=np.int64),
+        'low': np.minimum(opens, closes) * (1 - wicks[0]),
+        'high': np.maximum(opens, closes) * (1 + wicks[1]),
+        'close': closes,
+    }
+
+def make_synthetic_orders(num_orders, product="ETH-USD", seed=0):
+    """Makes num_orders limit orders, half of them done, in the same dict format as auth_client.get_orders()
+    """
+    rng = np.random.default_rng(seed)
+    prices = rng.uniform(1500.0, 2500.0, size=num_orders)
+    sizes = rng.uniform(0.01, 1.0, size=num_orders)
+    sides = np.where(rng.random(num_orders) < 0.5, 'buy', 'sell')
+    statuses = np.where(rng.random(num_orders) < 0.5, 'done', 'open')
+    orders = []
+    for ii in range(num_orders):
+        orders.append({
+            'id': str(uuid.UUID(int=ii)),
+            'price': f"{prices[ii]:.2f}",
+            'size': f"{sizes[ii]:.8f}",
+            'product_id': product,
+            'side': str(sides[ii]),
+            'type': 'limit',
+            'fill_fees': f"{0.005 * prices[ii] * sizes[ii]:.16f}",
+            'executed_value': f"{prices[ii] * sizes[ii]:.16f}",
+            'status': str(statuses[ii]),
+        })
+    return orders
+
+def make_synthetic_fills(num_fills, products=("ETH-USD", "BTC-USD"), seed=0):
+    """Makes num_fills fills of products in time order, in the format of pnl_engine.fills_from_orders()
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.uniform(0.01, 1.0, size=num_fills)
+    prices = rng.uniform(1500.0, 2500.0, size=num_fills)
+    return {
+        'timestamps': np.arange(num_fills, dtype=np.int64) * 1000000000,
+        'products': np.array(products)[rng.integers(0, len(products), size=num_fills)],
+        'sides': np.where(rng.random(num_fills) < 0.5, 1, -1).astype(np.int8),
+        'sizes': sizes,
+        'prices': prices,
+        'fees': 0.005 * prices * sizes,
+    }
+
+def make_synthetic_tick_buffer(num_ticks, seed=0):
+    """Makes a TickBuffer holding num_ticks ticks of a random walk, one every 0.1 s
+    """
+    rng = np.random.default_rng(seed)
+    prices = 2000.0 + np.cumsum(rng.normal(0.0, 0.5, size=num_ticks))
+    ticks = TickBuffer(num_ticks)
+    for ii, price in enumerate(prices.tolist()):
+        ticks.append(0.1 * ii, price)
+    return ticks
+
+
+#####   Classes   #####
+class StubAuthClient:
+    """In-memory stand-in for cbpro.AuthenticatedClient, with just what the cron_roberto.py cycle uses.
+    fill_one_order() makes one open order go away, as if it had been filled.
+    """
+    def __init__(self, price=2000.0):
+        self.price = price
+        self.open_orders = {}
+
+    def get_orders(self, product_id=None, status=None, **kwargs):
+        return iter(list(self.open_orders.values()))
+
+    def get_products(self):
+        return [{'id': 'ETH-USD', 'base_increment': '0.00000001', 'quote_increment': '0.01'}]
+
+    def get_product_order_book(self, product_id, level=1):
+        return {'bids': [[f"{self.price - 0.01:.2f}", "1.0", 1]], 'asks': [[f"{self.price + 0.01:.2f}", "1.0", 1]]}
+
+    def place_limit_order(self, product_id, side, price, size, client_oid=None, **kwargs):
+        order = {'id': str(uuid.uuid4()), 'product_id': product_id, 'side': side, 'price': str(price),
+                 'size': str(size), 'client_oid': client_oid, 'status': 'open', 'type': 'limit'}
+        self.open_orders[order['id']] = order
+        return order
+
+    def cancel_order(self, order_id):
+        self.open_orders.pop(order_id, None)
+        return order_id
+
+    def _send_message(self, method, endpoint, params=None, data=None):
+        return {'message': 'NotFound'}
+
+    def fill_one_order(self):
+        if self.open_orders:
+            self.open_orders.pop(next(iter(self.open_orders)))
+
+
+###   Benchmarks   ###
+def time_call(func, *args, repeat=3):
+    """Calls func(*args) repeat times, returns the best wall time in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def check_ledger_timestamps(ledger):
+    """Checks that the oldest entry of a synthetic ledger parses to the same time
+    through profits_calculator.get_datetime_from_utc() and AccountHistoryBuilder
+    """
+    entry = ledger[-1]
+    expected_ns = np.datetime64(profits_calculator.get_datetime_from_utc(entry['created_at']), 'ns').astype(np.int64)
+    account_history = profits_calculator.process_account_history("ETH-USD", [entry])
+    if account_history['timestamps'][0] != expected_ns:
+        raise ValueError(f"{entry['created_at']} parses to {account_history['timestamps'][0]} ns, not {expected_ns} ns")
+
+def bench_process_account_history(sizes, repeat=3):
+    """Times profits_calculator.process_account_history on synthetic ledgers of each size
+    """
+    results = {}
+    for num_entries in sizes:
+        ledger = make_synthetic_ledger(num_entries)
+        check_ledger_timestamps(ledger)
+        seconds = time_call(profits_calculator.process_account_history, "ETH-USD", ledger, repeat=repeat)
+        results[f"{num_entries}_entries_seconds"] = seconds
+        print(f"process_account_history  {num_entries:>9d} entries  {seconds:8.3f} s  ({1e9 * seconds / num_entries:7.1f} ns/entry)")
+    return results
+
+def bench_print_filled_orders_info(num_orders=100000, repeat=3):
+    """Times profits_calculator.print_filled_orders_info over a large order list, printing to /dev/null
+    """
+    orders = make_synthetic_orders(num_orders)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        seconds = time_call(profits_calculator.print_filled_orders_info, "ETH-USD", orders, repeat=repeat)
+    print(f"print_filled_orders_info  {num_orders:>9d} orders   {seconds:8.3f} s  ({1e6 * seconds / num_orders:7.2f} us/order)")
+    return {f"{num_orders}_orders_seconds": seconds}
+
+def bench_order_partitioning(num_orders=100000, repeat=3):
+    """Times the buy/sell partitioning of plot_limits_with_market_data.get_orders_dict
+    and check_limit_orders.get_limit_order_rows
+    """
+    orders = make_synthetic_orders(num_orders)
+
+    def partition_check_limit_orders():
+        check_limit_orders.get_limit_order_rows(orders, "sell", 2000.0)
+        check_limit_orders.get_limit_order_rows(orders, "buy", 2000.0)
+
+    results = {}
+    for name, func, args in (('get_orders_dict', plot_limits_with_market_data.get_orders_dict, (orders,)),
+                             ('check_limit_orders', partition_check_limit_orders, ())):
+        seconds = time_call(func, *args, repeat=repeat)
+        results[f"{name}_seconds"] = seconds
+        print(f"partition {name:<18s}{num_orders:>9d} orders   {seconds:8.3f} s  ({1e6 * seconds / num_orders:7.2f} us/order)")
+    return results
+
+def bench_websocket_clients(num_messages=200000, repeat=3):
+    """Times the on_message ingest rate of the MyWebsocketClient of each plotting script.
+    stream_market_data.py opens its window when imported, its client uses the same TickerIngest, see bench_ticker_ingest.
+    """
+    messages = make_synthetic_ticker_messages(num_messages)
+    results = {}
+    for module in (plot_market_data, plot_limits_with_market_data):
+        def ingest_all():
+            # no credentials, the clients only need them for the "user" channel
+            ws_client = module.MyWebsocketClient()
+            ws_client.on_open()
+            for msg in messages:
+                ws_client.on_message(msg)
+
+        seconds = time_call(ingest_all, repeat=repeat)
+        results[f"{module.__name__}_msgs_per_second"] = num_messages / seconds
+        print(f"{module.__name__:<26s}{num_messages:>9d} msgs     {seconds:8.3f} s  ({1e6 * seconds / num_messages:7.2f} us/msg, {num_messages / seconds:,.0f} msgs/s)")
+    return results
+
+def bench_animate(sizes=(10000, 1000000), frames=20):
+    """Times one animation frame of each plotting script with sizes ticks buffered:
+    the first animate(), which bins every tick, then animate() alone,
+    and animate() plus drawing the figure with the Agg backend
+    """
+    import matplotlib.pyplot as plt
+
+    results = {}
+    for num_ticks in sizes:
+        ticks = make_synthetic_tick_buffer(num_ticks)
+        for module in (plot_market_data, plot_limits_with_market_data):
+            fig = plt.figure()
+            ax = fig.add_subplot(1, 1, 1)
+            ax.plot([], [], lw=1.5)
+            decimator = MinMaxDecimator(ticks, max_bins=int(ax.bbox.width))
+            fargs = (decimator,)
+            if module is plot_limits_with_market_data:
+                open_orders = OpenOrders()
+                open_orders.load([{'id': str(jj), 'side': side, 'price': price} for jj, (side, price)
+                                  in enumerate((('sell', 2100.0), ('sell', 2200.0), ('buy', 1900.0), ('buy', 1800.0)))])
+                fargs = (decimator, plot_limits_with_market_data.OrderOverlay(ax, open_orders))
+            module.fig = fig
+            module.ax = ax
+
+            start = time.perf_counter()
+            module.animate(0, *fargs)
+            first_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            for frame in range(frames):
+                module.animate(frame, *fargs)
+            animate_seconds = (time.perf_counter() - start) / frames
+            start = time.perf_counter()
+            for frame in range(frames):
+                module.animate(frame, *fargs)
+                fig.canvas.draw()
+            draw_seconds = (time.perf_counter() - start) / frames
+            plt.close(fig)
+
+            results[f"{module.__name__}_{num_ticks}_ticks_first_animate_ms"] = 1000.0 * first_seconds
+            results[f"{module.__name__}_{num_ticks}_ticks_animate_ms"] = 1000.0 * animate_seconds
+            results[f"{module.__name__}_{num_ticks}_ticks_frame_ms"] = 1000.0 * draw_seconds
+            print(f"animate {module.__name__:<30s}{num_ticks:>9d} ticks  {1000.0 * first_seconds:8.3f} ms first  {1000.0 * animate_seconds:8.3f} ms/animate  {1000.0 * draw_seconds:8.3f} ms/frame with draw")
+    return results
+
+def bench_order_book(num_messages=200000, products=("ETH-USD", "BTC-USD", "MATIC-USD"), repeat=3):
+    """Times OrderBookClient.on_message on synthetic level2 snapshot and l2update messages
+    """
+    snapshots, updates = make_synthetic_level2_messages(num_messages, products)
+
+    def apply_all():
+        book_client = OrderBookClient(list(products))
+        for msg in snapshots:
+            book_client.on_message(msg)
+        start = time.perf_counter()
+        for msg in updates:
+            book_client.on_message(msg)
+            book_client.books[msg['product_id']].mid()
+        return time.perf_counter() - start
+
+    seconds = min(apply_all() for _ in range(repeat))
+    print(f"order book l2update       {num_messages:>9d} msgs     {seconds:8.3f} s  ({1e6 * seconds / num_messages:7.2f} us/msg, {num_messages / seconds:,.0f} msgs/s)")
+    return {'l2update_msgs_per_second': num_messages / seconds}
+
+def bench_ticker_ingest(num_messages=200000, products=("ETH-USD", "BTC-USD", "MATIC-USD"), repeat=3):
+    """Times TickerIngest.on_message on synthetic ticker messages,
+    against the old per-tick datetime.strptime() path, and with the TickQueue handoff of stream_market_data.py
+    """
+    messages = make_synthetic_ticker_messages(num_messages, products)
+
+    def strptime_all():
+        start_datetime = None
+        for msg in messages:
+            temp_datetime = datetime.datetime.strptime(msg['time'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            if start_datetime is None:
+                start_datetime = temp_datetime
+            (temp_datetime - start_datetime).total_seconds(), float(msg['price'])
+
+    def ingest_all():
+        ingest = TickerIngest(list(products), capacity=num_messages)
+        for msg in messages:
+            ingest.on_message(msg)
+
+    def ingest_queue_all():
+        # stream_market_data.py path: ticks also go on a TickQueue, drained in batches like every redraw
+        ingest = TickerIngest(list(products), capacity=num_messages, queue_capacity=65536)
+        for start in range(0, num_messages, 1000):
+            for msg in messages[start:start + 1000]:
+                ingest.on_message(msg)
+            for tick_queue in ingest.queues.values():
+                tick_queue.drain()
+
+    results = {}
+    for name, func in (('strptime', strptime_all), ('TickerIngest', ingest_all), ('TickQueue', ingest_queue_all)):
+        seconds = time_call(func, repeat=repeat)
+        results[f"{name}_msgs_per_second"] = num_messages / seconds
+        print(f"ticker ingest {name:<12s}{num_messages:>9d} msgs     {seconds:8.3f} s  ({1e6 * seconds / num_messages:7.2f} us/msg, {num_messages / seconds:,.0f} msgs/s)")
+    return results
+
+def bench_cron_cycle(num_cycles=500):
+    """Times the full cron_roberto.py cycle, check_if_limits_executed -> set_limit_orders -> record_new_limit_orders,
+    with one order of the pair filled before every cycle, against StubAuthClient
+    """
+    stub_client = StubAuthClient()
+    patched_modules = (roberto, cron_roberto)
+    saved = [module.get_auth_client for module in patched_modules]
+    saved_public_client = roberto.get_public_client
+    for module in patched_modules:
+        module.get_auth_client = lambda *args: stub_client
+    roberto.get_public_client = lambda *args: stub_client
+    try:
+        with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            # first cycle sets the pair, not timed
+            cron_roberto.run_roberto_cycle("ETH-USD", 1000.0, 5.0, 100.0, log_dir, True)
+            trade_journal.flush_all()
+            start = time.perf_counter()
+            for _ in range(num_cycles):
+                stub_client.fill_one_order()
+                if not cron_roberto.run_roberto_cycle("ETH-USD", 1000.0, 5.0, 100.0, log_dir, True):
+                    raise RuntimeError("cron_roberto cycle did not set new limit orders")
+                # the journal write of a cron_roberto.py run
+                trade_journal.flush_all()
+            seconds = time.perf_counter() - start
+    finally:
+        for module, get_auth_client in zip(patched_modules, saved):
+            module.get_auth_client = get_auth_client
+        roberto.get_public_client = saved_public_client
+
+    print(f"cron_roberto cycle        {num_cycles:>9d} cycles   {seconds:8.3f} s  ({1000.0 * seconds / num_cycles:7.3f} ms/cycle)")
+    return {'cycle_ms': 1000.0 * seconds / num_cycles}
+
+def bench_cron_invocation(runs=10):
+    """Times one cron run of cron_roberto.py with nothing to do, the usual case:
+    a fresh interpreter running cron_roberto.py, against cron_roberto_client.py forwarding it to a warm roberto_worker.py.
+    CPU time is user + system time of the invoked processes, plus the time the worker reports for each request.
+    Runs against an ExchangeSimulator, from a copy of the scripts in a temporary directory, so log/ is left alone.
+    """
+    from exchange_simulator import ExchangeSimulator
+    from cron_roberto_client import send_request
+
+    simulator = ExchangeSimulator(port=0, products=("ETH-USD",))
+    simulator.start()
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for filename in os.listdir(script_dir):
+            if filename.endswith('.py'):
+                shutil.copy(os.path.join(script_dir, filename), temp_dir)
+        with open(os.path.join(temp_dir, '.env'), 'w') as file1:
+            file1.write(f"API_KEY=bench\nAPI_SECRET=c2ltdWxhdG9y\nPASSPHRASE=bench\nAPI_URL={simulator.api_url}\n")
+        cron_args = ["ETH-USD", "1000.0", "5.0", "100.0", "-q"]
+
+        def run(script):
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script] + cron_args, cwd=temp_dir, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wall_seconds = time.perf_counter() - start
+            new_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu_seconds = new_usage.ru_utime - usage.ru_utime + new_usage.ru_stime - usage.ru_stime
+            return wall_seconds, cpu_seconds
+
+        # the first run places the pair of limit orders, the next ones find nothing to do
+        run('cron_roberto.py')
+        timings = {'cron_roberto': [run('cron_roberto.py') for _ in range(runs)]}
+
+        worker = subprocess.Popen([sys.executable, 'roberto_worker.py', '--keepalive', '0'], cwd=temp_dir,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            worker.stdout.readline()
+            socket_path = os.path.join(temp_dir, 'log', 'cron_roberto.sock')
+            run('cron_roberto_client.py')
+            worker_cpu_seconds = send_request({'command': 'stats'}, socket_path)['cpu_seconds']
+            client_timings = [run('cron_roberto_client.py') for _ in range(runs)]
+            worker_cpu_seconds = (send_request({'command': 'stats'}, socket_path)['cpu_seconds'] - worker_cpu_seconds) / runs
+            timings['client_and_worker'] = [(wall_seconds, cpu_seconds + worker_cpu_seconds) for wall_seconds, cpu_seconds in client_timings]
+        finally:
+            worker.terminate()
+            worker.wait()
+    simulator.stop()
+
+    for name, name_timings in timings.items():
+        wall_ms = 1000.0 * float(np.median([wall_seconds for wall_seconds, cpu_seconds in name_timings]))
+        cpu_ms = 1000.0 * float(np.median([cpu_seconds for wall_seconds, cpu_seconds in name_timings]))
+        results[f"{name}_wall_ms"] = wall_ms
+        results[f"{name}_cpu_ms"] = cpu_ms
+        print(f"cron invocation {name:<18s}{runs:>5d} runs  {wall_ms:8.1f} ms wall  {cpu_ms:8.1f} ms CPU per run")
+    return results
+
+def bench_backtest(num_bars=525600, num_swings=20, num_fiats=5, workers=None):
+    """Times backtest.run_grid on a year of synthetic 1-minute candles
+    """
+    candles = make_synthetic_candles(num_bars)
+    swing_percents = np.linspace(0.5, 10.0, num_swings).tolist()
+    fiat_profits_percents = np.linspace(0.0, 100.0, num_fiats).tolist()
+    start = time.perf_counter()
+    results = backtest.run_grid(candles, "ETH-USD", 1000.0, swing_percents, fiat_profits_percents, workers=workers,
+                                decimals=roberto.KNOWN_PRODUCT_DECIMALS["ETH-USD"])
+    seconds = time.perf_counter() - start
+    num_cycles = sum(result['cycles'] for result in results)
+    print(f"backtest grid             {len(results):>9d} sets     {seconds:8.3f} s  ({num_bars} bars, {num_cycles} cycles)")
+    return {f"{len(results)}_sets_{num_bars}_bars_seconds": seconds}
+
+def bench_pnl(sizes, products=("ETH-USD", "BTC-USD"), repeat=3):
+    """Times pnl_engine.compute_pnl_by_product on synthetic fills of each size, with both cost methods
+    """
+    results = {}
+    current_prices = {product: 2000.0 for product in products}
+    for num_fills in sizes:
+        fills = make_synthetic_fills(num_fills, products)
+        for method in pnl_engine.METHODS:
+            seconds = time_call(pnl_engine.compute_pnl_by_product, fills, current_prices, method, repeat=repeat)
+            results[f"{num_fills}_fills_{method}_seconds"] = seconds
+            print(f"pnl {method:<8s}             {num_fills:>9d} fills    {seconds:8.3f} s  ({1e9 * seconds / num_fills:7.1f} ns/fill)")
+    return results
+
+def get_git_commit():
+    """Current git commit of the repo, or None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(names, sizes, repeat=3):
+    """Runs the benchmarks in names, see BENCHMARKS.
+
+    Output:
+    -------
+    results: dict
+        benchmark name -> {metric name: value}
+    """
+    benchmark_calls = {
+        'process_account_history': lambda: bench_process_account_history(sizes, repeat=repeat),
+        'print_filled_orders_info': lambda: bench_print_filled_orders_info(repeat=repeat),
+        'order_partitioning': lambda: bench_order_partitioning(repeat=repeat),
+        'websocket_clients': lambda: bench_websocket_clients(repeat=repeat),
+        'animate': lambda: bench_animate(),
+        'order_book': lambda: bench_order_book(repeat=repeat),
+        'ticker_ingest': lambda: bench_ticker_ingest(repeat=repeat),
+        'cron_cycle': lambda: bench_cron_cycle(),
+        'cron_invocation': lambda: bench_cron_invocation(),
+        'backtest': lambda: bench_backtest(),
+        'pnl': lambda: bench_pnl(sizes, repeat=repeat),
+    }
+    results = {}
+    for name in BENCHMARKS:
+        if name in names:
+            results[name] = benchmark_calls[name]()
+    return results
+
+def save_results(results, output_filename):
+    """Saves results as JSON, with the time, git commit and machine they come from"""
+    run = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output_dir = os.path.dirname(output_filename)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output_filename, "w") as file1:
+        json.dump(run, file1, indent=2)
+    return run
+
+def print_comparison(results, old_filename):
+    """Prints each metric next to the same metric of an older run saved by save_results()"""
+    with open(old_filename, "r") as file1:
+        old_run = json.load(file1)
+    print()
+    print(f"compared to {old_filename} ({old_run.get('timestamp')}, commit {old_run.get('git_commit')})")
+    for name, metrics in results.items():
+        old_metrics = old_run['results'].get(name, {})
+        for metric, value in metrics.items():
+            old_value = old_metrics.get(metric)
+            if old_value:
+                print(f"{name:<26s}{metric:<58s}{old_value:14.4g} -> {value:14.4g}  ({value / old_value:6.2f}x)")
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Times the hot paths of Calculon against synthetic data.\nExample:\npython benchmarks.py --sizes 10000 100000 1000000')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Number of synthetic ledger entries to benchmark with.  Default is 10000 100000 1000000')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times each benchmark is repeated, the best time is kept.  Default is 3')
+    parser.add_argument('--only', type=str, nargs='+', default=list(BENCHMARKS), choices=BENCHMARKS,
+                        help='Benchmarks to run.  Default is all of them')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON file to save the results to.  Default is log/benchmarks_{date}_{time}.json')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='JSON file of an older run to compare the results with')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    sizes = args.sizes
+    repeat = args.repeat
+    names = args.only
+    output_filename = args.output
+    compare_filename = args.compare
+
+    if output_filename is None:
+        log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')
+        output_filename = os.path.join(log_dir, f"benchmarks_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+    return sizes, repeat, names, output_filename, compare_filename
+
+
+if __name__ == "__main__":
+    sizes, repeat, names, output_filename, compare_filename = parse_args()
+    results = run_benchmarks(names, sizes, repeat=repeat)
+    save_results(results, output_filename)
+    print(f"results saved to {output_filename}")
+    if compare_filename is not None:
+        print_comparison(results, compare_filename)
@@ -0,0 +1,155 @@
+"""cbpro_client.py
+
+One place to build the Coinbase Pro API clients used by all the scripts.
+
+The .env credentials are read once per process, and there is one AuthenticatedClient per API key.
+Each client keeps a pooled keep-alive HTTP session, so repeated requests reuse the same TLS connection.
+The sessions are rate limited with rate_limiter.py, sharing one budget per API key across processes.
+
+The REST and websocket base URLs can be pointed somewhere else, e.g. at exchange_simulator.py,
+with API_URL and WEBSOCKET_URL in the .env file, or the CBPRO_API_URL and CBPRO_WEBSOCKET_URL
+environment variables, which take precedence.
+
+Per-endpoint latency and error metrics (see api_metrics.py) are recorded with METRICS=1
+in the .env file or the CBPRO_METRICS=1 environment variable, and served over HTTP with METRICS_PORT.
+
+Example:
+from cbpro_client import get_auth_client
+auth_client = get_auth_client()
+"""
+import os
+import hashlib
+import threading
+
+import cbpro
+import requests
+from dotenv import dotenv_values
+
+import api_metrics
+import rate_limiter
+
+# If cron can't find .env, put the full path here, e.g. "/home/ethereum/Calculon/.env"
+DEFAULT_ENV_FILE = ".env"
+
+# Coinbase Pro base URLs
+DEFAULT_API_URL = "https://api.pro.coinbase.com"
+DEFAULT_WEBSOCKET_URL = "wss://ws-feed.pro.coinbase.com"
+
+# connection pool sizes of the shared HTTP session
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+_configs = {}
+_auth_clients = {}
+_public_client = None
+_public_scheduler = None
+_lock = threading.Lock()
+
+###   Functions   ###
+def load_config(env_file=DEFAULT_ENV_FILE):
+    """Reads the API credentials in env_file, only the first time it is asked for.
+
+    Input:
+    ------
+    env_file: str
+        Path to the .env file with API_KEY, API_SECRET and PASSPHRASE
+
+    Output:
+    -------
+    config: dict
+        the key/value pairs in env_file
+    """
+    with _lock:
+        if env_file not in _configs:
+            _configs[env_file] = dotenv_values(env_file)
+        return _configs[env_file]
+
+def get_api_url(env_file=DEFAULT_ENV_FILE):
+    """REST base URL: the CBPRO_API_URL environment variable, else API_URL in env_file, else Coinbase Pro"""
+    return os.environ.get('CBPRO_API_URL') or load_config(env_file).get('API_URL') or DEFAULT_API_URL
+
+def get_websocket_url(env_file=DEFAULT_ENV_FILE):
+    """Websocket feed URL: the CBPRO_WEBSOCKET_URL environment variable, else WEBSOCKET_URL in env_file, else Coinbase Pro"""
+    return os.environ.get('CBPRO_WEBSOCKET_URL') or load_config(env_file).get('WEBSOCKET_URL') or DEFAULT_WEBSOCKET_URL
+
+def get_metrics(env_file=DEFAULT_ENV_FILE):
+    """The api_metrics.ApiMetrics of this process if METRICS is set, like get_api_url(), else None"""
+    config = load_config(env_file)
+    enabled = os.environ.get('CBPRO_METRICS') or config.get('METRICS')
+    port = os.environ.get('CBPRO_METRICS_PORT') or config.get('METRICS_PORT')
+    return api_metrics.get_metrics(enabled not in (None, '', '0'), port)
+
+def get_public_scheduler():
+    """Returns the rate limiter of the public endpoints, shared by every session of every process.
+    Call with _lock held.
+    """
+    global _public_scheduler
+    if _public_scheduler is None:
+        _public_scheduler = rate_limiter.make_scheduler(rate_limiter.PUBLIC_RATE, rate_limiter.PUBLIC_BURST, "public")
+    return _public_scheduler
+
+def make_private_scheduler(key):
+    """Makes the rate limiter of the private endpoints of API key,
+    shared by every process using the same key.
+    """
+    # don't put the API key itself in the file name
+    key_hash = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return rate_limiter.make_scheduler(rate_limiter.PRIVATE_RATE, rate_limiter.PRIVATE_BURST, f"private_{key_hash}")
+
+def make_session(private_scheduler=None, metrics=None):
+    """Makes a requests.Session with a connection pool,
+    so that connections are kept alive and shared between requests and threads.
+    All the requests wait for the rate limiters before being sent, and are recorded in metrics if given.
+    Call with _lock held.
+    """
+    public_scheduler = get_public_scheduler()
+    if private_scheduler is None:
+        private_scheduler = public_scheduler
+
+    session = requests.Session()
+    adapter = rate_limiter.ThrottledAdapter(public_scheduler, private_scheduler, metrics=metrics,
+                                            pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_auth_client(env_file=DEFAULT_ENV_FILE):
+    """Returns the process-wide AuthenticatedClient for the API key in env_file,
+    creating it on the first call.
+
+    Input:
+    ------
+    env_file: str
+        Path to the .env file with API_KEY, API_SECRET and PASSPHRASE
+
+    Output:
+    -------
+    auth_client: cbpro.AuthenticatedClient
+        authenticated Coinbase Pro client shared by every caller using the same API key
+    """
+    config = load_config(env_file)
+    key = config['API_KEY']
+    b64secret = config['API_SECRET']
+    passphrase = config['PASSPHRASE']
+    api_url = get_api_url(env_file)
+    metrics = get_metrics(env_file)
+
+    with _lock:
+        auth_client = _auth_clients.get(key)
+        if auth_client is None:
+            auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase, api_url=api_url)
+            auth_client.session = make_session(make_private_scheduler(key), metrics)
+            _auth_clients[key] = auth_client
+    return auth_client
+
+def get_public_client():
+    """Returns the process-wide PublicClient, creating it on the first call.
+    """
+    global _public_client
+    api_url = get_api_url()
+    metrics = get_metrics()
+    with _lock:
+        if _public_client is None:
+            _public_client = cbpro.PublicClient(api_url=api_url)
+            _public_client.session = make_session(metrics=metrics)
+    return _public_client
@@ -10,59 +10,65 @@ BUYSELL = PRODUCT.split("-")
 BUY = BUYSELL[0]
 SELL = BUYSELL[1]
 
-import cbpro
-from dotenv import dotenv_values
+from cbpro_client import get_auth_client
+from roberto import get_mid_price
 
-# initialize API
-config = dotenv_values(".env")
-key = config['API_KEY']
-b64secret = config['API_SECRET']
-passphrase = config['PASSPHRASE']
-auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+###   Functions   ###
+def get_limit_order_rows(list_orders, side, current_price):
+    """Picks out the limit orders on side, 'buy' or 'sell', and their distance to current_price.
 
-# Get user limit orders
-orders = auth_client.get_orders()
-list_orders = list(orders)
-for order in list_orders:
-    print(order)
+    Output:
+    -------
+    rows: list
+        (price, size, diff, percent_diff) of each order, in the order of list_orders
+    """
+    rows = []
+    for order in list_orders:
+        if order["side"] == side:
+            temp_size = float(order["size"]) 
+            temp_price = round(float(order["price"]), 2)
+            temp_diff = round(temp_price - current_price, 2)
+            temp_percent_diff = 100 * temp_diff / current_price
+            rows.append((temp_price, temp_size, temp_diff, temp_percent_diff))
+    return rows
 
-# retrieve current price
-order_book = auth_client.get_product_order_book(PRODUCT)
-current_bid = float(order_book['bids'][0][0])
-current_ask = float(order_book['asks'][0][0])
-current_price = round((current_bid + current_ask) / 2, 2)
-
-print("\033[92m")
-print("Limit Sells")
-print("===========")
-print(" Sell price    Sell size")
-print("\033[0m", end="")
-for order in list_orders:
-    if order["side"] == "sell":
-        temp_size = float(order["size"]) 
-        temp_price = round(float(order["price"]), 2)
-        temp_size_price = round(temp_size * temp_price, 2)
-        temp_diff = round(temp_price - current_price, 2)
-        temp_percent_diff = 100 * temp_diff / current_price
+def print_limit_orders(list_orders, current_price):
+    """Prints the limit sells, the current price, and the limit buys"""
+    print("\033[92m")
+    print("Limit Sells")
+    print("===========")
+    print(" Sell price    Sell size")
+    print("\033[0m", end="")
+    for temp_price, temp_size, temp_diff, temp_percent_diff in get_limit_order_rows(list_orders, "sell", current_price):
         print(f"{temp_price:7.2f} {SELL}  {temp_size:7f} {BUY}  (\033[92m +{temp_diff} \033[0m) (\033[92m {temp_percent_diff:.1f} % \033[0m)")
 
-print("\033[96m")
-print("Current Price")
-print("=============")
-print("\033[0m", end="")
-print(f"{current_price} USD")
+    print("\033[96m")
+    print("Current Price")
+    print("=============")
+    print("\033[0m", end="")
+    print(f"{current_price} USD")
 
-print("\033[91m")
-print("Limit Buys")
-print("==========")
-print("  Buy price     Buy size")
-print("\033[0m", end="")
-for order in list_orders:
-    if order["side"] == "buy":
-        temp_size = float(order["size"]) 
-        temp_price = round(float(order["price"]), 2)
-        temp_size_price = round(temp_size * temp_price, 2)
-        temp_diff = round(temp_price - current_price, 2)
-        temp_percent_diff = 100 * temp_diff / current_price
+    print("\033[91m")
+    print("Limit Buys")
+    print("==========")
+    print("  Buy price     Buy size")
+    print("\033[0m", end="")
+    for temp_price, temp_size, temp_diff, temp_percent_diff in get_limit_order_rows(list_orders, "buy", current_price):
         print(f"{temp_price:7.2f} {SELL}  {temp_size:7f} {BUY}  (\033[91m {temp_diff} \033[0m) (\033[91m {temp_percent_diff:.1f} % \033[0m)")
-print()
\ No newline at end of file
+    print()
+
+
+if __name__ == "__main__":
+    # initialize API
+    auth_client = get_auth_client()
+
+    # Get user limit orders
+    orders = auth_client.get_orders()
+    list_orders = list(orders)
+    for order in list_orders:
+        print(order)
+
+    # retrieve current price
+    current_price = round(get_mid_price(auth_client, PRODUCT), 2)
+
+    print_limit_orders(list_orders, current_price)
@@ -1,15 +1,15 @@
 import os
-import time
-import cbpro
-from dotenv import dotenv_values
 import argparse
 
-from roberto import set_limit_orders
+from roberto import set_limit_orders, set_ladder_orders, cancel_leg, SPACINGS, SIZE_RULES
+from cbpro_client import get_auth_client
+import order_state
+import trade_journal
 
-def parse_args():
-    """Parses the user command line arguments
+def parse_args(argv=None):
+    """Parses the user command line arguments, or argv if given, e.g. when forwarded by cron_roberto_client.py
     """
-    parser = argparse.ArgumentParser(description='Automatically sets up a pair of limit orders for the chosen cryptocurrency product on Coinbase Pro. Checks to make sure the limit orders did or did not go off. If one did, sets up a new pair.\nExample:\npython cron_roberto.py ETH-USD 1000.0 5.0')
+    parser = argparse.ArgumentParser(prog='cron_roberto.py', description='Automatically sets up a pair of limit orders for the chosen cryptocurrency product on Coinbase Pro. Checks to make sure the limit orders did or did not go off. If one did, sets up a new pair.\nExample:\npython cron_roberto.py ETH-USD 1000.0 5.0')
     parser.add_argument('product', type=str, 
                         help='Cryptocurrency product to buy, e.g. ETH-USD, BTC-USD, MATIC-USD')
     parser.add_argument('buy_amount_usd', type=float, 
@@ -18,16 +18,25 @@ def parse_args():
                         help='Percent to set limit orders above and below.  Must be between 0 and 100.  Default is 5.0')
     parser.add_argument('fiat_profits_percent', type=float, default=100.0,
                         help='Percent of profits to keep in fiat.  Must be between 0 and 100.  Default is 100.0')
+    parser.add_argument('--levels', type=int, default=1,
+                        help='Number of limit orders on each side.  If more than 1, keeps a ladder of orders and re-arms each level on its own.  Default is 1')
+    parser.add_argument('--spacing', type=str, default='linear', choices=SPACINGS,
+                        help='Ladder spacing, see roberto.py.  Default is linear')
+    parser.add_argument('--size-rule', type=str, default='equal', choices=SIZE_RULES,
+                        help='Ladder sizes, see roberto.py.  Default is equal')
     parser.add_argument('--quiet', '-q', action='store_true',
                         help='Flag.  If set, runs code in quiet mode.')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Don't use namespaces
     product = args.product
     buy_amount_usd = args.buy_amount_usd
     swing_percent = args.swing_percent
     fiat_profits_percent = args.fiat_profits_percent
+    levels = args.levels
+    spacing = args.spacing
+    size_rule = args.size_rule
     quiet = args.quiet
 
     if not quiet:
@@ -35,28 +44,36 @@ def parse_args():
         print(f"buy_amount_usd       = {buy_amount_usd}")
         print(f"swing_percent        = {swing_percent}")
         print(f"fiat_profits_percent = {fiat_profits_percent}")
+        print(f"levels               = {levels}")
+        print(f"spacing              = {spacing}")
+        print(f"size_rule            = {size_rule}")
         print(f"quiet                = {quiet}")
 
-    return product, buy_amount_usd, swing_percent, fiat_profits_percent, quiet
+    return product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, quiet
 
-def get_list_of_order_ids(product):
+def get_open_orders():
+    """Simple function which gets all open orders, for every product, from Coinbase pro API."""
+    # initialize
+    auth_client = get_auth_client()
+
+    orders = auth_client.get_orders()
+    return list(orders)
+
+def get_list_of_order_ids(product, open_orders=None):
     """Simple function which gets all open limit orders from Coinbase pro API.
 
     Input:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    open_orders: list
+        Open orders already fetched with get_open_orders(), shared between products.
+        If None, they are fetched from the API.
     """
-    # initialize
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
-
     # get the current order ids
-    orders = auth_client.get_orders()
-    list_orders = list(orders)
+    if open_orders is None:
+        open_orders = get_open_orders()
+    list_orders = open_orders
     current_order_ids = []
     for order in list_orders:
         if order['product_id'] == product:
@@ -65,70 +82,81 @@ def get_list_of_order_ids(product):
     return current_order_ids
 
 def cancel_order_by_id(order_id):
-    """Simple function which cancels an order by it's order id"""
+    """Simple function which cancels an order by it's order id.
+    Returns True if the exchange confirmed the cancel.
+    """
     # initialize
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+    auth_client = get_auth_client()
 
     # cancel order
-    auth_client.cancel_order(order_id)
+    return cancel_leg(auth_client, {'id': order_id, 'side': 'other'})
 
-    return
+def read_current_order_ids(product, log_dir):
+    """Reads the order ids of the live pair of product in the order state store, see order_state.py.
+    Returns None if no pair of product was ever stored, or an empty list if there is no live pair.
+    """
+    open_pairs = order_state.get_open_pairs(product, log_dir)
+    if open_pairs is None:
+        return None
+    if 0 not in open_pairs:
+        return []
+    return [order_id for order_id in open_pairs[0] if order_id is not None]
+
+def clear_current_order_ids(product, log_dir):
+    """Marks the live pair of product done,
+    so a new pair can be recorded later in record_new_limit_orders()
+    """
+    order_state.close_pairs(product, log_dir, levels=[0])
 
-def check_if_limits_executed(product, log_dir, quiet):
+def check_if_limits_executed(product, log_dir, quiet, open_orders=None):
     """Function which checks if any of our two limit orders have executed 
     since the last time this script was run.
-    It checks by looking at the order ids in the file current_order_ids.txt,
+    It checks by looking at the order ids of the live pair in the order state store,
     and comparing to the current active orders.
     If any have executed, they'll be gone from the active orders,
     and we'll return True.
-    If no file containing the current orders exists, 
-    we will create new orders and populate it, so we'll return True.
+    If no pair is stored, 
+    we will create new orders and record them, so we'll return True.
 
     Input:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    open_orders: list
+        Open orders already fetched with get_open_orders().  If None, they are fetched from the API.
     """
     # create boolean which will be returned by this func
     should_new_orders_be_created = False
 
-    # put order ids in .txt file that will be checked each time cron runs
-    product_underscore = product.replace('-', '_')
-    cron_filename = os.path.join(log_dir, f"current_order_ids_{product_underscore}.txt")
-
-    # read in contents of cron_filename to get old order ids, if the file exists and is not empty
-    if os.path.exists(cron_filename):
-        if not os.stat(cron_filename).st_size == 0:
-            with open(cron_filename, "r") as file1:
-                temp_order_ids = file1.readlines()
-            old_order_ids = []
-            for order_id in temp_order_ids:
-                old_order_ids.append(order_id.strip('\n'))
-        else:
+    # order ids checked each time cron runs
+    state_filename = order_state.get_db_path(log_dir)
+
+    # get the old order ids, if a pair was stored and is live
+    old_order_ids = read_current_order_ids(product, log_dir)
+    if old_order_ids is not None:
+        if not old_order_ids:
             print()
-            print(f"File is empty: cron_filename = {cron_filename} ")
-            print(f"Creating file with order ids for next time this script is called.")
+            print(f"No live pair of {product} in {state_filename}")
+            print(f"Recording the new order ids for next time this script is called.")
             print()
 
             return True
 
-    else: # if no file is found, return True to create new set of orders
+    else: # if no pair was ever stored, return True to create new set of orders
         print()
-        print(f"File not found: cron_filename = {cron_filename} ")
-        print(f"Creating file with order ids for next time this script is called.")
+        print(f"No pair of {product} stored yet in {state_filename}")
+        print(f"Recording the new order ids for next time this script is called.")
         print()
 
         return True # new orders should be created
 
     # get list of current order ids
-    current_order_ids = get_list_of_order_ids(product)
+    current_order_ids = get_list_of_order_ids(product, open_orders)
 
-    # compare the order ids by checking if old_order_ids is a subset of current_order_ids
-    if set(old_order_ids).issubset(current_order_ids):
+    # compare the order ids by checking if old_order_ids is a subset of current_order_ids.
+    # A half pair, left by a cancel which failed in roberto.keep_complete_pair(), always counts as gone off,
+    # so its open order is canceled now.
+    if len(old_order_ids) == 2 and set(old_order_ids).issubset(current_order_ids):
         if not quiet:
             print()
             print("The old_order_ids ids list is contained in current_order_ids")
@@ -141,26 +169,32 @@ def check_if_limits_executed(product, log_dir, quiet):
             print("The old_order_ids ids list is *not* contained in current_order_ids")
             print("One order went off, or was otherwise canceled")
             print()
-        for order_id in set(old_order_ids).intersection(current_order_ids): # get intersection or order_id lists, should just be one order_id
+        canceled_order_ids = sorted(set(old_order_ids).intersection(current_order_ids))
+        for order_id in canceled_order_ids: # get intersection or order_id lists, should just be one order_id
             if not quiet:
                 print(f"Canceling the other order of the pair: order id = {order_id}")
-            cancel_order_by_id(order_id)
+            if not cancel_order_by_id(order_id):
+                # keep the pair stored, the next run tries the cancel again
+                print(f"Could not cancel order id = {order_id}, no new orders until it is canceled")
+                return False
+        trade_journal.get_journal(log_dir).write('pair_done', product, old_order_ids, level=0,
+                                                 done=sorted(set(old_order_ids) - set(canceled_order_ids)),
+                                                 canceled=canceled_order_ids)
         if not quiet:
             print("Cancel succeeded")
             print()
 
         should_new_orders_be_created = True
 
-        # overwrite old list of order ids, 
-        # so we can append new order ids later in record_new_limit_orders()
-        with open(cron_filename, "w") as file1:
-            file1.write(f"")
+        # mark the old pair done,
+        # so we can record the new order ids later in record_new_limit_orders()
+        clear_current_order_ids(product, log_dir)
 
     return should_new_orders_be_created
 
 def record_new_limit_orders(product, buy_order, sell_order, log_dir):
-    """Simple function which appends time of new limit orders to the end of limit_orders_record.txt,
-    and records all the new limit order ids in the current_order_ids_{product}.txt.
+    """Simple function which records the new limit orders as a pair_placed record of the trade journal,
+    and records the new limit order ids as the live pair of product in the order state store.
 
     Inputs:
     ------
@@ -171,87 +205,242 @@ def record_new_limit_orders(product, buy_order, sell_order, log_dir):
     sell_order: dict
         limit order sell Coinbase pro API information
     """
-    product_split = product.split('-')
-    product_bought = product_split[0]
-    product_sold = product_split[1]
-
-    # file to store when limit orders created
-    product_underscore = product.replace('-', '_')
-    record_filename = os.path.join(log_dir, f"limit_orders_record_{product_underscore}.txt")
-
-    buy_succeeded = True
-    sell_succeeded = True
-    with open(record_filename, "a") as file1:
-        file1.write(f"\n\nNew limit orders creation attempt at {time.strftime('%Y %m %d, %H:%M:%S') }\n")
-
-        if 'message' in buy_order:
-            file1.write(f"\nbuy error: {buy_order['message']}\n")
-            buy_succeeded = False
-        else:
-            file1.write(f"\nLimit buy:\n")
-            file1.write(f"Price: {buy_order['price']}\n")
-            file1.write(f"Size: {buy_order['size']} {product_bought} ({float(buy_order['price']) * float(buy_order['size'])} {product_sold})\n")
-            file1.write(f"ID: {buy_order['id']}\n")
-
-        if 'message' in sell_order:
-            file1.write(f"\nsell error: {sell_order['message']}\n")
-            sell_succeeded = False
-        else:
-            file1.write(f"\nLimit sell:\n")
-            file1.write(f"Price: {sell_order['price']}\n")
-            file1.write(f"Size: {sell_order['size']} {product_bought}  ({float(sell_order['price']) * float(sell_order['size'])} {product_sold})\n")
-            file1.write(f"ID: {sell_order['id']}\n")
-
-    # append new order ids to .txt
-    cron_filename = os.path.join(log_dir, f"current_order_ids_{product_underscore}.txt")
-    with open(cron_filename, "a") as file1:
-        if buy_succeeded:
-            file1.write(f"{buy_order['id']}\n")
-        if sell_succeeded:
-            file1.write(f"{sell_order['id']}\n")
+    buy_succeeded = 'message' not in buy_order
+    sell_succeeded = 'message' not in sell_order
+    buy_id = buy_order['id'] if buy_succeeded else None
+    sell_id = sell_order['id'] if sell_succeeded else None
+
+    trade_journal.get_journal(log_dir).write('pair_placed', product, [order_id for order_id in (buy_id, sell_id) if order_id],
+                                             level=0, buy=trade_journal.get_order_record(buy_order),
+                                             sell=trade_journal.get_order_record(sell_order))
+
+    # record the new order ids, in one transaction
+    if buy_succeeded or sell_succeeded:
+        order_state.record_pair(product, buy_id, sell_id, log_dir)
+
+    return
+
+def read_ladder_order_ids(product, log_dir):
+    """Reads the live ladder pairs of product in the order state store.
+    Returns None if no pair of product was ever stored.
+
+    Output:
+    -------
+    ladder_order_ids: dict
+        level -> (buy_id, sell_id)
+    """
+    open_pairs = order_state.get_open_pairs(product, log_dir)
+    if open_pairs is None:
+        return None
+    return {level: order_ids for level, order_ids in open_pairs.items() if level > 0}
+
+def write_ladder_order_ids(product, ladder_order_ids, log_dir):
+    """Makes ladder_order_ids the live ladder pairs of product:
+    the other live levels are marked done, and the new pairs are recorded
+    """
+    old_ladder_order_ids = read_ladder_order_ids(product, log_dir) or {}
+    order_state.close_pairs(product, log_dir, [level for level, order_ids in old_ladder_order_ids.items()
+                                               if ladder_order_ids.get(level) != order_ids])
+    for level, (buy_id, sell_id) in sorted(ladder_order_ids.items()):
+        if old_ladder_order_ids.get(level) != (buy_id, sell_id):
+            order_state.record_pair(product, buy_id, sell_id, log_dir, level)
+
+def check_ladder_levels_executed(product, levels, log_dir, quiet, open_orders=None):
+    """Ladder version of check_if_limits_executed().
+    Checks every level of the ladder on its own: if one of its two orders is gone from the open orders,
+    cancels the other one and marks the level to be re-armed.
+    The other levels are left alone.
+
+    Output:
+    -------
+    levels_to_arm: list
+        ladder levels which need a new pair of limit orders
+    """
+    ladder_order_ids = read_ladder_order_ids(product, log_dir)
+    if ladder_order_ids is None:
+        print()
+        print(f"No ladder of {product} stored yet in {order_state.get_db_path(log_dir)}")
+        print(f"Recording the new order ids for next time this script is called.")
+        print()
+        return list(range(1, levels + 1))
+
+    # get list of current order ids
+    current_order_ids = set(get_list_of_order_ids(product, open_orders))
+
+    levels_to_arm = []
+    live_ladder_order_ids = {}
+    for level, (buy_id, sell_id) in ladder_order_ids.items():
+        if level <= levels and buy_id in current_order_ids and sell_id in current_order_ids:
+            live_ladder_order_ids[level] = (buy_id, sell_id)
+            continue
+
+        if not quiet:
+            print(f"Level {level}: one order went off, or was otherwise canceled")
+        # a half pair has one None id, see roberto.keep_complete_pair()
+        pair_ids = {order_id for order_id in (buy_id, sell_id) if order_id is not None}
+        canceled_order_ids = sorted(pair_ids.intersection(current_order_ids))
+        cancels_failed = False
+        for order_id in canceled_order_ids:
+            if not quiet:
+                print(f"Canceling the other order of level {level}: order id = {order_id}")
+            if not cancel_order_by_id(order_id):
+                cancels_failed = True
+        if cancels_failed:
+            # keep the level stored, the next run tries the cancel again
+            print(f"Level {level}: could not cancel its open orders, not re-arming it yet")
+            live_ladder_order_ids[level] = (buy_id, sell_id)
+            continue
+        trade_journal.get_journal(log_dir).write('pair_done', product, sorted(pair_ids), level=level,
+                                                 done=sorted(pair_ids - set(canceled_order_ids)),
+                                                 canceled=canceled_order_ids)
+
+    for level in range(1, levels + 1):
+        if level not in live_ladder_order_ids:
+            levels_to_arm.append(level)
+
+    write_ladder_order_ids(product, live_ladder_order_ids, log_dir)
+
+    return levels_to_arm
+
+def record_new_ladder_orders(product, placed_levels, log_dir):
+    """Ladder version of record_new_limit_orders().
+    Records the new limit orders of every level as pair_placed records of the trade journal,
+    and records their ids as the live pairs of their levels in the order state store.
+    """
+    journal = trade_journal.get_journal(log_dir)
+    for level, (buy_order, sell_order) in sorted(placed_levels.items()):
+        # a level can be a half pair, see roberto.keep_complete_pair()
+        buy_id = buy_order.get('id') if 'message' not in buy_order else None
+        sell_id = sell_order.get('id') if 'message' not in sell_order else None
+        journal.write('pair_placed', product, [order_id for order_id in (buy_id, sell_id) if order_id], level=level,
+                      buy=trade_journal.get_order_record(buy_order), sell=trade_journal.get_order_record(sell_order))
+        order_state.record_pair(product, buy_id, sell_id, log_dir, level)
+
+    return
+
+def record_failed_limit_orders(product, log_dir):
+    """Simple function which records a failed attempt to create new limit orders in the trade journal
+
+    Inputs:
+    ------
+    product: str
+        Cryptocurrency product set limit orders on 
+    """
+    trade_journal.get_journal(log_dir).write('placement_failed', product)
 
     return
 
 def record_failure(product, log_dir):
-    """Simple function which appends time attempt to create new limit orders in failure_log_{product}.txt
+    """Simple function which records a run which set no new limit orders in the trade journal
 
     Inputs:
     ------
     product: str
         Cryptocurrency product set limit orders on 
     """
-    # file to store when limit orders created
-    product_underscore = product.replace('-', '_')
-    record_filename = os.path.join(log_dir, f"failure_log_{product_underscore}.txt")
-    with open(record_filename, "a") as file1:
-        file1.write(f"No new limit orders set at {time.strftime('%Y %m %d, %H:%M:%S') }\n")
+    trade_journal.get_journal(log_dir).write('no_new_orders', product)
 
     return
 
-if __name__ == "__main__":
-    # First, make sure a log/ directory exists
+def get_log_dir():
+    """Returns the log/ directory next to this script, creating it if needed"""
     log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
-
-    # In this case, we don't want to ask for user input     
-    # because we want to use cron to run this script every minute
-    yes = True
-    product, buy_amount_usd, swing_percent, fiat_profits_percent, quiet = parse_args()
-    # If limit orders have been executed, 
-    # we want to create new ones using roberto.set_limit_orders() function
-    if check_if_limits_executed(product, log_dir, quiet):
+    return log_dir
+
+def run_roberto_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet, open_orders=None):
+    """One run of cron_roberto.py.
+    If limit orders have been executed, creates new ones using roberto.set_limit_orders(),
+    otherwise records the failure to set new limit orders.
+    open_orders can be passed in to share one get_open_orders() call between products.
+
+    Output:
+    -------
+    new_orders_set: bool
+        True if a new pair of limit orders was set
+    """
+    # a run which overlaps a slow previous run of the same product leaves it alone
+    with order_state.product_lock(product, log_dir) as locked:
+        if not locked:
+            print(f"Another run is handling {product}, exiting.")
+            return False
+
+        # In this case, we don't want to ask for user input     
+        # because we want to use cron to run this script every minute
+        yes = True
+
+        # If limit orders have been executed, 
+        # we want to create new ones using roberto.set_limit_orders() function
+        if check_if_limits_executed(product, log_dir, quiet, open_orders):
         
-        # use roberto.set_limit_orders function
-        buy_order, sell_order = set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet)
+            # use roberto.set_limit_orders function, which places both orders or none
+            limit_orders = set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet)
+            if limit_orders is None:
+                # no live pair is stored, so the next run tries again
+                record_failed_limit_orders(product, log_dir)
+                return False
+            buy_order, sell_order = limit_orders
+
+            # record the new limit orders in the order state store
+            record_new_limit_orders(product, buy_order, sell_order, log_dir)
+
+            if not quiet:
+                print()
+                print("cron_roberto.py is done setting new limit orders!")
+                print()
+
+            return True
+
+        else:
+            record_failure(product, log_dir)
+
+            return False
+
+def run_ladder_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, log_dir, quiet, open_orders=None):
+    """Ladder version of run_roberto_cycle().
+    Re-arms only the ladder levels which went off, using roberto.set_ladder_orders().
+
+    Output:
+    -------
+    new_orders_set: bool
+        True if at least one level got a new pair of limit orders
+    """
+    # a run which overlaps a slow previous run of the same product leaves it alone
+    with order_state.product_lock(product, log_dir) as locked:
+        if not locked:
+            print(f"Another run is handling {product}, exiting.")
+            return False
+
+        yes = True
+
+        levels_to_arm = check_ladder_levels_executed(product, levels, log_dir, quiet, open_orders)
+        if not levels_to_arm:
+            record_failure(product, log_dir)
+            return False
+
+        placed_levels = set_ladder_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet,
+                                          levels, spacing, size_rule, only_levels=levels_to_arm)
+        if placed_levels is None:
+            # the levels stay out of the order state store, so the next run tries again
+            record_failed_limit_orders(product, log_dir)
+            return False
 
-        # record the new limit orders in the .txt file
-        record_new_limit_orders(product, buy_order, sell_order, log_dir)
+        record_new_ladder_orders(product, placed_levels, log_dir)
 
         if not quiet:
             print()
-            print("cron_roberto.py is done setting new limit orders!")
+            print(f"cron_roberto.py is done setting new limit orders on levels {sorted(placed_levels)}!")
             print()
 
+        return True
+
+if __name__ == "__main__":
+    # First, make sure a log/ directory exists
+    log_dir = get_log_dir()
+
+    product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, quiet = parse_args()
+    if levels > 1:
+        run_ladder_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, log_dir, quiet)
     else:
-        record_failure(product, log_dir)
\ No newline at end of file
+        run_roberto_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet)
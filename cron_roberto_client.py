@@ -0,0 +1,62 @@
+"""cron_roberto_client.py
+
+Thin cron entry point for cron_roberto.py.
+
+Starting Python, importing cbpro and requests, reading .env and opening a TLS connection
+cost more than the usual cron_roberto.py check, which finds nothing to do.
+This script only imports the standard library: it forwards its command line to the resident worker
+started with roberto_worker.py, over a Unix socket, prints the output of the run and exits with its exit code.
+If no worker is listening, it runs cron_roberto.py itself, so cron keeps working when the worker is down.
+
+Example, in the crontab, with the worker started once with python roberto_worker.py:
+* * * * * cd /home/ethereum/Calculon && python cron_roberto_client.py ETH-USD 1000.0 5.0 100.0 -q
+"""
+import os
+import sys
+import json
+import socket
+
+SOCKET_FILENAME = "cron_roberto.sock"
+
+# seconds to wait for the worker to answer, a cycle placing orders takes a few seconds
+TIMEOUT = 300.0
+
+###   Functions   ###
+def get_socket_path():
+    """Returns the path of the worker socket, log/cron_roberto.sock next to this script"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log', SOCKET_FILENAME)
+
+def send_request(request, socket_path=None, timeout=TIMEOUT):
+    """Sends one JSON request to the worker and returns its JSON response.
+    Raises OSError if no worker is listening on socket_path.
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        data = b"".join(iter(lambda: sock.recv(65536), b""))
+    return json.loads(data)
+
+def run_locally(argv):
+    """Replaces this process with cron_roberto.py, when no worker is listening"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cron_roberto.py')
+    os.execv(sys.executable, [sys.executable, script] + argv)
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        response = send_request({'argv': argv})
+    except (FileNotFoundError, ConnectionRefusedError):
+        # no worker, run cron_roberto.py here instead
+        run_locally(argv)
+    except (OSError, ValueError) as e:
+        # the worker got the request but did not answer, don't run the cycle a second time
+        print(f"No answer from the cron_roberto worker: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(response['output'])
+    sys.stdout.flush()
+    sys.exit(response['exit_code'])
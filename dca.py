@@ -1,17 +1,12 @@
 BUY_AMOUNT_USD = '20.00'
 PRODUCT = "ETH-USD"
 
-import cbpro
-from dotenv import dotenv_values
 import time
 import pprint
 
-config = dotenv_values(".env")
-key = config['API_KEY']
-b64secret = config['API_SECRET']
-passphrase = config['PASSPHRASE']
+from cbpro_client import get_auth_client
 
-auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+auth_client = get_auth_client()
 
 # transfer in enough USD
 payment_methods = auth_client.get_payment_methods()
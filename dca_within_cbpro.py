@@ -2,52 +2,45 @@ BUY_AMOUNT_USD = '25.00'
 PRODUCT = "ETH-USD"
 
 import os
-import cbpro
-from dotenv import dotenv_values
 import time
 import pprint
 
+from cbpro_client import get_auth_client
+import trade_journal
+
 def record_start(product, log_dir):
-    """Simple function which appends time attempt to create new market orders in dca_within_cbpro_log.txt
+    """Simple function which records an attempt to create new market orders in the trade journal
 
     Inputs:
     ------
     product: str
         Cryptocurrency product set limit orders on 
     """
-    # file to store when limit orders created
-    product_underscore = product.replace('-', '_')
-    record_filename = os.path.join(log_dir, f"dca_within_cbpro_log.txt")
-    with open(record_filename, "a") as file1:
-        file1.write(f"dca_within_cbpro.py run for {product_underscore} at {time.strftime('%Y %m %d, %H:%M:%S') }\n")
+    trade_journal.get_journal(log_dir).write('dca_start', product)
 
-def record_success(product, log_dir):
-    """Simple function which appends time attempt to create new market orders in dca_within_cbpro_log.txt
+def record_success(product, log_dir, order):
+    """Simple function which records the new market order in the trade journal
 
     Inputs:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    order: dict
+        market order Coinbase pro API information
     """
-    # file to store when limit orders created
-    product_underscore = product.replace('-', '_')
-    record_filename = os.path.join(log_dir, f"dca_within_cbpro_log.txt")
-    with open(record_filename, "a") as file1:
-        file1.write(f"DCA succeeded for {product_underscore} at {time.strftime('%Y %m %d, %H:%M:%S') }\n")
+    trade_journal.get_journal(log_dir).write('dca_succeeded', product, [order['id']], order=order)
 
-def record_failure(product, log_dir):
-    """Simple function which appends time attempt to create new market orders in dca_within_cbpro_log.txt
+def record_failure(product, log_dir, order):
+    """Simple function which records a failed attempt to create new market orders in the trade journal
 
     Inputs:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    order: dict
+        Coinbase pro API error of the last attempt
     """
-    # file to store when limit orders created
-    product_underscore = product.replace('-', '_')
-    record_filename = os.path.join(log_dir, f"dca_within_cbpro_log.txt")
-    with open(record_filename, "a") as file1:
-        file1.write(f"DCA failed for {product_underscore} at {time.strftime('%Y %m %d, %H:%M:%S') }\n")
+    trade_journal.get_journal(log_dir).write('dca_failed', product, error=order.get('message'))
 
 # First, make sure a log/ directory exists
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')
@@ -56,12 +49,7 @@ if not os.path.exists(log_dir):
 
 record_start(PRODUCT, log_dir)
 
-config = dotenv_values(".env_default")
-key = config['API_KEY']
-b64secret = config['API_SECRET']
-passphrase = config['PASSPHRASE']
-
-auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+auth_client = get_auth_client(".env_default")
 
 # # transfer in enough USD
 # payment_methods = auth_client.get_payment_methods()
@@ -103,6 +91,6 @@ while(buy_made == False and attempts < max_attempts):
 pprint.pprint(result2)
 
 if buy_made:
-    record_success(PRODUCT, log_dir)
+    record_success(PRODUCT, log_dir, result2)
 else:
-    record_failure(PRODUCT, log_dir)
\ No newline at end of file
+    record_failure(PRODUCT, log_dir, result2)
\ No newline at end of file
@@ -0,0 +1,1231 @@
+"""exchange_simulator.py
+
+Local stand-in for the Coinbase Pro REST API and websocket feed, for load testing without the real exchange.
+
+One port serves both the REST subset used by the scripts (orders, order book, accounts and ledgers,
+fills, deposits) and the websocket feed with the "ticker", "matches", "level2" and "user" channels.
+Orders go through a price-time priority matching engine.  A market maker quotes every product
+around a scripted price path (a random walk, or the closes of a candles CSV file), so resting limit
+orders fill when the price moves through them.  Latency and rate limits are configurable.
+
+Point the scripts at it with API_URL and WEBSOCKET_URL in .env (see cbpro_client.py), e.g.
+API_URL=http://127.0.0.1:8900
+WEBSOCKET_URL=ws://127.0.0.1:8900
+Any API key is accepted, each key gets its own simulated accounts.
+The signatures are not checked, but API_SECRET must be valid base64 for cbpro to sign, e.g. c2ltdWxhdG9y
+
+Examples:
+python exchange_simulator.py --products ETH-USD BTC-USD --latency-ms 50
+python exchange_simulator.py --load-test 5000 --clients 8
+"""
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import datetime
+import threading
+import itertools
+import queue
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import cbpro
+import requests
+import numpy as np
+from sortedcontainers import SortedDict
+
+from rate_limiter import PRIVATE_BURST, PRIVATE_RATE, PUBLIC_BURST, PUBLIC_RATE, TokenBucket, is_public_endpoint
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8900
+
+PRODUCTS = ("ETH-USD", "BTC-USD", "MATIC-USD")
+START_PRICES = {"ETH-USD": 2000.0, "BTC-USD": 30000.0, "MATIC-USD": 1.0}
+DEFAULT_START_PRICE = 100.0
+
+MAKER_FEE = 0.005
+TAKER_FEE = 0.005
+
+# every API key starts with this much USD, and this much USD worth of each cryptocurrency
+STARTING_BALANCE_USD = 1000000.0
+
+# the market maker quotes QUOTE_LEVELS levels per side, QUOTE_SIZE_USD each,
+# the first HALF_SPREAD away from the price and then every LEVEL_SPACING
+MARKET_MAKER_KEY = "market-maker"
+QUOTE_LEVELS = 5
+QUOTE_SIZE_USD = 100000.0
+HALF_SPREAD = 0.0005
+LEVEL_SPACING = 0.001
+
+# the price path moves every STEP_SECONDS, by VOLATILITY (standard deviation of the log return) per step
+STEP_SECONDS = 1.0
+VOLATILITY = 0.001
+
+# page size of the paginated endpoints, like Coinbase Pro
+PAGE_LIMIT = 100
+# price levels per side in get_product_order_book(level=2)
+BOOK_LEVEL2_DEPTH = 50
+
+SIZE_EPSILON = 1e-12
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# base64 API secret used by the load test clients
+LOAD_TEST_SECRET = base64.b64encode(b"simulator").decode()
+
+###   Functions   ###
+def get_utc_now_string():
+    """Current UTC time like '2021-11-25T22:52:29.119195Z'"""
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def format_amount(amount):
+    return f"{amount:.16f}"
+
+def format_size(size):
+    return f"{size:.8f}"
+
+def format_price(price):
+    return f"{price:.2f}"
+
+def order_to_api(order):
+    """Order information in the format of the Coinbase Pro API, without the internal '_' keys"""
+    api_order = {key: value for key, value in order.items() if not key.startswith('_')}
+    api_order['filled_size'] = format_size(order['_filled_size'])
+    api_order['executed_value'] = format_amount(order['_executed_value'])
+    api_order['fill_fees'] = format_amount(order['_fill_fees'])
+    return api_order
+
+def read_websocket_frame(rfile):
+    """Reads one client websocket frame.
+
+    Output:
+    -------
+    opcode, payload: int, bytes
+        opcode is None if the connection was closed
+    """
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None, b''
+    opcode = header[0] & 0x0F
+    length = header[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(rfile.read(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(rfile.read(8), 'big')
+    mask = rfile.read(4) if header[1] & 0x80 else None
+    payload = rfile.read(length)
+    if mask is not None:
+        payload = (np.frombuffer(payload, dtype=np.uint8) ^ np.resize(np.frombuffer(mask, dtype=np.uint8), length)).tobytes()
+    return opcode, payload
+
+def make_websocket_frame(opcode, payload):
+    """Makes one unmasked, final websocket frame"""
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, 'big')
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, 'big')
+    return header + payload
+
+def paginate_newest_first(items, get_cursor, before=None, after=None, limit=PAGE_LIMIT):
+    """One page of items, which are sorted oldest first, returned newest first like the Coinbase Pro API.
+    after gives the items older than the cursor, before the items newer than the cursor.
+
+    Output:
+    -------
+    page, cb_after: list, str
+        cb_after is the cursor of the next (older) page, None on the last page
+    """
+    if after is not None:
+        items = [item for item in items if get_cursor(item) < int(after)]
+    if before is not None:
+        items = [item for item in items if get_cursor(item) > int(before)]
+        page = items[:limit][::-1]
+        return page, None
+    page = items[::-1][:limit]
+    cb_after = None
+    if len(items) > limit:
+        cb_after = str(get_cursor(page[-1]))
+    return page, cb_after
+
+def make_page_headers(cb_after):
+    if cb_after is None:
+        return None
+    return {'cb-after': cb_after}
+
+def run_load_test(api_url, num_orders, num_clients=8, product="ETH-USD"):
+    """Places and cancels num_orders limit orders against the simulator at api_url,
+    from num_clients threads with one API key each.  Every tenth order is a market order instead.
+    The clients are not rate limited on our side.
+
+    Output:
+    -------
+    stats: dict
+        'orders', 'requests', 'seconds', 'orders_per_second', 'requests_per_second',
+        and the request latencies in ms: 'latency_p50_ms', 'latency_p99_ms'
+    """
+    def run_client(client_index, client_orders):
+        auth_client = cbpro.AuthenticatedClient(f"load-test-{client_index}", LOAD_TEST_SECRET, "simulator", api_url=api_url)
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        auth_client.session = session
+        rng = random.Random(client_index)
+        price = float(auth_client.get_product_ticker(product)['price'])
+        latencies = []
+        for ii in range(client_orders):
+            start = time.perf_counter()
+            if ii % 10 == 9:
+                auth_client.place_market_order(product_id=product, side=rng.choice(('buy', 'sell')), size=0.001)
+                latencies.append(time.perf_counter() - start)
+                continue
+            side = rng.choice(('buy', 'sell'))
+            offset = 0.02 + 0.02 * rng.random()
+            order_price = round(price * (1 - offset if side == 'buy' else 1 + offset), 2)
+            order = auth_client.place_limit_order(product_id=product, side=side, price=order_price, size=0.01)
+            latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            auth_client.cancel_order(order['id'])
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    orders_per_client = [num_orders // num_clients + (1 if ii < num_orders % num_clients else 0) for ii in range(num_clients)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_clients) as executor:
+        latencies = list(itertools.chain.from_iterable(executor.map(run_client, range(num_clients), orders_per_client)))
+    seconds = time.perf_counter() - start
+
+    latencies_ms = 1000.0 * np.array(latencies)
+    return {
+        'orders': num_orders,
+        'requests': len(latencies),
+        'seconds': seconds,
+        'orders_per_second': num_orders / seconds,
+        'requests_per_second': len(latencies) / seconds,
+        'latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+        'latency_p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Runs a local Coinbase Pro REST and websocket simulator with a matching engine.\nExample:\npython exchange_simulator.py --products ETH-USD BTC-USD --latency-ms 50')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST,
+                        help=f'Address to listen on.  Default is {DEFAULT_HOST}')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port of both the REST API and the websocket feed.  Default is {DEFAULT_PORT}')
+    parser.add_argument('--products', type=str, nargs='+', default=list(PRODUCTS),
+                        help=f'Products to trade.  Default is {" ".join(PRODUCTS)}')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='Added latency of every REST request, in milliseconds.  Default is 0.0')
+    parser.add_argument('--jitter-ms', type=float, default=0.0,
+                        help='Random extra latency of up to this many milliseconds.  Default is 0.0')
+    parser.add_argument('--public-rate', type=float, default=PUBLIC_RATE,
+                        help=f'Public requests per second per client address.  Default is {PUBLIC_RATE}')
+    parser.add_argument('--public-burst', type=int, default=PUBLIC_BURST,
+                        help=f'Public request burst.  Default is {PUBLIC_BURST}')
+    parser.add_argument('--private-rate', type=float, default=PRIVATE_RATE,
+                        help=f'Private requests per second per API key.  Default is {PRIVATE_RATE}')
+    parser.add_argument('--private-burst', type=int, default=PRIVATE_BURST,
+                        help=f'Private request burst.  Default is {PRIVATE_BURST}')
+    parser.add_argument('--no-rate-limit', action='store_true',
+                        help='Flag.  If set, requests are never answered with 429 Too Many Requests.')
+    parser.add_argument('--step-seconds', type=float, default=STEP_SECONDS,
+                        help=f'Seconds between two steps of the price path.  Default is {STEP_SECONDS}')
+    parser.add_argument('--volatility', type=float, default=VOLATILITY,
+                        help=f'Standard deviation of the log return of one step.  Default is {VOLATILITY}')
+    parser.add_argument('--prices-csv', type=str, default=None,
+                        help='Candles CSV file (see backtest.py) whose closes are used as the price path, scaled to each product')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random walk.  Default is 0')
+    parser.add_argument('--load-test', type=int, default=None,
+                        help='Runs a load test with this many orders against an in-process simulator, then exits')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='Number of concurrent load test clients.  Default is 8')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Flag.  If set, logs every request.')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    host = args.host
+    port = args.port
+    products = args.products
+    latency = args.latency_ms / 1000.0
+    jitter = args.jitter_ms / 1000.0
+    rate_limits = None
+    if not args.no_rate_limit:
+        rate_limits = (args.public_rate, args.public_burst, args.private_rate, args.private_burst)
+    step_seconds = args.step_seconds
+    volatility = args.volatility
+    prices_csv = args.prices_csv
+    seed = args.seed
+    load_test = args.load_test
+    clients = args.clients
+    verbose = args.verbose
+
+    return (host, port, products, latency, jitter, rate_limits, step_seconds, volatility, prices_csv, seed,
+            load_test, clients, verbose)
+
+
+#####   Classes   #####
+class SimulatorError(Exception):
+    """Error answered to the client as {"message": ...} with an HTTP status"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Profile:
+    """Simulated accounts, ledgers and fills of one API key"""
+    def __init__(self, key, products, start_prices, unlimited=False):
+        self.key = key
+        self.id = str(uuid.uuid4())
+        # the market maker never runs out of money and keeps no history
+        self.unlimited = unlimited
+        self.accounts = {}
+        self.ledgers = {}
+        self.fills = []
+        self.get_account('USD')['balance'] = STARTING_BALANCE_USD
+        for product in products:
+            base_currency = product.split('-')[0]
+            self.get_account(base_currency)['balance'] = STARTING_BALANCE_USD / start_prices[product]
+
+    def get_account(self, currency):
+        account = self.accounts.get(currency)
+        if account is None:
+            account = {'id': str(uuid.uuid4()), 'currency': currency, 'balance': 0.0, 'hold': 0.0}
+            self.accounts[currency] = account
+            self.ledgers[account['id']] = []
+        return account
+
+    def get_account_by_id(self, account_id):
+        for account in self.accounts.values():
+            if account['id'] == account_id:
+                return account
+        raise SimulatorError(404, "NotFound")
+
+    def get_available(self, currency):
+        if self.unlimited:
+            return float('inf')
+        account = self.get_account(currency)
+        return account['balance'] - account['hold']
+
+    def add_entry(self, entry_id, currency, amount, entry_type, details):
+        """Changes a balance and appends the ledger entry"""
+        account = self.get_account(currency)
+        account['balance'] += amount
+        if self.unlimited:
+            return
+        self.ledgers[account['id']].append({
+            'id': str(entry_id),
+            'created_at': get_utc_now_string(),
+            'amount': format_amount(amount),
+            'balance': format_amount(account['balance']),
+            'type': entry_type,
+            'details': details,
+        })
+
+    def account_to_api(self, account):
+        return {
+            'id': account['id'],
+            'currency': account['currency'],
+            'balance': format_amount(account['balance']),
+            'available': format_amount(account['balance'] - account['hold']),
+            'hold': format_amount(account['hold']),
+            'profile_id': self.id,
+            'trading_enabled': True,
+        }
+
+class SimBook:
+    """Resting limit orders of one product, price -> deque of orders in time priority,
+    with the total size of each price level kept up to date.
+    """
+    def __init__(self, product):
+        self.product = product
+        self.bids = SortedDict()
+        self.asks = SortedDict()
+        self.bid_sizes = {}
+        self.ask_sizes = {}
+        self.sequence = 0
+
+    def get_side(self, side):
+        if side == 'buy':
+            return self.bids, self.bid_sizes
+        return self.asks, self.ask_sizes
+
+    def add(self, order):
+        levels, sizes = self.get_side(order['side'])
+        price = order['_price']
+        if price not in levels:
+            levels[price] = deque()
+            sizes[price] = 0.0
+        levels[price].append(order)
+        sizes[price] += order['_remaining']
+
+    def remove(self, order):
+        levels, sizes = self.get_side(order['side'])
+        price = order['_price']
+        level = levels[price]
+        level.remove(order)
+        sizes[price] -= order['_remaining']
+        if not level:
+            del levels[price]
+            del sizes[price]
+
+    def best_bid(self):
+        return self.bids.peekitem(-1)[0] if self.bids else None
+
+    def best_ask(self):
+        return self.asks.peekitem(0)[0] if self.asks else None
+
+    def level_size(self, side, price):
+        sizes = self.bid_sizes if side == 'buy' else self.ask_sizes
+        return max(0.0, sizes.get(price, 0.0))
+
+    def next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+class FeedConnection:
+    """One websocket client of the feed.
+    Messages are put on a queue by the matching engine and written by the connection thread,
+    so a slow client never holds up the engine.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.channels = set()
+        self.products = set()
+        self.key = None
+        self.messages = queue.SimpleQueue()
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def wants(self, channel, product):
+        return channel in self.channels and product in self.products
+
+    def put(self, msg):
+        self.messages.put(msg)
+
+    def send_frame(self, opcode, payload):
+        with self.send_lock:
+            self.sock.sendall(make_websocket_frame(opcode, payload))
+
+    def close(self):
+        self.closed = True
+        self.messages.put(None)
+
+class MatchingEngine:
+    """Price-time priority matching of the limit and market orders of every API key.
+    One lock protects everything, so the engine behaves like a single-threaded exchange.
+    """
+    def __init__(self, products, start_prices, maker_fee=MAKER_FEE, taker_fee=TAKER_FEE):
+        self.products = list(products)
+        self.start_prices = dict(start_prices)
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.lock = threading.RLock()
+        self.books = {product: SimBook(product) for product in self.products}
+        self.last_trades = {}
+        self.orders = {}
+        self.client_oids = {}
+        self.profiles = {}
+        self.feeds = []
+        self.order_seq = itertools.count(1)
+        self.trade_ids = itertools.count(1)
+        self.entry_ids = itertools.count(1)
+        self.order_count = 0
+        self.trade_count = 0
+        # level-2 changes of the operation in progress, (product, side, price)
+        self._changed_levels = set()
+
+    ###   accounts   ###
+    def get_profile(self, key):
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = Profile(key, self.products, self.start_prices, unlimited=(key == MARKET_MAKER_KEY))
+            self.profiles[key] = profile
+        return profile
+
+    def get_accounts(self, key):
+        with self.lock:
+            profile = self.get_profile(key)
+            return [profile.account_to_api(account) for account in profile.accounts.values()]
+
+    def get_account(self, key, account_id):
+        with self.lock:
+            profile = self.get_profile(key)
+            return profile.account_to_api(profile.get_account_by_id(account_id))
+
+    def get_account_history(self, key, account_id, before=None, after=None, limit=PAGE_LIMIT):
+        """Ledger entries newest first, paginated like Coinbase Pro.
+
+        Output:
+        -------
+        entries, cb_after: list, str
+            cb_after is the cursor of the next page, None on the last page
+        """
+        with self.lock:
+            profile = self.get_profile(key)
+            profile.get_account_by_id(account_id)
+            ledger = profile.ledgers[account_id]
+            return paginate_newest_first(ledger, lambda entry: int(entry['id']), before, after, limit)
+
+    def deposit(self, key, amount, currency):
+        with self.lock:
+            profile = self.get_profile(key)
+            transfer_id = str(uuid.uuid4())
+            profile.add_entry(next(self.entry_ids), currency, amount, 'transfer',
+                              {'transfer_id': transfer_id, 'transfer_type': 'deposit'})
+            return {'id': transfer_id, 'amount': format_amount(amount), 'currency': currency,
+                    'payout_at': get_utc_now_string()}
+
+    def get_fills(self, key, product_id=None, order_id=None, before=None, after=None, limit=PAGE_LIMIT):
+        with self.lock:
+            fills = [fill for fill in self.get_profile(key).fills
+                     if (product_id is None or fill['product_id'] == product_id)
+                     and (order_id is None or fill['order_id'] == order_id)]
+            return paginate_newest_first(fills, lambda fill: fill['trade_id'], before, after, limit)
+
+    ###   orders   ###
+    def place_order(self, key, params):
+        """Places a limit or market order, matching it against the book.
+
+        Output:
+        -------
+        order: dict
+            order information in the format of the Coinbase Pro API
+        """
+        product_id = params.get('product_id')
+        side = params.get('side')
+        order_type = params.get('type', 'limit')
+        client_oid = params.get('client_oid')
+        if product_id not in self.books:
+            raise SimulatorError(400, "Product not found")
+        if side not in ('buy', 'sell'):
+            raise SimulatorError(400, "side must be buy or sell")
+        if order_type not in ('limit', 'market'):
+            raise SimulatorError(400, "type must be limit or market")
+        base_currency, quote_currency = product_id.split('-')
+
+        try:
+            price = round(float(params['price']), 2) if order_type == 'limit' else None
+            size = float(params['size']) if params.get('size') is not None else None
+            funds = float(params['funds']) if params.get('funds') is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise SimulatorError(400, "Invalid price, size or funds")
+        if order_type == 'limit' and (price is None or price <= 0.0 or size is None or size <= 0.0):
+            raise SimulatorError(400, "Invalid price or size")
+        if order_type == 'market' and not ((size is not None and size > 0.0) or (funds is not None and funds > 0.0)):
+            raise SimulatorError(400, "Market orders need size or funds")
+
+        with self.lock:
+            if client_oid and (key, client_oid) in self.client_oids:
+                # same order sent twice, e.g. retried after a timeout
+                existing = self.orders.get(self.client_oids[(key, client_oid)])
+                if existing is not None:
+                    return order_to_api(existing)
+
+            profile = self.get_profile(key)
+            hold_currency = None
+            hold_amount = 0.0
+            if order_type == 'limit':
+                if side == 'buy':
+                    hold_currency, hold_amount = quote_currency, price * size * (1 + self.taker_fee)
+                else:
+                    hold_currency, hold_amount = base_currency, size
+            elif side == 'buy' and funds is not None:
+                hold_currency, hold_amount = quote_currency, funds
+            elif side == 'sell':
+                hold_currency, hold_amount = base_currency, size
+            if hold_currency is not None and profile.get_available(hold_currency) < hold_amount:
+                raise SimulatorError(400, "Insufficient funds")
+
+            order = {
+                'id': str(uuid.uuid4()),
+                'product_id': product_id,
+                'profile_id': profile.id,
+                'side': side,
+                'type': order_type,
+                'post_only': False,
+                'created_at': get_utc_now_string(),
+                'status': 'pending',
+                'settled': False,
+                '_key': key,
+                '_seq': next(self.order_seq),
+                '_price': price,
+                '_remaining': size if size is not None else float('inf'),
+                '_funds': funds,
+                '_filled_size': 0.0,
+                '_executed_value': 0.0,
+                '_fill_fees': 0.0,
+                '_hold_currency': hold_currency,
+                '_hold_amount': hold_amount,
+            }
+            if order_type == 'limit':
+                order['price'] = format_price(price)
+                order['size'] = format_size(size)
+                order['time_in_force'] = 'GTC'
+            else:
+                if size is not None:
+                    order['size'] = format_size(size)
+                if funds is not None:
+                    order['funds'] = format_amount(funds)
+            if client_oid:
+                order['client_oid'] = client_oid
+                self.client_oids[(key, client_oid)] = order['id']
+            if hold_currency is not None:
+                profile.get_account(hold_currency)['hold'] += hold_amount
+
+            self.orders[order['id']] = order
+            self.order_count += 1
+            book = self.books[product_id]
+            self.publish_user(key, product_id, {'type': 'received', 'order_id': order['id'], 'order_type': order_type,
+                                                'side': side, 'client_oid': client_oid or '',
+                                                'price': order.get('price'), 'size': order.get('size')})
+
+            self.match(order)
+            if order_type == 'limit' and order['_remaining'] > SIZE_EPSILON:
+                order['status'] = 'open'
+                book.add(order)
+                self._changed_levels.add((product_id, side, price))
+                self.publish_user(key, product_id, {'type': 'open', 'order_id': order['id'], 'side': side,
+                                                    'price': order['price'], 'remaining_size': format_size(order['_remaining'])})
+            else:
+                self.finish_order(order, 'filled')
+            self.publish_level_changes()
+            return order_to_api(order)
+
+    def match(self, order):
+        """Fills order against the other side of the book, best price first, then oldest first.
+        Call with self.lock held.
+        """
+        book = self.books[order['product_id']]
+        buying = order['side'] == 'buy'
+        levels = book.asks if buying else book.bids
+        sizes = book.ask_sizes if buying else book.bid_sizes
+        taker_profile = self.get_profile(order['_key'])
+        quote_currency = order['product_id'].split('-')[1]
+
+        while order['_remaining'] > SIZE_EPSILON and levels:
+            best_price = levels.peekitem(0 if buying else -1)[0]
+            if order['_price'] is not None and (best_price > order['_price'] if buying else best_price < order['_price']):
+                break
+            level = levels[best_price]
+            maker = level[0]
+            if maker['_key'] == order['_key']:
+                # self-trade prevention: cancel the older, resting order
+                self.cancel_resting(maker, book)
+                continue
+
+            size = min(order['_remaining'], maker['_remaining'])
+            if order['_funds'] is not None:
+                funds_left = order['_funds'] - order['_executed_value'] - order['_fill_fees']
+                size = min(size, np.floor(1e8 * funds_left / (best_price * (1 + self.taker_fee))) / 1e8)
+            elif order['type'] == 'market' and buying and not taker_profile.unlimited:
+                # market buys by size hold nothing, check the balance as they fill
+                available = taker_profile.get_available(quote_currency)
+                size = min(size, np.floor(1e8 * available / (best_price * (1 + self.taker_fee))) / 1e8)
+            if size <= SIZE_EPSILON:
+                break
+
+            self.fill(maker, order, best_price, size)
+            sizes[best_price] -= size
+            self._changed_levels.add((order['product_id'], maker['side'], best_price))
+            if maker['_remaining'] <= SIZE_EPSILON:
+                level.popleft()
+                if not level:
+                    del levels[best_price]
+                    del sizes[best_price]
+                self.finish_order(maker, 'filled')
+
+
+    def fill(self, maker, taker, price, size):
+        """Settles one trade between a resting maker order and an incoming taker order.
+        Call with self.lock held.
+        """
+        product_id = taker['product_id']
+        base_currency, quote_currency = product_id.split('-')
+        trade_id = next(self.trade_ids)
+        value = price * size
+        now = get_utc_now_string()
+        self.trade_count += 1
+
+        for order, fee_rate, liquidity in ((maker, self.maker_fee, 'M'), (taker, self.taker_fee, 'T')):
+            profile = self.get_profile(order['_key'])
+            fee = fee_rate * value
+            details = {'order_id': order['id'], 'trade_id': str(trade_id), 'product_id': product_id}
+            if order['side'] == 'buy':
+                profile.add_entry(next(self.entry_ids), base_currency, size, 'match', details)
+                profile.add_entry(next(self.entry_ids), quote_currency, -value, 'match', details)
+            else:
+                profile.add_entry(next(self.entry_ids), base_currency, -size, 'match', details)
+                profile.add_entry(next(self.entry_ids), quote_currency, value, 'match', details)
+            profile.add_entry(next(self.entry_ids), quote_currency, -fee, 'fee', details)
+
+            # release the part of the hold used by this fill
+            if order['_hold_currency'] is not None:
+                if order['_hold_currency'] == quote_currency:
+                    released = value + fee if order['type'] == 'market' else order['_price'] * size * (1 + self.taker_fee)
+                else:
+                    released = size
+                released = min(released, order['_hold_amount'])
+                order['_hold_amount'] -= released
+                profile.get_account(order['_hold_currency'])['hold'] -= released
+
+            order['_remaining'] -= size
+            order['_filled_size'] += size
+            order['_executed_value'] += value
+            order['_fill_fees'] += fee
+            if not profile.unlimited:
+                profile.fills.append({
+                    'created_at': now,
+                    'trade_id': trade_id,
+                    'product_id': product_id,
+                    'order_id': order['id'],
+                    'profile_id': profile.id,
+                    'liquidity': liquidity,
+                    'price': format_price(price),
+                    'size': format_size(size),
+                    'fee': format_amount(fee),
+                    'side': order['side'],
+                    'settled': True,
+                    'usd_volume': format_amount(value),
+                })
+
+        book = self.books[product_id]
+        match_msg = {'type': 'match', 'trade_id': trade_id, 'maker_order_id': maker['id'], 'taker_order_id': taker['id'],
+                     'side': maker['side'], 'size': format_size(size), 'price': format_price(price),
+                     'product_id': product_id, 'time': now}
+        self.last_trades[product_id] = (trade_id, price, size, maker['side'], now)
+        self.publish('matches', product_id, dict(match_msg, sequence=book.next_sequence()))
+        self.publish_user(maker['_key'], product_id, dict(match_msg))
+        if taker['_key'] != maker['_key']:
+            self.publish_user(taker['_key'], product_id, dict(match_msg))
+        self.publish_ticker(product_id)
+
+    def finish_order(self, order, reason):
+        """Marks order done and releases what is left of its hold.  Call with self.lock held."""
+        order['status'] = 'done'
+        order['settled'] = True
+        order['done_at'] = get_utc_now_string()
+        order['done_reason'] = reason
+        if order['_hold_currency'] is not None and order['_hold_amount'] > 0.0:
+            self.get_profile(order['_key']).get_account(order['_hold_currency'])['hold'] -= order['_hold_amount']
+            order['_hold_amount'] = 0.0
+        remaining = order['_remaining'] if order['_remaining'] != float('inf') else 0.0
+        self.publish_user(order['_key'], order['product_id'], {
+            'type': 'done', 'order_id': order['id'], 'side': order['side'], 'reason': reason,
+            'price': order.get('price'), 'remaining_size': format_size(max(0.0, remaining))})
+        if reason == 'canceled':
+            # canceled orders are gone from the API, like on Coinbase Pro
+            self.orders.pop(order['id'], None)
+            if 'client_oid' in order:
+                self.client_oids.pop((order['_key'], order['client_oid']), None)
+
+    def cancel_resting(self, order, book):
+        """Takes a resting order off the book.  Call with self.lock held."""
+        book.remove(order)
+        self._changed_levels.add((order['product_id'], order['side'], order['_price']))
+        self.finish_order(order, 'canceled')
+
+    def cancel_order(self, key, order_id):
+        with self.lock:
+            order = self.find_order(key, order_id)
+            if order['status'] != 'open':
+                raise SimulatorError(400, "Order already done")
+            self.cancel_resting(order, self.books[order['product_id']])
+            self.publish_level_changes()
+            return order['id']
+
+    def cancel_all(self, key, product_id=None):
+        with self.lock:
+            canceled = []
+            for order in list(self.orders.values()):
+                if order['_key'] == key and order['status'] == 'open' and product_id in (None, order['product_id']):
+                    self.cancel_resting(order, self.books[order['product_id']])
+                    canceled.append(order['id'])
+            self.publish_level_changes()
+            return canceled
+
+    def find_order(self, key, order_id):
+        if order_id.startswith('client:'):
+            order_id = self.client_oids.get((key, order_id[len('client:'):]))
+        order = self.orders.get(order_id)
+        if order is None or order['_key'] != key:
+            raise SimulatorError(404, "NotFound")
+        return order
+
+    def get_order(self, key, order_id):
+        with self.lock:
+            return order_to_api(self.find_order(key, order_id))
+
+    def get_orders(self, key, product_id=None, statuses=None, before=None, after=None, limit=PAGE_LIMIT):
+        """Orders of key newest first, by default only the open ones, paginated like Coinbase Pro"""
+        if not statuses:
+            statuses = ['open', 'pending', 'active']
+        with self.lock:
+            orders = [order for order in self.orders.values()
+                      if order['_key'] == key
+                      and ('all' in statuses or order['status'] in statuses)
+                      and product_id in (None, order['product_id'])]
+            orders.sort(key=lambda order: order['_seq'])
+            page, cb_after = paginate_newest_first(orders, lambda order: order['_seq'], before, after, limit)
+            return [order_to_api(order) for order in page], cb_after
+
+    ###   market data   ###
+    def get_product_order_book(self, product_id, level=1):
+        if product_id not in self.books:
+            raise SimulatorError(404, "NotFound")
+        with self.lock:
+            book = self.books[product_id]
+            result = {'sequence': book.sequence}
+            for name, levels, sizes, reverse in (('bids', book.bids, book.bid_sizes, True), ('asks', book.asks, book.ask_sizes, False)):
+                prices = levels.keys()
+                prices = reversed(prices) if reverse else iter(prices)
+                if level == 3:
+                    result[name] = [[format_price(price), format_size(order['_remaining']), order['id']]
+                                    for price in prices for order in levels[price]]
+                else:
+                    depth = 1 if level == 1 else BOOK_LEVEL2_DEPTH
+                    result[name] = [[format_price(price), format_size(sizes[price]), len(levels[price])]
+                                    for price in itertools.islice(prices, depth)]
+            return result
+
+    def get_product_ticker(self, product_id):
+        if product_id not in self.books:
+            raise SimulatorError(404, "NotFound")
+        with self.lock:
+            book = self.books[product_id]
+            trade_id, price, size, _, trade_time = self.last_trades.get(
+                product_id, (0, self.start_prices[product_id], 0.0, None, get_utc_now_string()))
+            best_bid = book.best_bid()
+            best_ask = book.best_ask()
+            return {'trade_id': trade_id, 'price': format_price(price), 'size': format_size(size),
+                    'bid': format_price(best_bid if best_bid is not None else price),
+                    'ask': format_price(best_ask if best_ask is not None else price),
+                    'volume': '0', 'time': trade_time}
+
+    ###   websocket feed   ###
+    def subscribe(self, feed, msg):
+        """Handles a "subscribe" message of a feed connection, sending the level2 snapshots right away"""
+        product_ids = msg.get('product_ids', [])
+        channels = []
+        for channel in msg.get('channels', ['ticker']):
+            if isinstance(channel, dict):
+                product_ids = product_ids + channel.get('product_ids', [])
+                channel = channel['name']
+            channels.append(channel)
+
+        with self.lock:
+            feed.channels.update(channels)
+            feed.products.update(product_id for product_id in product_ids if product_id in self.books)
+            if 'user' in channels:
+                feed.key = msg.get('key')
+            if feed not in self.feeds:
+                self.feeds.append(feed)
+            feed.put({'type': 'subscriptions',
+                      'channels': [{'name': channel, 'product_ids': sorted(feed.products)} for channel in sorted(feed.channels)]})
+            for product_id in sorted(feed.products):
+                if 'level2' in channels:
+                    book = self.books[product_id]
+                    feed.put({'type': 'snapshot', 'product_id': product_id,
+                              'bids': [[format_price(price), format_size(book.bid_sizes[price])] for price in reversed(book.bids.keys())],
+                              'asks': [[format_price(price), format_size(book.ask_sizes[price])] for price in book.asks.keys()]})
+                if 'ticker' in channels and product_id in self.last_trades:
+                    feed.put(self.make_ticker(product_id))
+
+    def unsubscribe(self, feed):
+        with self.lock:
+            if feed in self.feeds:
+                self.feeds.remove(feed)
+
+    def publish(self, channel, product_id, msg):
+        """Sends msg to the feeds subscribed to channel for product_id.  Call with self.lock held."""
+        for feed in self.feeds:
+            if feed.wants(channel, product_id):
+                feed.put(msg)
+
+    def publish_user(self, key, product_id, msg):
+        """Sends msg to the "user" channel feeds of key.  Call with self.lock held."""
+        if not self.feeds or key == MARKET_MAKER_KEY:
+            return
+        msg['product_id'] = product_id
+        msg['time'] = msg.get('time') or get_utc_now_string()
+        msg['sequence'] = self.books[product_id].next_sequence()
+        for feed in self.feeds:
+            if feed.key == key and feed.wants('user', product_id):
+                feed.put(msg)
+
+    def make_ticker(self, product_id):
+        book = self.books[product_id]
+        trade_id, price, size, side, trade_time = self.last_trades[product_id]
+        best_bid = book.best_bid()
+        best_ask = book.best_ask()
+        return {'type': 'ticker', 'sequence': book.next_sequence(), 'product_id': product_id,
+                'price': format_price(price), 'side': 'sell' if side == 'buy' else 'buy', 'time': trade_time,
+                'trade_id': trade_id, 'last_size': format_size(size),
+                'best_bid': format_price(best_bid) if best_bid is not None else None,
+                'best_ask': format_price(best_ask) if best_ask is not None else None}
+
+    def publish_ticker(self, product_id):
+        if any(feed.wants('ticker', product_id) for feed in self.feeds):
+            self.publish('ticker', product_id, self.make_ticker(product_id))
+
+    def publish_level_changes(self):
+        """Sends one l2update per product for the price levels changed by the last operation.  Call with self.lock held."""
+        if not self._changed_levels:
+            return
+        changes = {}
+        for product_id, side, price in sorted(self._changed_levels):
+            size = self.books[product_id].level_size(side, price)
+            changes.setdefault(product_id, []).append([side, format_price(price), format_size(size)])
+        self._changed_levels = set()
+        if not self.feeds:
+            return
+        now = get_utc_now_string()
+        for product_id, product_changes in changes.items():
+            self.publish('level2', product_id, {'type': 'l2update', 'product_id': product_id,
+                                                'changes': product_changes, 'time': now})
+
+class PricePath:
+    """Scripted prices of one product: a geometric random walk from start_price,
+    or the given prices scaled to start at start_price, repeated.
+    """
+    def __init__(self, start_price, volatility=VOLATILITY, seed=0, prices=None):
+        self.price = start_price
+        self.volatility = volatility
+        self.rng = np.random.default_rng(seed)
+        self.prices = None
+        self.index = 0
+        if prices is not None and len(prices) > 0:
+            self.prices = np.asarray(prices, dtype=float) * start_price / prices[0]
+
+    def next(self):
+        if self.prices is not None:
+            self.price = self.prices[self.index % len(self.prices)]
+            self.index += 1
+        else:
+            self.price *= np.exp(self.volatility * self.rng.standard_normal())
+        return float(self.price)
+
+class MarketMaker:
+    """Re-quotes every product around its price path every step_seconds.
+    When the price moves, the new quotes trade with the resting orders they cross.
+    """
+    def __init__(self, engine, paths, step_seconds=STEP_SECONDS):
+        self.engine = engine
+        self.paths = paths
+        self.step_seconds = step_seconds
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def quote(self, product_id, price):
+        engine = self.engine
+        with engine.lock:
+            engine.cancel_all(MARKET_MAKER_KEY, product_id)
+            size = round(QUOTE_SIZE_USD / price, 8)
+            for level in range(QUOTE_LEVELS):
+                distance = HALF_SPREAD + level * LEVEL_SPACING
+                for side, level_price in (('buy', price * (1 - distance)), ('sell', price * (1 + distance))):
+                    if round(level_price, 2) <= 0.0:
+                        continue
+                    engine.place_order(MARKET_MAKER_KEY, {'product_id': product_id, 'side': side, 'type': 'limit',
+                                                          'price': level_price, 'size': size})
+
+    def step(self):
+        for product_id, path in self.paths.items():
+            self.quote(product_id, path.next())
+
+    def run(self):
+        while not self.stop_event.wait(self.step_seconds):
+            self.step()
+
+    def start(self):
+        self.step()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    """REST API and websocket upgrade of the simulator, self.server.simulator is the ExchangeSimulator"""
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.simulator.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self.handle_websocket()
+        else:
+            self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_api(self, method):
+        simulator = self.server.simulator
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        statuses = parse_qs(url.query).get('status')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        key = self.headers.get('CB-ACCESS-KEY')
+
+        simulator.wait_latency()
+        if not simulator.take_token(url.path, key, self.client_address[0]):
+            self.send_json(429, {'message': "Rate limit exceeded"})
+            return
+
+        try:
+            status, result, headers = simulator.route(method, url.path, params, statuses, body, key)
+        except SimulatorError as e:
+            status, result, headers = e.status, {'message': e.message}, None
+        self.send_json(status, result, headers)
+
+    def handle_websocket(self):
+        simulator = self.server.simulator
+        accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        feed = FeedConnection(self.connection)
+        reader = threading.Thread(target=self.read_websocket, args=(feed,), daemon=True)
+        reader.start()
+        try:
+            while True:
+                msg = feed.messages.get()
+                if msg is None:
+                    break
+                feed.send_frame(OPCODE_TEXT, json.dumps(msg).encode())
+        except OSError:
+            pass
+        finally:
+            feed.closed = True
+            simulator.engine.unsubscribe(feed)
+
+    def read_websocket(self, feed):
+        engine = self.server.simulator.engine
+        try:
+            while not feed.closed:
+                opcode, payload = read_websocket_frame(self.rfile)
+                if opcode is None or opcode == OPCODE_CLOSE:
+                    if opcode == OPCODE_CLOSE:
+                        feed.send_frame(OPCODE_CLOSE, payload[:2])
+                    break
+                if opcode == OPCODE_PING:
+                    feed.send_frame(OPCODE_PONG, payload)
+                elif opcode == OPCODE_TEXT:
+                    msg = json.loads(payload)
+                    if msg.get('type') == 'subscribe':
+                        engine.subscribe(feed, msg)
+        except (OSError, ValueError):
+            pass
+        feed.close()
+
+class ExchangeSimulator:
+    """The simulated exchange: matching engine, market maker, and the REST and websocket server on one port.
+
+    Inputs:
+    -------
+    products: list
+        products to trade, e.g. ["ETH-USD", "BTC-USD"]
+    latency, jitter: float
+        seconds added to every REST request, plus a random part of up to jitter seconds
+    rate_limits: tuple
+        (public_rate, public_burst, private_rate, private_burst), or None for no rate limits
+    step_seconds, volatility, seed, prices:
+        price path, see PricePath and MarketMaker
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, products=PRODUCTS, latency=0.0, jitter=0.0,
+                 rate_limits=(PUBLIC_RATE, PUBLIC_BURST, PRIVATE_RATE, PRIVATE_BURST),
+                 step_seconds=STEP_SECONDS, volatility=VOLATILITY, seed=0, prices=None, verbose=False):
+        start_prices = {product: START_PRICES.get(product, DEFAULT_START_PRICE) for product in products}
+        self.engine = MatchingEngine(products, start_prices)
+        paths = {product: PricePath(start_prices[product], volatility, seed + ii, prices)
+                 for ii, product in enumerate(products)}
+        self.market_maker = MarketMaker(self.engine, paths, step_seconds)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = rate_limits
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.verbose = verbose
+        self.server = ThreadingHTTPServer((host, port), SimulatorRequestHandler)
+        self.server.daemon_threads = True
+        self.server.simulator = self
+        self.server_thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def websocket_url(self):
+        host, port = self.server.server_address[:2]
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        self.market_maker.start()
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def stop(self):
+        self.market_maker.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_latency(self):
+        if self.latency > 0.0 or self.jitter > 0.0:
+            time.sleep(self.latency + self.jitter * random.random())
+
+    def take_token(self, path, key, address):
+        """False if the request is over the rate limit of its API key, or of its address for public endpoints"""
+        if self.rate_limits is None:
+            return True
+        public_rate, public_burst, private_rate, private_burst = self.rate_limits
+        if is_public_endpoint(path) or key is None:
+            bucket_key = ('public', address)
+            rate, burst = public_rate, public_burst
+        else:
+            bucket_key = ('private', key)
+            rate, burst = private_rate, private_burst
+        with self.buckets_lock:
+            bucket = self.buckets.get(bucket_key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                self.buckets[bucket_key] = bucket
+        return bucket.try_take() == 0.0
+
+    def route(self, method, path, params, statuses, body, key):
+        """Answers one REST request.
+
+        Output:
+        -------
+        status, result, headers: int, object, dict
+        """
+        engine = self.engine
+        parts = [part for part in path.split('/') if part]
+        before = params.get('before')
+        after = params.get('after')
+        limit = min(int(params.get('limit', PAGE_LIMIT)), PAGE_LIMIT)
+
+        # public endpoints
+        if method == 'GET' and parts == ['time']:
+            now = time.time()
+            return 200, {'iso': get_utc_now_string(), 'epoch': now}, None
+        if method == 'GET' and parts == ['products']:
+            return 200, [{'id': product, 'base_currency': product.split('-')[0], 'quote_currency': product.split('-')[1],
+                          'base_increment': '0.00000001', 'quote_increment': '0.01', 'status': 'online'}
+                         for product in engine.products], None
+        if method == 'GET' and len(parts) == 3 and parts[0] == 'products' and parts[2] == 'book':
+            return 200, engine.get_product_order_book(parts[1], int(params.get('level', 1))), None
+        if method == 'GET' and len(parts) == 3 and parts[0] == 'products' and parts[2] == 'ticker':
+            return 200, engine.get_product_ticker(parts[1]), None
+
+        # private endpoints
+        if not key:
+            raise SimulatorError(401, "CB-ACCESS-KEY header is required")
+        if parts and parts[0] == 'accounts' and method == 'GET':
+            if len(parts) == 1:
+                return 200, engine.get_accounts(key), None
+            if len(parts) == 2:
+                return 200, engine.get_account(key, parts[1]), None
+            if len(parts) == 3 and parts[2] == 'ledger':
+                entries, cb_after = engine.get_account_history(key, parts[1], before, after, limit)
+                return 200, entries, make_page_headers(cb_after)
+        if parts and parts[0] == 'orders':
+            if method == 'POST' and len(parts) == 1:
+                return 200, engine.place_order(key, body), None
+            if method == 'GET' and len(parts) == 1:
+                orders, cb_after = engine.get_orders(key, params.get('product_id'), statuses, before, after, limit)
+                return 200, orders, make_page_headers(cb_after)
+            if method == 'GET' and len(parts) == 2:
+                return 200, engine.get_order(key, parts[1]), None
+            if method == 'DELETE' and len(parts) == 2:
+                return 200, engine.cancel_order(key, parts[1]), None
+            if method == 'DELETE' and len(parts) == 1:
+                return 200, engine.cancel_all(key, params.get('product_id')), None
+        if method == 'GET' and parts == ['fills']:
+            fills, cb_after = engine.get_fills(key, params.get('product_id'), params.get('order_id'), before, after, limit)
+            return 200, fills, make_page_headers(cb_after)
+        if method == 'GET' and parts == ['payment-methods']:
+            return 200, [{'id': 'simulated-bank', 'type': 'ach_bank_account', 'name': 'Simulated bank',
+                          'currency': 'USD', 'primary_buy': True, 'allow_deposit': True}], None
+        if method == 'POST' and parts == ['deposits', 'payment-method']:
+            try:
+                amount = float(body['amount'])
+            except (KeyError, TypeError, ValueError):
+                raise SimulatorError(400, "Invalid amount")
+            return 200, engine.deposit(key, amount, body.get('currency', 'USD')), None
+
+        raise SimulatorError(404, "NotFound")
+
+
+if __name__ == "__main__":
+    (host, port, products, latency, jitter, rate_limits, step_seconds, volatility, prices_csv, seed,
+     load_test, clients, verbose) = parse_args()
+
+    prices = None
+    if prices_csv is not None:
+        from backtest import load_candles_csv
+        prices = load_candles_csv(prices_csv)['close']
+
+    if load_test is not None:
+        # the load test measures the simulator itself, don't throttle it
+        rate_limits = None
+        port = 0
+
+    simulator = ExchangeSimulator(host, port, products, latency, jitter, rate_limits, step_seconds, volatility, seed, prices, verbose)
+    simulator.start()
+    print(f"REST API on {simulator.api_url}, websocket feed on {simulator.websocket_url}")
+
+    if load_test is not None:
+        stats = run_load_test(simulator.api_url, load_test, clients, products[0])
+        print(f"{stats['orders']} orders, {stats['requests']} requests in {stats['seconds']:.2f} s: "
+              f"{stats['orders_per_second']:,.0f} orders/s, {stats['requests_per_second']:,.0f} requests/s, "
+              f"latency p50 {stats['latency_p50_ms']:.2f} ms, p99 {stats['latency_p99_ms']:.2f} ms")
+        print(f"{simulator.engine.order_count} orders matched into {simulator.engine.trade_count} trades")
+        simulator.stop()
+    else:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            simulator.stop()
@@ -0,0 +1,400 @@
+"""ledger_store.py
+
+Keeps a local SQLite copy of your Coinbase Pro account ledgers and orders,
+so profits_calculator.py only downloads the ledger entries and orders that are new since the last run.
+
+Example:
+python ledger_store.py ETH-USD
+python ledger_store.py ETH-USD BTC-USD --resync
+"""
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cbpro_client import get_auth_client
+
+LEDGER_DB_FILENAME = "ledger.sqlite3"
+
+# number of rows handed to sqlite at once
+INSERT_BATCH_SIZE = 1000
+
+# sqlite has one writer at a time: the syncs running on threads download concurrently, then take turns to write
+_write_lock = threading.Lock()
+
+###   Functions   ###
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Syncs the local copy of the Coinbase Pro account ledgers and orders for products.\nExample:\npython ledger_store.py ETH-USD BTC-USD --resync')
+    parser.add_argument('products', type=str, nargs='+',
+                        help='Cryptocurrency products whose crypto and fiat ledgers and orders are synced, e.g. ETH-USD BTC-USD MATIC-USD')
+    parser.add_argument('--resync', action='store_true',
+                        help='Flag.  If set, deletes the stored ledgers and orders and downloads them again from scratch.')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='Flag.  If set, runs code in quiet mode.')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    products = args.products
+    resync = args.resync
+    quiet = args.quiet
+
+    if not quiet:
+        print(f"products = {products}")
+        print(f"resync   = {resync}")
+        print(f"quiet    = {quiet}")
+
+    return products, resync, quiet
+
+def get_default_db_path():
+    """Returns the path of the ledger database, in the data/ directory next to this script.
+    Creates the data/ directory if needed.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(script_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, LEDGER_DB_FILENAME)
+
+def connect(db_path=None):
+    """Opens the ledger database, creating the ledger table if it does not exist yet.
+
+    Input:
+    ------
+    db_path: str
+        Path to the sqlite file.  Defaults to data/ledger.sqlite3
+
+    Output:
+    -------
+    conn: sqlite3.Connection
+        open connection to the ledger database
+    """
+    if db_path is None:
+        db_path = get_default_db_path()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS ledger (
+            account_id TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            amount TEXT NOT NULL,
+            balance TEXT NOT NULL,
+            type TEXT NOT NULL,
+            details TEXT,
+            PRIMARY KEY (account_id, entry_id)
+        ) WITHOUT ROWID"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            product_id TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL,
+            details TEXT NOT NULL
+        ) WITHOUT ROWID"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS orders_product_created_at ON orders (product_id, created_at)")
+    # orders of product_id are all stored from created_at synced_since on, or from the first one if it is NULL
+    conn.execute("CREATE TABLE IF NOT EXISTS order_syncs (product_id TEXT PRIMARY KEY, synced_since TEXT)")
+    return conn
+
+def get_cursor(conn, account_id):
+    """Returns the newest ledger entry id stored for account_id, or None if nothing is stored.
+    """
+    row = conn.execute("SELECT MAX(entry_id) FROM ledger WHERE account_id = ?", (account_id,)).fetchone()
+    return row[0]
+
+def entry_to_row(account_id, entry):
+    """Converts one ledger entry dict from the Coinbase Pro API to a row of the ledger table.
+    """
+    return (
+        account_id,
+        int(entry['id']),
+        entry['created_at'],
+        entry['amount'],
+        entry['balance'],
+        entry['type'],
+        json.dumps(entry.get('details', {})),
+    )
+
+def sync_account_history(auth_client, account_id, db_path=None, resync=False, quiet=True):
+    """Downloads the ledger entries of account_id that are newer than the stored cursor.
+    The API returns the newest entries first, so we stop paging as soon as we reach an entry we already have.
+    New entries are committed in one transaction once downloaded, so an interrupted sync never leaves a gap behind the cursor,
+    and syncs of other accounts can run on other threads at the same time.
+
+    Inputs:
+    -------
+    auth_client: cbpro.AuthenticatedClient
+        authenticated Coinbase Pro client
+    account_id: str
+        Coinbase Pro account id, e.g. the id of your ETH account
+    db_path: str
+        Path to the sqlite file.  Defaults to data/ledger.sqlite3
+    resync: bool
+        Flag. If set, deletes the stored entries of account_id and downloads everything again
+    quiet: bool
+        Flag. If set, does not print so much to terminal.
+
+    Output:
+    -------
+    num_new_entries: int
+        number of entries added to the store
+    """
+    conn = connect(db_path)
+    try:
+        cursor = None if resync else get_cursor(conn, account_id)
+    finally:
+        conn.close()
+
+    rows = []
+    for entry in auth_client.get_account_history(account_id):
+        if cursor is not None and int(entry['id']) <= cursor:
+            break
+        rows.append(entry_to_row(account_id, entry))
+    num_new_entries = len(rows)
+
+    with _write_lock:
+        conn = connect(db_path)
+        try:
+            if resync:
+                conn.execute("DELETE FROM ledger WHERE account_id = ?", (account_id,))
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                conn.executemany("INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?)", rows[start:start + INSERT_BATCH_SIZE])
+            conn.commit()
+        finally:
+            conn.close()
+
+    if not quiet:
+        print(f"{num_new_entries} new ledger entries stored for account {account_id}")
+
+    return num_new_entries
+
+def iter_account_history(account_id, db_path=None):
+    """Yields the stored ledger entries of account_id, newest first,
+    in the same dict format as auth_client.get_account_history(account_id).
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT entry_id, created_at, amount, balance, type, details FROM ledger "
+            "WHERE account_id = ? ORDER BY entry_id DESC",
+            (account_id,)
+        )
+        for entry_id, created_at, amount, balance, entry_type, details in rows:
+            yield {
+                'id': str(entry_id),
+                'created_at': created_at,
+                'amount': amount,
+                'balance': balance,
+                'type': entry_type,
+                'details': json.loads(details) if details else {},
+            }
+    finally:
+        conn.close()
+
+def get_account_ids(auth_client, product, accounts=None):
+    """Returns the Coinbase Pro account ids of the crypto and the fiat in product.
+    accounts can be passed in to share one get_accounts() call between products.
+    """
+    product_split = product.split('-')
+    product_bought = product_split[0]
+    product_sold = product_split[1]
+
+    if accounts is None:
+        accounts = auth_client.get_accounts()
+    for account in accounts:
+        if account['currency'] == product_bought:
+            crypto_id = account['id']
+        if account['currency'] == product_sold: # usually USD
+            fiat_id = account['id']
+
+    return crypto_id, fiat_id
+
+def sync_product_ledgers(auth_client, product, db_path=None, resync=False, quiet=True):
+    """Syncs the crypto and fiat ledgers of product into the local store, both at the same time.
+
+    Outputs:
+    --------
+    crypto_id: str
+        account id of the crypto in product
+    fiat_id: str
+        account id of the fiat in product
+    """
+    account_ids = sync_products(auth_client, [product], db_path=db_path, resync=resync, orders=False, quiet=quiet)
+    return account_ids[product]
+
+def sync_products(auth_client, products, db_path=None, resync=False, since=None, orders=True, quiet=True, executor=None):
+    """Syncs the ledgers, and the orders if orders is set, of every product into the local store, concurrently.
+    Accounts are listed once, and every ledger is synced once even when it is shared, e.g. USD by ETH-USD and BTC-USD.
+
+    Inputs:
+    -------
+    products: list
+        Cryptocurrency products, e.g. ['ETH-USD', 'BTC-USD']
+    since: str
+        passed to sync_orders()
+    executor: concurrent.futures.Executor
+        runs the syncs.  If None, a thread pool with one thread per sync is used
+
+    Output:
+    -------
+    account_ids: dict
+        product -> (crypto_id, fiat_id)
+    """
+    accounts = auth_client.get_accounts()
+    account_ids = {product: get_account_ids(auth_client, product, accounts) for product in products}
+    unique_account_ids = sorted(set(account_id for ids in account_ids.values() for account_id in ids))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(unique_account_ids) + (len(products) if orders else 0))
+    try:
+        futures = [executor.submit(sync_account_history, auth_client, account_id, db_path=db_path, resync=resync, quiet=quiet)
+                   for account_id in unique_account_ids]
+        if orders:
+            futures += [executor.submit(sync_orders, auth_client, product, db_path=db_path, since=since, resync=resync, quiet=quiet)
+                        for product in products]
+        # raises the first error of the syncs
+        for future in futures:
+            future.result()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    return account_ids
+
+def order_to_row(order):
+    """Converts one order dict from the Coinbase Pro API to a row of the orders table.
+    """
+    return (order['id'], order['product_id'], order['created_at'], order['status'], json.dumps(order))
+
+def sync_orders(auth_client, product, db_path=None, since=None, resync=False, quiet=True):
+    """Downloads the orders of product that are new or changed since the last sync.
+    The API returns the newest orders first, so we stop paging as soon as we reach an order we already have,
+    or an order older than since.  Stored orders which were not done yet are refreshed from the open orders,
+    and the ones which left them one by one with get_order().
+    Changes are committed in one transaction once downloaded, like sync_account_history().
+
+    Inputs:
+    -------
+    auth_client: cbpro.AuthenticatedClient
+        authenticated Coinbase Pro client
+    product: str
+        Cryptocurrency product, e.g. ETH-USD
+    db_path: str
+        Path to the sqlite file.  Defaults to data/ledger.sqlite3
+    since: str
+        UTC date or time, e.g. 2021-11-25 or 2021-11-25T22:00:00.  If set, only the orders created since then are synced
+    resync: bool
+        Flag. If set, deletes the stored orders of product and downloads them again
+    quiet: bool
+        Flag. If set, does not print so much to terminal.
+
+    Output:
+    -------
+    num_new_orders: int
+        number of orders added or updated in the store
+    """
+    conn = connect(db_path)
+    try:
+        row = None
+        stored_statuses = {}
+        if not resync:
+            row = conn.execute("SELECT synced_since FROM order_syncs WHERE product_id = ?", (product,)).fetchone()
+            stored_statuses = dict(conn.execute("SELECT order_id, status FROM orders WHERE product_id = ?", (product,)))
+    finally:
+        conn.close()
+    # the known orders can only be trusted to end the paging if the stored history covers since
+    covered = row is not None and (row[0] is None or (since is not None and row[0] <= since))
+
+    rows = []
+    seen_order_ids = set()
+    reached_since = False
+    for order in auth_client.get_orders(product, status='all'):
+        if 'id' not in order:
+            raise RuntimeError(f"get_orders failed: {order}")
+        if order['product_id'] != product:
+            continue
+        if since is not None and order['created_at'] < since:
+            reached_since = True
+            break
+        if covered and order['id'] in stored_statuses:
+            break
+        seen_order_ids.add(order['id'])
+        rows.append(order_to_row(order))
+
+    # the orders not done at the last sync, which we did not page back to
+    stale_order_ids = [order_id for order_id, status in stored_statuses.items()
+                       if status != 'done' and order_id not in seen_order_ids]
+    deleted_order_ids = []
+    if stale_order_ids:
+        open_orders = {order['id']: order for order in auth_client.get_orders(product) if 'id' in order}
+        for order_id in stale_order_ids:
+            order = open_orders.get(order_id)
+            if order is None:
+                order = auth_client.get_order(order_id)
+            if 'id' in order:
+                rows.append(order_to_row(order))
+            else:
+                # canceled orders are gone from the API
+                deleted_order_ids.append((order_id,))
+
+    with _write_lock:
+        conn = connect(db_path)
+        try:
+            if resync:
+                conn.execute("DELETE FROM orders WHERE product_id = ?", (product,))
+                conn.execute("DELETE FROM order_syncs WHERE product_id = ?", (product,))
+            conn.executemany("DELETE FROM orders WHERE order_id = ?", deleted_order_ids)
+            conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)", rows)
+            if not covered:
+                conn.execute("INSERT OR REPLACE INTO order_syncs VALUES (?, ?)", (product, since if reached_since else None))
+            conn.commit()
+        finally:
+            conn.close()
+
+    if not quiet:
+        print(f"{len(rows)} new or updated orders stored for {product}")
+
+    return len(rows)
+
+def iter_orders(product, db_path=None, since=None, status=None):
+    """Yields the stored orders of product, newest first,
+    in the same dict format as auth_client.get_orders(product).
+
+    Inputs:
+    -------
+    since: str
+        UTC date or time, if set only the orders created since then are yielded
+    status: str
+        if set, only the orders with this status are yielded, e.g. done
+    """
+    conn = connect(db_path)
+    try:
+        query = "SELECT details FROM orders WHERE product_id = ?"
+        values = [product]
+        if since is not None:
+            query += " AND created_at >= ?"
+            values.append(since)
+        if status is not None:
+            query += " AND status = ?"
+            values.append(status)
+        query += " ORDER BY created_at DESC"
+        for (details,) in conn.execute(query, values):
+            yield json.loads(details)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    products, resync, quiet = parse_args()
+
+    # initialize
+    auth_client = get_auth_client()
+
+    sync_products(auth_client, products, resync=resync, quiet=quiet)
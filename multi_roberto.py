@@ -0,0 +1,164 @@
+"""multi_roberto.py
+
+Runs the cron_roberto.py cycle for many products in one process.
+
+The products are read from a JSON config file, see products.example.json.
+Every cycle makes one get_orders() call shared by all the products,
+then checks and re-arms the limit orders of all the products concurrently on a thread pool.
+
+Example, one cycle per cron call:
+python multi_roberto.py products.json --once
+or a long-running loop, one cycle every 60 seconds:
+python multi_roberto.py products.json --interval 60
+"""
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import trade_journal
+from cron_roberto import get_log_dir, get_open_orders, run_ladder_cycle, run_roberto_cycle
+from order_book import OrderBookClient
+from roberto import get_product_decimals
+
+###   Functions   ###
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Automatically sets up pairs of limit orders for many cryptocurrency products on Coinbase Pro, in one process.\nExample:\npython multi_roberto.py products.json --once')
+    parser.add_argument('config_filename', type=str,
+                        help='JSON file with a list of products, see products.example.json')
+    parser.add_argument('--once', action='store_true',
+                        help='Flag.  If set, runs a single cycle and exits, e.g. when called from cron.')
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='Seconds between the start of two cycles when not using --once.  Default is 60.0')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of products handled at the same time.  Default is 8')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='Flag.  If set, runs code in quiet mode.')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    config_filename = args.config_filename
+    once = args.once
+    interval = args.interval
+    workers = args.workers
+    quiet = args.quiet
+
+    if not quiet:
+        print(f"config_filename = {config_filename}")
+        print(f"once            = {once}")
+        print(f"interval        = {interval}")
+        print(f"workers         = {workers}")
+        print(f"quiet           = {quiet}")
+
+    return config_filename, once, interval, workers, quiet
+
+def load_product_configs(config_filename):
+    """Reads the list of product configs from a JSON file like
+    [
+        {"product": "ETH-USD", "buy_amount_usd": 1000.0, "swing_percent": 5.0, "fiat_profits_percent": 100.0},
+        {"product": "BTC-USD", "buy_amount_usd": 100.0, "swing_percent": 2.0, "fiat_profits_percent": 100.0,
+         "levels": 5, "spacing": "geometric", "size_rule": "equal"},
+        ...
+    ]
+    levels, spacing and size_rule are optional, see cron_roberto.py --levels.
+    Raises ValueError for a product which is not traded, instead of failing on every cycle.
+
+    Output:
+    -------
+    product_configs: list
+        list of dicts with keys product, buy_amount_usd, swing_percent, fiat_profits_percent
+    """
+    with open(config_filename, "r") as file1:
+        product_configs = json.load(file1)
+
+    for product_config in product_configs:
+        product_config['buy_amount_usd'] = float(product_config['buy_amount_usd'])
+        product_config['swing_percent'] = float(product_config.get('swing_percent', 5.0))
+        product_config['fiat_profits_percent'] = float(product_config.get('fiat_profits_percent', 100.0))
+        product_config['levels'] = int(product_config.get('levels', 1))
+        product_config['spacing'] = product_config.get('spacing', 'linear')
+        product_config['size_rule'] = product_config.get('size_rule', 'equal')
+        # looks up the decimals of the order prices and sizes once, see roberto.get_product_decimals()
+        get_product_decimals(product_config['product'])
+
+    return product_configs
+
+def run_product_cycle(product_config, log_dir, quiet, open_orders):
+    """Runs one cron_roberto.py cycle for one product config.
+    Errors are printed and swallowed, so that one product can not stop the others.
+    """
+    product = product_config['product']
+    try:
+        if product_config['levels'] > 1:
+            return run_ladder_cycle(product, product_config['buy_amount_usd'], product_config['swing_percent'],
+                                    product_config['fiat_profits_percent'], product_config['levels'],
+                                    product_config['spacing'], product_config['size_rule'], log_dir, quiet, open_orders)
+        return run_roberto_cycle(product, product_config['buy_amount_usd'], product_config['swing_percent'],
+                                 product_config['fiat_profits_percent'], log_dir, quiet, open_orders)
+    except Exception as e:
+        print(f"{product} cycle failed: {e!r}")
+        return False
+
+def run_multi_cycle(product_configs, log_dir, quiet, executor):
+    """One cycle for all the products: a single get_orders() call, then every product concurrently.
+
+    Output:
+    -------
+    new_orders_set: dict
+        product -> True if a new pair of limit orders was set for it, empty if the cycle was skipped
+    """
+    # an API error skips this cycle only, the next one tries again
+    try:
+        open_orders = get_open_orders()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"could not get the open orders, skipping this cycle: {e!r}")
+        return {}
+    # an error response comes back as its keys, not as orders
+    if not all(isinstance(order, dict) for order in open_orders):
+        print(f"could not get the open orders, skipping this cycle: {open_orders}")
+        return {}
+    futures = {}
+    for product_config in product_configs:
+        futures[product_config['product']] = executor.submit(run_product_cycle, product_config, log_dir, quiet, open_orders)
+
+    new_orders_set = {}
+    for product, future in futures.items():
+        new_orders_set[product] = future.result()
+
+    # the journal records of all the products in one write
+    trade_journal.flush_all()
+    return new_orders_set
+
+
+if __name__ == "__main__":
+    # First, make sure a log/ directory exists
+    log_dir = get_log_dir()
+
+    config_filename, once, interval, workers, quiet = parse_args()
+    product_configs = load_product_configs(config_filename)
+
+    # when running in a loop, keep live order books so that setting orders does not need REST calls for the prices
+    book_client = None
+    if not once:
+        book_client = OrderBookClient([product_config['product'] for product_config in product_configs])
+        book_client.start()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            start = time.time()
+            new_orders_set = run_multi_cycle(product_configs, log_dir, quiet, executor)
+            if not quiet:
+                num_new = sum(new_orders_set.values())
+                print(f"cycle done in {time.time() - start:.2f} s, new limit orders set for {num_new}/{len(product_configs)} products")
+            if once:
+                break
+            if book_client.stop:
+                # the websocket dropped, prices come from REST until it is back
+                book_client = OrderBookClient([product_config['product'] for product_config in product_configs])
+                book_client.start()
+            time.sleep(max(0.0, interval - (time.time() - start)))
@@ -0,0 +1,102 @@
+"""open_orders.py
+
+Live set of our open limit orders, kept current from the authenticated "user" websocket channel.
+
+It is loaded once over REST with get_orders(), then every "open" message adds an order
+and every "done" message (filled or canceled) removes one, so following cron_roberto.py
+re-arming its limit orders takes no REST calls.
+The changes are also queued, so a plot can add and remove one line per order instead of redrawing them all.
+
+Example:
+open_orders = OpenOrders("ETH-USD")
+# subscribe to the "user" channel first and pass it every message with open_orders.on_message(msg), then
+open_orders.load(auth_client.get_orders(product_id="ETH-USD"))
+"""
+import threading
+
+#####   Classes   #####
+class OpenOrders:
+    """Our open limit orders of one product, or of every product if product is None.
+    Safe to update from the websocket thread while another thread reads it.
+    """
+    def __init__(self, product=None):
+        self.product = product
+        # order_id -> (side, price)
+        self.orders = {}
+        # order ids done before load() was called, so a stale REST answer does not bring them back
+        self._done_ids = set()
+        self._loaded = False
+        # ('add', order_id, side, price) and ('remove', order_id, side, price), oldest first
+        self._changes = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.orders)
+
+    def load(self, orders):
+        """Adds the open orders returned by get_orders()"""
+        with self.lock:
+            for order in orders:
+                if self.product is not None and order.get('product_id') != self.product:
+                    continue
+                if order.get('type', 'limit') != 'limit' or order['id'] in self._done_ids or order['id'] in self.orders:
+                    continue
+                self._add(order['id'], order['side'], float(order['price']))
+            self._done_ids.clear()
+            self._loaded = True
+
+    def on_message(self, msg):
+        """Handles one "user" channel message, returns True if the open orders changed"""
+        msg_type = msg.get('type')
+        if msg_type not in ('open', 'done'):
+            return False
+        if self.product is not None and msg.get('product_id') != self.product:
+            return False
+
+        order_id = msg.get('order_id')
+        with self.lock:
+            if msg_type == 'open':
+                if order_id in self.orders or 'price' not in msg:
+                    return False
+                self._add(order_id, msg['side'], float(msg['price']))
+                return True
+
+            if not self._loaded:
+                self._done_ids.add(order_id)
+            side_price = self.orders.pop(order_id, None)
+            if side_price is None:
+                return False
+            self._changes.append(('remove', order_id) + side_price)
+            return True
+
+    def get_changes(self):
+        """Returns and forgets the changes since the last call, oldest first"""
+        with self.lock:
+            changes = self._changes
+            self._changes = []
+        return changes
+
+    def get_closest(self, price):
+        """Finds the order closest to being crossed at price: a buy fills when the price falls to it,
+        a sell when the price rises to it.
+
+        Output:
+        -------
+        closest: tuple or None
+            (order_id, side, order_price, distance) with distance the fraction of price left to go,
+            negative if the order is already crossed, or None without orders
+        """
+        closest = None
+        with self.lock:
+            for order_id, (side, order_price) in self.orders.items():
+                if side == 'buy':
+                    distance = (price - order_price) / price
+                else:
+                    distance = (order_price - price) / price
+                if closest is None or distance < closest[3]:
+                    closest = (order_id, side, order_price, distance)
+        return closest
+
+    def _add(self, order_id, side, price):
+        self.orders[order_id] = (side, price)
+        self._changes.append(('add', order_id, side, price))
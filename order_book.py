@@ -0,0 +1,234 @@
+"""order_book.py
+
+In-memory level-2 order books kept up to date from the Coinbase Pro websocket feed.
+
+OrderBookClient subscribes to the "level2" channel, applies the snapshot and l2update messages
+to one L2OrderBook per product, and registers itself so that roberto.get_mid_price() and
+profits_calculator.get_current_price() read the live book instead of making a REST call.
+
+Example:
+python order_book.py ETH-USD BTC-USD
+"""
+import sys
+import time
+import signal
+import argparse
+import threading
+
+import cbpro
+from sortedcontainers import SortedDict
+
+from cbpro_client import get_websocket_url
+
+# a book which has not been updated for this many seconds is not used for prices
+MAX_BOOK_AGE = 30.0
+
+_running_clients = []
+_registry_lock = threading.Lock()
+
+#####   Classes   #####
+class L2OrderBook:
+    """Price levels of one product, price -> size, in two sorted dicts.
+    The best bid and ask are cached, so reading them is O(1), and updates are O(log n).
+    """
+    def __init__(self, product):
+        self.product = product
+        self.bids = SortedDict()
+        self.asks = SortedDict()
+        self.best_bid_price = None
+        self.best_ask_price = None
+        self.last_update = 0.0
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def _refresh_best(self):
+        self.best_bid_price = self.bids.peekitem(-1)[0] if self.bids else None
+        self.best_ask_price = self.asks.peekitem(0)[0] if self.asks else None
+
+    def apply_snapshot(self, msg):
+        """Replaces the book with a "snapshot" message"""
+        with self.lock:
+            self.bids = SortedDict((float(price), float(size)) for price, size in msg['bids'])
+            self.asks = SortedDict((float(price), float(size)) for price, size in msg['asks'])
+            self._refresh_best()
+            self.last_update = time.time()
+            self.ready = True
+
+    def apply_l2update(self, msg):
+        """Applies the changes of an "l2update" message, a size of 0 removes the price level"""
+        with self.lock:
+            for side, price, size in msg['changes']:
+                price = float(price)
+                size = float(size)
+                if side == 'buy':
+                    if size == 0.0:
+                        self.bids.pop(price, None)
+                        if price == self.best_bid_price:
+                            self.best_bid_price = self.bids.peekitem(-1)[0] if self.bids else None
+                    else:
+                        self.bids[price] = size
+                        if self.best_bid_price is None or price > self.best_bid_price:
+                            self.best_bid_price = price
+                else:
+                    if size == 0.0:
+                        self.asks.pop(price, None)
+                        if price == self.best_ask_price:
+                            self.best_ask_price = self.asks.peekitem(0)[0] if self.asks else None
+                    else:
+                        self.asks[price] = size
+                        if self.best_ask_price is None or price < self.best_ask_price:
+                            self.best_ask_price = price
+            self.last_update = time.time()
+
+    def best_bid(self):
+        """Best bid price, or None if there are no bids"""
+        return self.best_bid_price
+
+    def best_ask(self):
+        """Best ask price, or None if there are no asks"""
+        return self.best_ask_price
+
+    def mid(self):
+        """Mid of the best bid and ask, or None if one side is empty"""
+        best_bid = self.best_bid_price
+        best_ask = self.best_ask_price
+        if best_bid is None or best_ask is None:
+            return None
+        return (best_bid + best_ask) / 2
+
+    def depth_within(self, distance_percent):
+        """Total size resting within distance_percent of the mid, on each side.
+        O(log n + k), with k the number of price levels inside the distance.
+
+        Outputs:
+        --------
+        bid_depth, ask_depth: float
+            size of the bids above mid * (1 - distance) and of the asks below mid * (1 + distance)
+        """
+        with self.lock:
+            mid = self.mid()
+            if mid is None:
+                return 0.0, 0.0
+            distance = distance_percent / 100.0
+            bid_depth = sum(self.bids[price] for price in self.bids.irange(minimum=mid * (1 - distance)))
+            ask_depth = sum(self.asks[price] for price in self.asks.irange(maximum=mid * (1 + distance)))
+        return bid_depth, ask_depth
+
+    def is_fresh(self):
+        """True if the book is synced, recently updated and not crossed"""
+        if not self.ready or time.time() - self.last_update > MAX_BOOK_AGE:
+            return False
+        best_bid = self.best_bid_price
+        best_ask = self.best_ask_price
+        return best_bid is not None and best_ask is not None and best_bid < best_ask
+
+class OrderBookClient(cbpro.WebsocketClient):
+    """Websocket client keeping one L2OrderBook per product from the "level2" channel.
+    Keeps count of the messages and of the time spent applying them, see mean_message_cost().
+    """
+    def __init__(self, products, url=None):
+        if url is None:
+            url = get_websocket_url()
+        super().__init__(url=url, products=products, channels=["level2"], should_print=False)
+        self.books = {product: L2OrderBook(product) for product in products}
+        self.message_count = 0
+        self.apply_seconds = 0.0
+
+    def on_open(self):
+        register_client(self)
+
+    def on_message(self, msg):
+        start = time.perf_counter()
+        msg_type = msg.get('type')
+        if msg_type == 'l2update':
+            self.books[msg['product_id']].apply_l2update(msg)
+        elif msg_type == 'snapshot':
+            self.books[msg['product_id']].apply_snapshot(msg)
+        else:
+            return
+        self.apply_seconds += time.perf_counter() - start
+        self.message_count += 1
+
+    def on_close(self):
+        unregister_client(self)
+
+    def on_error(self, e, data=None):
+        self.error = e
+        self.stop = True
+        unregister_client(self)
+        print(f"order book websocket error: {e}")
+
+    def mean_message_cost(self):
+        """Mean seconds spent applying one snapshot or l2update message"""
+        if self.message_count == 0:
+            return 0.0
+        return self.apply_seconds / self.message_count
+
+
+#####   Functions   #####
+def register_client(client):
+    """Makes the books of client available to get_live_book()"""
+    with _registry_lock:
+        if client not in _running_clients:
+            _running_clients.append(client)
+
+def unregister_client(client):
+    with _registry_lock:
+        if client in _running_clients:
+            _running_clients.remove(client)
+
+def get_live_book(product):
+    """Returns a fresh L2OrderBook of product from a running OrderBookClient, or None if there is none"""
+    with _registry_lock:
+        clients = list(_running_clients)
+    for client in clients:
+        book = client.books.get(product)
+        if book is not None and not client.stop and book.is_fresh():
+            return book
+    return None
+
+def get_live_mid_price(product):
+    """Mid price of product from a running OrderBookClient, or None if there is no fresh book for it"""
+    book = get_live_book(product)
+    if book is None:
+        return None
+    return book.mid()
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Streams the level-2 order books of Coinbase Pro products and prints the top of book.\nExample:\npython order_book.py ETH-USD BTC-USD')
+    parser.add_argument('products', type=str, nargs='+',
+                        help='Cryptocurrency products to follow, e.g. ETH-USD BTC-USD')
+    parser.add_argument('--distance', type=float, default=1.0,
+                        help='Percent from the mid to sum the depth within.  Default is 1.0')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    products = args.products
+    distance = args.distance
+
+    return products, distance
+
+
+if __name__ == "__main__":
+    products, distance = parse_args()
+
+    book_client = OrderBookClient(products)
+
+    def signal_handler(sig, frame):
+        book_client.close()
+        sys.exit(0)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    book_client.start()
+    while True:
+        time.sleep(1)
+        for product, book in book_client.books.items():
+            if not book.ready:
+                continue
+            bid_depth, ask_depth = book.depth_within(distance)
+            print(f"{product}  bid {book.best_bid()}  ask {book.best_ask()}  mid {book.mid():.2f}  "
+                  f"depth within {distance}%: {bid_depth:.4f} / {ask_depth:.4f}")
+        print(f"{book_client.message_count} messages, {1e6 * book_client.mean_message_cost():.1f} us per message")
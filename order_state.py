@@ -0,0 +1,198 @@
+"""order_state.py
+
+Crash-safe store of the limit order pairs kept by cron_roberto.py, roberto_daemon.py and multi_roberto.py,
+replacing the log/current_order_ids_{product}.txt and log/current_ladder_ids_{product}.txt files.
+
+The pairs live in the SQLite database log/order_state.sqlite3, in WAL mode, so readers never block the writer
+and every change is one transaction: a run killed halfway leaves the old pair or the new one, never half of it.
+Every pair keeps its order ids, placement time and status: 'open' while it is live,
+'done' once one of its orders went off and the other was canceled.
+The plain pair of a product is level 0, ladder levels are 1, 2, ...
+
+Runs also take a per-product advisory lock (flock on log/locks/{product}.lock), so when a slow run
+overlaps the next cron tick, the second run finds the lock held and exits instead of placing a second pair.
+
+The old .txt files are imported the first time a product is looked up.
+"""
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, runs are not locked
+    fcntl = None
+
+STATE_DB_FILENAME = "order_state.sqlite3"
+
+# milliseconds to wait for another process writing the database
+BUSY_TIMEOUT_MS = 10000
+
+# one connection per thread and database, sqlite3 connections can't be shared between threads
+_local = threading.local()
+
+###   Functions   ###
+def get_db_path(log_dir):
+    return os.path.join(log_dir, STATE_DB_FILENAME)
+
+def connect(log_dir):
+    """Returns this thread's connection to the order state database of log_dir, creating the tables if needed.
+
+    Output:
+    -------
+    conn: sqlite3.Connection
+        connection in autocommit mode, use transaction() to write
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    db_path = get_db_path(log_dir)
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS pairs (
+                pair_id INTEGER PRIMARY KEY,
+                product TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                buy_id TEXT,
+                sell_id TEXT,
+                placed_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                closed_at REAL
+            )"""
+        )
+        # at most one live pair per product and level, found through the index
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS open_pairs ON pairs (product, level) WHERE status = 'open'")
+        conn.execute("CREATE INDEX IF NOT EXISTS product_pairs ON pairs (product, pair_id)")
+        connections[db_path] = conn
+    return conn
+
+@contextlib.contextmanager
+def transaction(conn):
+    """Write transaction, taking the database write lock up front so it never fails halfway on a busy database"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+@contextlib.contextmanager
+def product_lock(product, log_dir, blocking=False):
+    """Advisory lock of one product, shared by every process and thread using log_dir.
+
+    Inputs:
+    -------
+    product: str
+        Cryptocurrency product, e.g. ETH-USD
+    blocking: bool
+        If set, waits for the lock, otherwise gives up at once if another run holds it
+
+    Output:
+    -------
+    locked: bool
+        True if the lock is held until the end of the with block
+    """
+    if fcntl is None:
+        yield True
+        return
+    lock_dir = os.path.join(log_dir, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(lock_dir, f"{product}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+
+def is_known_product(conn, product):
+    """True if any pair of product was ever stored"""
+    return conn.execute("SELECT 1 FROM pairs WHERE product = ? LIMIT 1", (product,)).fetchone() is not None
+
+def import_text_files(conn, product, log_dir):
+    """Imports the live pairs of product from the old current_order_ids/current_ladder_ids .txt files, if any,
+    so that upgrading does not place a second pair next to the live one
+    """
+    product_underscore = product.replace('-', '_')
+    pair_filename = os.path.join(log_dir, f"current_order_ids_{product_underscore}.txt")
+    ladder_filename = os.path.join(log_dir, f"current_ladder_ids_{product_underscore}.txt")
+    rows = []
+    if os.path.exists(pair_filename):
+        with open(pair_filename, "r") as file1:
+            order_ids = [line.strip() for line in file1 if line.strip()]
+        # a file with a single id is a pair with one failed leg, the side does not matter to the checks
+        if order_ids:
+            rows.append((0, order_ids[0], order_ids[1] if len(order_ids) > 1 else None))
+    if os.path.exists(ladder_filename):
+        with open(ladder_filename, "r") as file1:
+            for line in file1:
+                fields = line.split()
+                if len(fields) == 3:
+                    rows.append((int(fields[0]), fields[1], fields[2]))
+    if not rows:
+        return
+    placed_at = os.path.getmtime(pair_filename if os.path.exists(pair_filename) else ladder_filename)
+    with transaction(conn):
+        if is_known_product(conn, product):
+            return
+        conn.executemany("INSERT INTO pairs (product, level, buy_id, sell_id, placed_at, status) VALUES (?, ?, ?, ?, ?, 'open')",
+                         [(product, level, buy_id, sell_id, placed_at) for level, buy_id, sell_id in rows])
+
+def get_open_pairs(product, log_dir):
+    """Live pairs of product.
+
+    Output:
+    -------
+    open_pairs: dict or None
+        level -> (buy_id, sell_id), with None for a leg which failed to be placed,
+        or None if no pair of product was ever stored
+    """
+    conn = connect(log_dir)
+    if not is_known_product(conn, product):
+        import_text_files(conn, product, log_dir)
+        if not is_known_product(conn, product):
+            return None
+    rows = conn.execute("SELECT level, buy_id, sell_id FROM pairs WHERE product = ? AND status = 'open'", (product,))
+    return {level: (buy_id, sell_id) for level, buy_id, sell_id in rows}
+
+def record_pair(product, buy_id, sell_id, log_dir, level=0):
+    """Stores a new live pair of product at level, closing the pair it replaces if there is one.
+    buy_id or sell_id can be None if that leg failed to be placed.
+    """
+    conn = connect(log_dir)
+    now = time.time()
+    with transaction(conn):
+        conn.execute("UPDATE pairs SET status = 'done', closed_at = ? WHERE product = ? AND level = ? AND status = 'open'",
+                     (now, product, level))
+        conn.execute("INSERT INTO pairs (product, level, buy_id, sell_id, placed_at, status) VALUES (?, ?, ?, ?, ?, 'open')",
+                     (product, level, buy_id, sell_id, now))
+
+def close_pairs(product, log_dir, levels=None):
+    """Marks the live pairs of product done, at every level or only at levels"""
+    conn = connect(log_dir)
+    now = time.time()
+    with transaction(conn):
+        if levels is None:
+            conn.execute("UPDATE pairs SET status = 'done', closed_at = ? WHERE product = ? AND status = 'open'",
+                         (now, product))
+        else:
+            conn.executemany("UPDATE pairs SET status = 'done', closed_at = ? WHERE product = ? AND level = ? AND status = 'open'",
+                             [(now, product, level) for level in levels])
+
+def get_pair_history(product, log_dir):
+    """Every pair of product ever stored, oldest first, as dicts with the columns of the pairs table"""
+    conn = connect(log_dir)
+    cursor = conn.execute("SELECT * FROM pairs WHERE product = ? ORDER BY pair_id", (product,))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
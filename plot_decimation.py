@@ -0,0 +1,163 @@
+"""plot_decimation.py
+
+Keeps the live matplotlib price plots cheap to draw, however many ticks are stored.
+
+MinMaxDecimator reduces the ticks of a TickBuffer to a min/max envelope of about two points
+per pixel column: the ticks fall into time bins, and each bin is drawn as its lowest and highest tick,
+in time order, so spikes stay visible.  Only the ticks appended since the last update are binned,
+and when there are more bins than pixels, neighbouring bins are merged pairwise,
+so the work per frame does not grow with the history.
+
+update_axes_limits() only moves the axes limits when the ticks leave them, with some headroom,
+so that with FuncAnimation(blit=True) most frames only redraw the price line.
+"""
+import numpy as np
+
+# fraction of the data range left free beyond the newest tick and around the prices
+LIMITS_HEADROOM = 0.1
+
+#####   Classes   #####
+class MinMaxDecimator:
+    """Min/max envelope of the ticks of a TickBuffer, updated incrementally.
+
+    Inputs:
+    -------
+    ticks: TickBuffer
+        ticks to decimate, times in seconds
+    max_bins: int
+        Maximum number of bins, e.g. the width of the axes in pixels.  The envelope has twice as many points.
+    bin_seconds: float
+        Starting bin width, doubled whenever there are more than max_bins bins
+    """
+    def __init__(self, ticks, max_bins=2000, bin_seconds=0.01):
+        self.ticks = ticks
+        self.max_bins = max_bins
+        self.bin_seconds = bin_seconds
+        # index of the next tick to bin, counted like TickBuffer.count
+        self.processed = 0
+        # bin id, time and price of the lowest tick, time and price of the highest tick
+        self._bins = tuple(np.empty(0, dtype=dtype) for dtype in (np.int64, np.float64, np.float64, np.float64, np.float64))
+        self._xs = np.empty(0)
+        self._ys = np.empty(0)
+
+    def __len__(self):
+        return len(self._bins[0])
+
+    def update(self):
+        """Bins the new ticks.
+
+        Outputs:
+        --------
+        xs, ys: numpy.ndarray
+            times and prices of the envelope, two points per bin
+        """
+        ticks = self.ticks
+        if ticks.count == self.processed:
+            return self._xs, self._ys
+
+        times, prices = ticks.view()
+        first = max(self.processed, ticks.start) - ticks.start
+        new_times = times[first:]
+        new_prices = prices[first:]
+        self.processed = ticks.count
+
+        # widen the bins first if the stored ticks span more than max_bins of them
+        bins = self._bins
+        span = new_times[-1] - ticks.first_time()
+        if span > self.max_bins * self.bin_seconds:
+            doublings = int(np.ceil(np.log2(span / (self.max_bins * self.bin_seconds))))
+            self.bin_seconds *= 2**doublings
+            bins = merge_bins(bins[0] >> doublings, *bins[1:])
+
+        ids = np.floor(new_times / self.bin_seconds).astype(np.int64)
+        new_bins = merge_bins(ids, new_times, new_prices, new_times, new_prices)
+        if len(bins[0]) and bins[0][-1] == new_bins[0][0]:
+            # the first new ticks belong to the last bin
+            last_bin = merge_bins(*(np.concatenate((array[-1:], new_array[:1])) for array, new_array in zip(bins, new_bins)))
+            bins = tuple(array[:-1] for array in bins)
+            new_bins = tuple(np.concatenate((last, new_array[1:])) for last, new_array in zip(last_bin, new_bins))
+        bins = tuple(np.concatenate((array, new_array)) for array, new_array in zip(bins, new_bins))
+
+        # drop the bins older than the oldest tick kept
+        oldest_id = int(np.floor(ticks.first_time() / self.bin_seconds))
+        keep = np.searchsorted(bins[0], oldest_id)
+        if keep:
+            bins = tuple(array[keep:] for array in bins)
+
+        while len(bins[0]) > self.max_bins:
+            self.bin_seconds *= 2
+            bins = merge_bins(bins[0] >> 1, *bins[1:])
+
+        self._bins = bins
+        self._xs, self._ys = get_envelope(*bins[1:])
+        return self._xs, self._ys
+
+
+#####   Functions   #####
+def merge_bins(ids, min_times, min_prices, max_times, max_prices):
+    """Merges the consecutive bins with the same id, keeping the lowest and highest tick of each.
+    ids must be sorted.  Returns the same 5 arrays, one entry per distinct id.
+    """
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    if len(starts) >= len(ids):
+        return ids, min_times, min_prices, max_times, max_prices
+    groups = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(ids)]))
+    # first lowest and last highest tick of each group
+    lowest = np.flatnonzero(min_prices == np.minimum.reduceat(min_prices, starts)[groups])
+    lowest = lowest[np.r_[True, groups[lowest][1:] != groups[lowest][:-1]]]
+    highest = np.flatnonzero(max_prices == np.maximum.reduceat(max_prices, starts)[groups])
+    highest = highest[np.r_[groups[highest][1:] != groups[highest][:-1], True]]
+    return ids[starts], min_times[lowest], min_prices[lowest], max_times[highest], max_prices[highest]
+
+def get_envelope(min_times, min_prices, max_times, max_prices):
+    """Interleaves the lowest and highest tick of each bin, in time order, into one line"""
+    min_first = min_times <= max_times
+    xs = np.empty(2 * len(min_times))
+    ys = np.empty(2 * len(min_times))
+    xs[0::2] = np.where(min_first, min_times, max_times)
+    xs[1::2] = np.where(min_first, max_times, min_times)
+    ys[0::2] = np.where(min_first, min_prices, max_prices)
+    ys[1::2] = np.where(min_first, max_prices, min_prices)
+    return xs, ys
+
+def update_axes_limits(ax, ticks, fit_prices=True, headroom=LIMITS_HEADROOM, extra_prices=(), refit=False):
+    """Moves the limits of ax when the ticks go past them, leaving headroom for the next ticks.
+
+    Inputs:
+    -------
+    ax: matplotlib.axes.Axes
+    ticks: TickBuffer
+    fit_prices: bool
+        If set, the y axis follows the prices too
+    headroom: float
+        fraction of the time span left free after the newest tick, and of the price range around the prices
+    extra_prices: sequence
+        prices the y axis has to show along with the ticks, e.g. our limit orders
+    refit: bool
+        If set, the y axis is fitted again even if the prices are within its limits, e.g. after extra_prices changed
+
+    Output:
+    -------
+    changed: bool
+        True if the limits moved, then the whole figure has to be redrawn
+    """
+    if not len(ticks):
+        return False
+    x_min = ticks.first_time()
+    x_max = ticks.last()[0]
+    x_low, x_high = ax.get_xlim()
+    changed = False
+    if x_max > x_high or x_min < x_low:
+        span = max(x_max - x_min, 1.0)
+        ax.set_xlim([x_min, x_max + headroom * span])
+        changed = True
+
+    if fit_prices:
+        y_min = min([ticks.min(), *extra_prices])
+        y_max = max([ticks.max(), *extra_prices])
+        y_low, y_high = ax.get_ylim()
+        if changed or refit or y_min < y_low or y_max > y_high:
+            margin = 0.5 * headroom * max(y_max - y_min, 1e-3 * abs(y_max), 1e-9)
+            ax.set_ylim([y_min - margin, y_max + margin])
+            changed = True
+    return changed
@@ -4,58 +4,68 @@ and plots it live using pyqtgraph.
 """
 import sys
 import time
-import json
 import cbpro
-import datetime
 import signal
 
 import matplotlib as mpl
-mpl.use('TkAgg')
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-import numpy as np
 
-from dotenv import dotenv_values
+from cbpro_client import get_auth_client, get_websocket_url, load_config
+from ticker_ingest import TickerIngest
+from tick_recorder import TickRecorder
+from plot_decimation import MinMaxDecimator, update_axes_limits
+from open_orders import OpenOrders
+
+# Ticks kept for plotting: at most TICK_CAPACITY ticks, from the last TICK_WINDOW_SECONDS (None for no time limit)
+TICK_CAPACITY = 100000
+TICK_WINDOW_SECONDS = 3600.0
+# Recorder mode: channels saved to data/ticks/ for later replay with tick_recorder.replay(),
+# e.g. ["ticker"] or ["ticker", "matches", "level2"].  Empty to record nothing.
+RECORD_CHANNELS = []
+# colors of the limit order lines
+ORDER_COLORS = {"sell": "C2", "buy": "C3"}
 
 #####   Classes   #####
 class MyWebsocketClient(cbpro.WebsocketClient):
+    """Pass auth=True and the API credentials, see __main__, to follow our limit orders on the "user" channel.
+    Without them only the prices are streamed.
+    """
     def on_open(self):
-        self.url = "wss://ws-feed.pro.coinbase.com/"
+        self.url = get_websocket_url()
         self.products = ["ETH-USD"]
         self.channels = ["ticker"]
+        if self.auth:
+            # our limit orders come on the authenticated "user" channel, along with the prices
+            self.channels.append("user")
         self.message_count = 0
-        self.prices = []
-        self.times = []
-        self.start_datetime = 0
+        self.ingest = TickerIngest(self.products, TICK_CAPACITY, TICK_WINDOW_SECONDS)
+        self.ticks = self.ingest.buffers[self.products[0]]
+        self.open_orders = OpenOrders(self.products[0])
+        self.recorder = None
+        if RECORD_CHANNELS:
+            self.channels = sorted(set(self.channels) | set(RECORD_CHANNELS))
+            self.recorder = TickRecorder(RECORD_CHANNELS)
         # print("Let's count the messages!")
         return
 
     def on_message(self, data_dict):
-        # data_dict = msg #json.dumps(msg, indent=4, sort_keys=True)
-        if data_dict["type"] == "ticker":
-            temp_price = float(data_dict["price"])
-
-            # Get number of seconds from the first ticker price
-            temp_datetime = get_datetime_from_utc(data_dict["time"])
-            # Save the first ticker price datetime
-            if self.start_datetime == 0:
-                self.start_datetime = temp_datetime
-            # Compare now vs first ticker price time
-            temp_delta_time = temp_datetime - self.start_datetime
-            temp_time = temp_delta_time.total_seconds()
-
-            self.prices.append( temp_price )
-            self.times.append( temp_time )
-
-        # print(data_dict)
+        # Tick times are the number of seconds from the first ticker price
+        if not self.ingest.on_message(data_dict):
+            self.open_orders.on_message(data_dict)
+        if self.recorder is not None:
+            self.recorder.record(data_dict)
         self.message_count += 1
         return
 
     def on_close(self):
+        if self.recorder is not None:
+            self.recorder.close()
         print('\033[96m')
         print("Time,\tPrice")
         print('\033[0m')
-        for time, price in zip(self.times, self.prices):
+        times, prices = self.ticks.view()
+        for time, price in zip(times, prices):
             print(f"{time},\t", end='')
             print('\033[92m', end='')
             print(f"{price}", end='')
@@ -64,6 +74,79 @@ class MyWebsocketClient(cbpro.WebsocketClient):
         return
 
 
+class OrderOverlay:
+    """Horizontal lines of our open limit orders on ax, one per order,
+    and a dashed line with a label on the order closest to being crossed.
+    All of them, and the legend, are blitted artists, see get_artists(),
+    so the background saved by FuncAnimation(blit=True) never holds an old order line.
+
+    Inputs:
+    -------
+    ax: matplotlib.axes.Axes
+    open_orders: OpenOrders
+        kept current by the websocket client
+    """
+    def __init__(self, ax, open_orders):
+        self.ax = ax
+        self.open_orders = open_orders
+        # order_id -> Line2D
+        self.lines = {}
+        self.closest_line = ax.axhline(0.0, lw=3.0, ls='--', color="k", alpha=0.5, visible=False)
+        self.closest_text = ax.text(0.99, 0.02, "", transform=ax.transAxes, ha='right', va='bottom')
+        self.legend = None
+
+    def update(self, price):
+        """Adds and removes the lines of the orders opened and done since the last call,
+        and moves the closest order marker to price.
+
+        Output:
+        -------
+        changed: bool
+            True if order lines were added or removed
+        """
+        changes = self.open_orders.get_changes()
+        for change, order_id, side, order_price in changes:
+            if change == "add":
+                # animated from the start, so a full redraw in the same frame leaves it out of the background
+                self.lines[order_id] = self.ax.axhline(order_price, lw=1.5, color=ORDER_COLORS[side],
+                                                       label=f"{side} {order_price:.2f}", animated=True)
+            else:
+                line = self.lines.pop(order_id, None)
+                if line is not None:
+                    line.remove()
+        if changes:
+            if self.lines:
+                self.legend = self.ax.legend(handles=list(self.lines.values()), loc='upper left')
+                self.legend.set_animated(True)
+            elif self.legend is not None:
+                self.legend.remove()
+                self.legend = None
+
+        closest = None
+        if price is not None:
+            closest = self.open_orders.get_closest(price)
+        if closest is None:
+            self.closest_line.set_visible(False)
+            self.closest_text.set_text("")
+        else:
+            order_id, side, order_price, distance = closest
+            self.closest_line.set_ydata([order_price, order_price])
+            self.closest_line.set_visible(True)
+            self.closest_text.set_text(f"closest: {side} {order_price:.2f}, {100.0 * distance:.2f}% away")
+        return bool(changes)
+
+    def get_prices(self):
+        """Prices of the order lines"""
+        return [line.get_ydata()[0] for line in self.lines.values()]
+
+    def get_artists(self):
+        """Artists redrawn on every frame"""
+        artists = (self.closest_line, self.closest_text) + tuple(self.lines.values())
+        if self.legend is not None:
+            artists += (self.legend,)
+        return artists
+
+
 #####   Functions   #####
 def signal_handler(sig, frame):
     print('\033[91m')
@@ -75,13 +158,6 @@ def signal_handler(sig, frame):
     sys.exit(0) 
     return 
 
-def get_datetime_from_utc(utc_date_string):
-    """Takes in utc_date_string, like '2021-11-25T22:52:29.119195Z'
-    Returns the corresponding datetime object.
-    """
-    dt = datetime.datetime.strptime(utc_date_string, '%Y-%m-%dT%H:%M:%S.%fZ')
-    return dt
-
 def get_orders_dict(orders):
     """Form a dictionary of current order buys and sells
     """
@@ -109,55 +185,47 @@ def init():
     ax.set_title('ETH price [$]')
     ax.set_xlabel('Time [seconds]')
     
-    ax.grid()
+    ax.grid(True)
+
+    # about two points per pixel column, also called again when the window is resized
+    decimator.max_bins = max(100, int(ax.bbox.width))
 
     line = ax.lines[0]
     line.set_data([], [])
-    return line,
+    return (line,) + overlay.get_artists()
 
-def animate(i, xs, ys, orders_dict):
-    """Animate the matplotlib plot.
+def animate(i, decimator, overlay):
+    """Animate the matplotlib plot with the min/max envelope of the ticks in the buffer,
+    and the limit orders opened or done since the last frame.
+    The price line and the order overlay are blitted,
+    the whole figure is only redrawn when the axes limits move, for the ticks or for the orders.
     """
-    # print('\033[91m')
-    # print(f"xs: {xs}")
-    # print(f"ys: {ys}")
-    # print('\033[0m')
-    try:
-        xs_max = max(xs)
-        ys_min = min(ys)
-        ys_max = max(ys)
-    except ValueError:
-        xs_max = 1.0
-
-    ax.set_xlim([0.0, xs_max])
-    # ax.set_ylim([ys_min, ys_max])
-
-    lines = ax.lines
-    main_line = lines[0]
-    main_line.set_xdata(xs)
-    main_line.set_ydata(ys)
-
-    for line in lines[1:]:
-        line.set_xdata([0.0, xs_max])
-     
-    return main_line,
+    main_line = ax.lines[0]
+    ticks = decimator.ticks
+    last_tick = ticks.last()
+
+    orders_changed = overlay.update(None if last_tick is None else last_tick[1])
+    if len(ticks):
+        xs, ys = decimator.update()
+        main_line.set_data(xs, ys)
+        # the y axis follows the prices and shows every order line
+        if update_axes_limits(ax, ticks, extra_prices=overlay.get_prices(), refit=orders_changed):
+            fig.canvas.draw()
+
+    return (main_line,) + overlay.get_artists()
         
 
 if __name__ == "__main__":
+    # only when run as a script, so importing this module, e.g. in benchmarks.py, needs no display
+    mpl.use('TkAgg')
 
     # initialize API
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
-
-    # Get user limit orders
-    orders = auth_client.get_orders()
-    orders_dict = get_orders_dict(orders)
-    
+    auth_client = get_auth_client()
+
     # Set up the web socket with coinbase pro
-    wsClient = MyWebsocketClient()
+    config = load_config()
+    wsClient = MyWebsocketClient(auth=True, api_key=config['API_KEY'], api_secret=config['API_SECRET'],
+                                 api_passphrase=config['PASSPHRASE'])
     # After creating the class object, we want to register the Ctrl-C signal catcher,
     # which will automatically close the object upon Ctrl-C of the plot
     signal.signal(signal.SIGINT, signal_handler)
@@ -165,6 +233,10 @@ if __name__ == "__main__":
     wsClient.start()
     print(wsClient.url, wsClient.products)
 
+    # Get user limit orders once, the "user" channel keeps them current from here on
+    orders = auth_client.get_orders(product_id=wsClient.products[0])
+    wsClient.open_orders.load(orders)
+
     # try:
     #     while True:
     #         print("\nMessageCount =", "%i \n" % wsClient.message_count)
@@ -181,16 +253,9 @@ if __name__ == "__main__":
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1)
     line, = ax.plot([], [], lw=1.5)
-
-    for buysell, prices in orders_dict.items():
-        for jj, price in enumerate(prices):
-            if buysell == "sells":
-                ax.plot([0.0, 1.0], [price, price], lw=1.5, color="C2", label=f"{buysell} {jj}")
-            if buysell == "buys":
-                ax.plot([0.0, 1.0], [price, price], lw=1.5, color="C3", label=f"{buysell} {jj}")
-
-    ax.legend(loc='upper left')
+    decimator = MinMaxDecimator(wsClient.ticks)
+    overlay = OrderOverlay(ax, wsClient.open_orders)
 
     # Set up plot to call animate() function periodically
-    ani = animation.FuncAnimation(fig, animate, init_func=init, fargs=(wsClient.times, wsClient.prices, orders_dict), interval=200)
+    ani = animation.FuncAnimation(fig, animate, init_func=init, fargs=(decimator, overlay), interval=200, blit=True)
     plt.show()
\ No newline at end of file
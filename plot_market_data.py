@@ -4,54 +4,56 @@ and plots it live using pyqtgraph.
 """
 import sys
 import time
-import json
 import cbpro
-import datetime
 import signal
 
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-import numpy as np
+
+from cbpro_client import get_websocket_url
+from ticker_ingest import TickerIngest
+from tick_recorder import TickRecorder
+from plot_decimation import MinMaxDecimator, update_axes_limits
+
+# Ticks kept for plotting: at most TICK_CAPACITY ticks, from the last TICK_WINDOW_SECONDS (None for no time limit)
+TICK_CAPACITY = 100000
+TICK_WINDOW_SECONDS = 3600.0
+# Recorder mode: channels saved to data/ticks/ for later replay with tick_recorder.replay(),
+# e.g. ["ticker"] or ["ticker", "matches", "level2"].  Empty to record nothing.
+RECORD_CHANNELS = []
 
 #####   Classes   #####
 class MyWebsocketClient(cbpro.WebsocketClient):
     def on_open(self):
-        self.url = "wss://ws-feed.pro.coinbase.com/"
+        self.url = get_websocket_url()
         self.products = ["ETH-USD"]
         self.channels = ["ticker"]
         self.message_count = 0
-        self.prices = []
-        self.times = []
-        self.start_datetime = 0
+        self.ingest = TickerIngest(self.products, TICK_CAPACITY, TICK_WINDOW_SECONDS)
+        self.ticks = self.ingest.buffers[self.products[0]]
+        self.recorder = None
+        if RECORD_CHANNELS:
+            self.channels = sorted(set(self.channels) | set(RECORD_CHANNELS))
+            self.recorder = TickRecorder(RECORD_CHANNELS)
         # print("Let's count the messages!")
         return
 
     def on_message(self, data_dict):
-        # data_dict = msg #json.dumps(msg, indent=4, sort_keys=True)
-        if data_dict["type"] == "ticker":
-            temp_price = float(data_dict["price"])
-
-            # Get number of seconds from the first ticker price
-            temp_datetime = get_datetime_from_utc(data_dict["time"])
-            # Save the first ticker price datetime
-            if self.start_datetime == 0:
-                self.start_datetime = temp_datetime
-            # Compare now vs first ticker price time
-            temp_delta_time = temp_datetime - self.start_datetime
-            temp_time = temp_delta_time.total_seconds()
-
-            self.prices.append( temp_price )
-            self.times.append( temp_time )
-
-        # print(data_dict)
+        # Tick times are the number of seconds from the first ticker price
+        self.ingest.on_message(data_dict)
+        if self.recorder is not None:
+            self.recorder.record(data_dict)
         self.message_count += 1
         return
 
     def on_close(self):
+        if self.recorder is not None:
+            self.recorder.close()
         print('\033[96m')
         print("Time,\tPrice")
         print('\033[0m')
-        for time, price in zip(self.times, self.prices):
+        times, prices = self.ticks.view()
+        for time, price in zip(times, prices):
             print(f"{time},\t", end='')
             print('\033[92m', end='')
             print(f"{price}", end='')
@@ -71,13 +73,6 @@ def signal_handler(sig, frame):
     sys.exit(0) 
     return 
 
-def get_datetime_from_utc(utc_date_string):
-    """Takes in utc_date_string, like '2021-11-25T22:52:29.119195Z'
-    Returns the corresponding datetime object.
-    """
-    dt = datetime.datetime.strptime(utc_date_string, '%Y-%m-%dT%H:%M:%S.%fZ')
-    return dt
-
 def init():
     """Initialize matplotlib animation plot.
     """
@@ -88,28 +83,29 @@ def init():
     ax.set_title('ETH price [$]')
     ax.set_xlabel('Time [seconds]')
     
-    ax.grid()
+    ax.grid(True)
+
+    # about two points per pixel column, also called again when the window is resized
+    decimator.max_bins = max(100, int(ax.bbox.width))
 
     line = ax.lines[0]
     line.set_data([], [])
     return line,
 
-def animate(i, xs, ys):
-    # print('\033[91m')
-    # print(f"xs: {xs}")
-    # print(f"ys: {ys}")
-    # print('\033[0m')
-    
-    xs_max = max(xs)
-    ys_min = min(ys)
-    ys_max = max(ys)
+def animate(i, decimator):
+    """Animate the matplotlib plot with the min/max envelope of the ticks in the buffer.
+    Only the price line is redrawn (blitted), unless the ticks went past the axes limits.
+    """
+    line = ax.lines[0]
+    ticks = decimator.ticks
+    if not len(ticks):
+        return line,
 
-    ax.set_xlim([0.0, xs_max])
-    ax.set_ylim([ys_min, ys_max])
+    xs, ys = decimator.update()
+    line.set_data(xs, ys)
 
-    line = ax.lines[0]
-    line.set_xdata(xs)
-    line.set_ydata(ys)
+    if update_axes_limits(ax, ticks):
+        fig.canvas.draw()
 
     return line,
 
@@ -139,7 +135,8 @@ if __name__ == "__main__":
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1)
     line, = ax.plot([], [], lw=1.5)
+    decimator = MinMaxDecimator(wsClient.ticks)
 
     # Set up plot to call animate() function periodically
-    ani = animation.FuncAnimation(fig, animate, init_func=init, fargs=(wsClient.times, wsClient.prices), interval=200)
+    ani = animation.FuncAnimation(fig, animate, init_func=init, fargs=(decimator,), interval=200, blit=True)
     plt.show()
\ No newline at end of file
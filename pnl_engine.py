@@ -0,0 +1,242 @@
+"""pnl_engine.py
+
+Cost basis and realized / unrealized profit and loss of your filled orders, computed with NumPy.
+
+The fills of one or many products are held as NumPy arrays (see fills_from_orders()),
+and every sell is matched against the lots bought before it, either first in first out (FIFO)
+or at the average cost of the position.  Buy fees go into the cost of the lots and sell fees come out of the proceeds,
+so the realized PnL is net of fees, and the fees are also reported on their own.
+
+FIFO is fully vectorized: the lots form a piecewise linear cumulative cost curve C(q) over the cumulative quantity bought,
+and the cost of the sell taking the quantities q0 to q1 is C(q1) - C(q0), found for every sell at once with np.searchsorted.
+
+Sells of coins bought before the first fill, e.g. transferred in, would leave the position negative:
+they are matched against an opening lot just big enough to cover them, at opening_price.
+
+profits_calculator.py prints the PnL of every product with print_pnl(), e.g.
+python profits_calculator.py --products ETH-USD BTC-USD --cost-method average
+"""
+import numpy as np
+
+METHODS = ('fifo', 'average')
+
+###   Functions   ###
+def fills_from_orders(orders):
+    """Converts the done orders of auth_client.get_orders(), or ledger_store.iter_orders(), to fill arrays.
+    Every done order with a filled size is one fill at its average execution price.
+
+    Output:
+    -------
+    fills: dict
+        numpy arrays of the same length, sorted by time:
+        'timestamps' (int64 epoch nanoseconds), 'products', 'sides' (+1 buy, -1 sell), 'sizes', 'prices', 'fees'
+    """
+    times = []
+    products = []
+    sides = []
+    sizes = []
+    values = []
+    fees = []
+    for order in orders:
+        if order.get('status') != 'done':
+            continue
+        size = order.get('filled_size', order.get('size'))
+        if size is None or float(size) <= 0.0:
+            continue
+        times.append((order.get('done_at') or order['created_at']).rstrip('Z'))
+        products.append(order['product_id'])
+        sides.append(1 if order['side'] == 'buy' else -1)
+        sizes.append(size)
+        values.append(order['executed_value'])
+        fees.append(order['fill_fees'])
+
+    sizes = np.array(sizes, dtype=np.float64)
+    fills = {
+        'timestamps': np.array(times, dtype='datetime64[ns]').astype(np.int64),
+        'products': np.array(products, dtype=str),
+        'sides': np.array(sides, dtype=np.int8),
+        'sizes': sizes,
+        'prices': np.array(values, dtype=np.float64) / np.where(sizes > 0.0, sizes, 1.0),
+        'fees': np.array(fees, dtype=np.float64),
+    }
+    order_by_time = np.argsort(fills['timestamps'], kind='stable')
+    return {key: column[order_by_time] for key, column in fills.items()}
+
+def get_opening_size(sides, sizes):
+    """Smallest position held before the first fill which keeps the position from going negative"""
+    signed_sizes = np.where(sides > 0, sizes, -sizes)
+    positions = np.cumsum(signed_sizes)
+    if not len(positions):
+        return 0.0
+    return max(0.0, -float(positions.min()))
+
+def compute_fifo_pnl(sides, sizes, prices, fees, opening_size, opening_price):
+    """Cost of every sell, matching it against the oldest lots still held.
+
+    Output:
+    -------
+    sell_costs: numpy.ndarray
+        cost basis of the coins sold by every fill, 0 for buys
+    remaining_cost: float
+        cost basis of the position left
+    """
+    buys = sides > 0
+    lot_sizes = np.concatenate(([opening_size], sizes[buys]))
+    lot_costs = np.concatenate(([opening_size * opening_price], sizes[buys] * prices[buys] + fees[buys]))
+    keep = lot_sizes > 0.0
+    lot_sizes = lot_sizes[keep]
+    lot_costs = lot_costs[keep]
+    # cumulative quantity and cost at the start of every lot
+    lot_starts = np.concatenate(([0.0], np.cumsum(lot_sizes)))
+    cost_starts = np.concatenate(([0.0], np.cumsum(lot_costs)))
+    unit_costs = lot_costs / np.where(lot_sizes > 0.0, lot_sizes, 1.0)
+
+    def cumulative_cost(quantities):
+        lots = np.clip(np.searchsorted(lot_starts, quantities, side='right') - 1, 0, max(len(lot_sizes) - 1, 0))
+        if not len(lot_sizes):
+            return np.zeros_like(quantities)
+        return cost_starts[lots] + (quantities - lot_starts[lots]) * unit_costs[lots]
+
+    sells = ~buys
+    sold_ends = np.cumsum(sizes[sells])
+    sold_starts = sold_ends - sizes[sells]
+    sell_costs = np.zeros(len(sizes))
+    sell_costs[sells] = cumulative_cost(sold_ends) - cumulative_cost(sold_starts)
+
+    total_sold = sold_ends[-1] if len(sold_ends) else 0.0
+    remaining_cost = float(cost_starts[-1] - cumulative_cost(np.array([total_sold]))[0])
+    return sell_costs, remaining_cost
+
+def compute_average_cost_pnl(sides, sizes, prices, fees, opening_size, opening_price):
+    """Cost of every sell at the average cost of the position.
+    The average only changes on buys, which makes it a recurrence, so this one is a loop over plain floats.
+
+    Output:
+    -------
+    sell_costs: numpy.ndarray
+        cost basis of the coins sold by every fill, 0 for buys
+    remaining_cost: float
+        cost basis of the position left
+    """
+    position = opening_size
+    cost = opening_size * opening_price
+    sell_costs = [0.0] * len(sizes)
+    for ii, (side, size, price, fee) in enumerate(zip(sides.tolist(), sizes.tolist(), prices.tolist(), fees.tolist())):
+        if side > 0:
+            position += size
+            cost += size * price + fee
+        else:
+            sell_cost = cost * size / position if position > 0.0 else 0.0
+            sell_costs[ii] = sell_cost
+            position -= size
+            cost -= sell_cost
+    return np.array(sell_costs), cost
+
+def compute_pnl(fills, current_price, method='fifo', opening_price=None):
+    """Realized and unrealized PnL of the fills of one product.
+
+    Inputs:
+    -------
+    fills: dict
+        fill arrays of one product, sorted by time, see fills_from_orders()
+    current_price: float
+        mid price the position left is valued at
+    method: str
+        'fifo' or 'average'
+    opening_price: float
+        cost per coin of the opening lot, if one is needed.  Defaults to the price of the first fill
+
+    Output:
+    -------
+    pnl: dict
+        'realized' (numpy array, realized PnL of every fill net of fees, 0 for buys), 'cumulative_realized',
+        'realized_pnl', 'unrealized_pnl', 'total_pnl', 'fees', 'buy_fees', 'sell_fees',
+        'position', 'cost_basis', 'average_cost', 'opening_size', 'opening_price', 'num_buys', 'num_sells'
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not {method}")
+    sides = fills['sides']
+    sizes = fills['sizes']
+    prices = fills['prices']
+    fees = fills['fees']
+    buys = sides > 0
+
+    opening_size = get_opening_size(sides, sizes)
+    if opening_price is None:
+        opening_price = float(prices[0]) if len(prices) else 0.0
+
+    compute = compute_fifo_pnl if method == 'fifo' else compute_average_cost_pnl
+    sell_costs, remaining_cost = compute(sides, sizes, prices, fees, opening_size, opening_price)
+
+    proceeds = np.where(buys, 0.0, sizes * prices - fees)
+    realized = np.where(buys, 0.0, proceeds - sell_costs)
+    position = opening_size + float(sizes[buys].sum() - sizes[~buys].sum())
+    # round-off of the cumulative sums, a position sold out is exactly 0
+    if abs(position) < 1e-12:
+        position = 0.0
+        remaining_cost = 0.0
+    unrealized_pnl = position * current_price - remaining_cost
+
+    pnl = {}
+    pnl['realized'] = realized
+    pnl['cumulative_realized'] = np.cumsum(realized)
+    pnl['realized_pnl'] = float(realized.sum())
+    pnl['unrealized_pnl'] = float(unrealized_pnl)
+    pnl['total_pnl'] = pnl['realized_pnl'] + pnl['unrealized_pnl']
+    pnl['buy_fees'] = float(fees[buys].sum())
+    pnl['sell_fees'] = float(fees[~buys].sum())
+    pnl['fees'] = pnl['buy_fees'] + pnl['sell_fees']
+    pnl['position'] = position
+    pnl['cost_basis'] = float(remaining_cost)
+    pnl['average_cost'] = float(remaining_cost / position) if position > 0.0 else 0.0
+    pnl['opening_size'] = opening_size
+    pnl['opening_price'] = opening_price
+    pnl['num_buys'] = int(buys.sum())
+    pnl['num_sells'] = int(len(sides) - buys.sum())
+    return pnl
+
+def compute_pnl_by_product(fills, current_prices, method='fifo'):
+    """compute_pnl() for every product in fills.
+
+    Inputs:
+    -------
+    fills: dict
+        fill arrays of any number of products, sorted by time, see fills_from_orders()
+    current_prices: dict
+        product -> mid price
+
+    Output:
+    -------
+    pnls: dict
+        product -> pnl dict of compute_pnl()
+    """
+    products, product_codes = np.unique(fills['products'], return_inverse=True)
+    # one stable sort groups the fills by product and keeps them in time order
+    order_by_product = np.argsort(product_codes, kind='stable')
+    bounds = np.searchsorted(product_codes[order_by_product], np.arange(len(products) + 1))
+    pnls = {}
+    for ii, product in enumerate(products):
+        rows = order_by_product[bounds[ii]:bounds[ii + 1]]
+        product_fills = {key: column[rows] for key, column in fills.items()}
+        pnls[str(product)] = compute_pnl(product_fills, current_prices[str(product)], method)
+    return pnls
+
+def print_pnl(product, pnl, method='fifo'):
+    """Pretty prints the PnL of product"""
+    product_split = product.split('-')
+    product_bought = product_split[0]
+    product_sold = product_split[1]
+
+    print("\033[93m")
+    print(f"PnL {product} ({method})")
+    print("=============")
+    print("\033[0m", end="")
+    print(f"Realized     {pnl['realized_pnl']:12.2f} {product_sold}  ({pnl['num_sells']} sells, {pnl['num_buys']} buys)")
+    print(f"Unrealized   {pnl['unrealized_pnl']:12.2f} {product_sold}  ({pnl['position']} {product_bought} at {pnl['average_cost']:.2f} {product_sold} average cost)")
+    print(f"Total        {pnl['total_pnl']:12.2f} {product_sold}")
+    print(f"Fees         {pnl['fees']:12.2f} {product_sold}  ({pnl['buy_fees']:.2f} buys, {pnl['sell_fees']:.2f} sells, included above)")
+    if pnl['opening_size'] > 0.0:
+        print(f"Opening lot  {pnl['opening_size']} {product_bought} at {pnl['opening_price']:.2f} {product_sold}, sold before any buy")
+    print()
+
+    return
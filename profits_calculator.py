@@ -1,14 +1,18 @@
 import os
-import cbpro
-from dotenv import dotenv_values
 import argparse
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
 import pprint
+
+import ledger_store
+import pnl_engine
+from cbpro_client import get_auth_client
+from order_book import get_live_mid_price
 ###   Functions   ###
 def get_datetime_from_utc(utc_date_string):
     """Takes in utc_date_string, like '2021-11-25T22:52:29.119195Z'
@@ -20,62 +24,83 @@ def get_datetime_from_utc(utc_date_string):
 def parse_args():
     """Parses the user command line arguments
     """
-    parser = argparse.ArgumentParser(description='Calculates the overall profits from limit orders on a product in Coinbase Pro.\nExample:\npython profits_calculator.py ETH-USD')
-    parser.add_argument('product', type=str, 
+    parser = argparse.ArgumentParser(description='Calculates the overall profits from limit orders on a product in Coinbase Pro.\nExample:\npython profits_calculator.py ETH-USD\npython profits_calculator.py --products ETH-USD BTC-USD MATIC-USD')
+    parser.add_argument('product', type=str, nargs='?', default=None,
                         help='Cryptocurrency product to calculate profits for, e.g. ETH-USD, BTC-USD, MATIC-USD')
+    parser.add_argument('--products', type=str, nargs='+', default=None,
+                        help='Cryptocurrency products to calculate profits for in one run, instead of product, e.g. ETH-USD BTC-USD')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of ledgers and order lists downloaded at the same time.  Default is 8')
+    parser.add_argument('--cost-method', type=str, default='fifo', choices=pnl_engine.METHODS,
+                        help='Cost basis of the realized and unrealized PnL, first in first out or average cost.  Default is fifo')
+    parser.add_argument('--resync', action='store_true',
+                        help='Flag.  If set, deletes the locally stored account ledgers and orders and downloads them again from scratch.')
+    parser.add_argument('--since', type=str, default=None,
+                        help='UTC date or time, e.g. 2021-11-25.  If set, only the filled orders created since then are listed.')
     parser.add_argument('--quiet', '-q', action='store_true',
                         help='Flag.  If set, runs code in quiet mode.')
 
     args = parser.parse_args()
 
+    if (args.product is None) == (args.products is None):
+        parser.error("give either product or --products")
+
     # Don't use namespaces
-    product = args.product
+    products = args.products if args.products is not None else [args.product]
+    resync = args.resync
+    since = args.since
+    workers = args.workers
+    cost_method = args.cost_method
     quiet = args.quiet
 
     if not quiet:
-        print(f"product = {product}")
-        print(f"quiet   = {quiet}")
+        print(f"products    = {products}")
+        print(f"resync      = {resync}")
+        print(f"since       = {since}")
+        print(f"workers     = {workers}")
+        print(f"cost_method = {cost_method}")
+        print(f"quiet       = {quiet}")
 
-    return product, quiet
+    return products, resync, since, workers, cost_method, quiet
 
-def get_list_of_order_ids(product, status='all'):
-    """Simple function which gets all open limit orders from Coinbase pro API.
+def get_list_of_order_ids(product, status='all', since=None, resync=False):
+    """Simple function which gets the limit orders of product, newest first.
+    Only the orders that are new or changed since the last run are downloaded,
+    the rest are read from the local store in data/ledger.sqlite3.
 
     Input:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    status: str
+        order status to keep, e.g. done, or all
+    since: str
+        UTC date or time, e.g. 2021-11-25.  If set, only the orders created since then are synced and returned
+    resync: bool
+        Flag. If set, throws away the stored orders and downloads them again
     """
     # initialize
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
-
-    # get the current order ids
-    orders = auth_client.get_orders(product, status=status)
-    list_orders = list(orders)
-    current_order_list = []
-    for order in list_orders:
-        if order['product_id'] == product:
-            current_order_list.append(order)
-    return current_order_list
+    auth_client = get_auth_client()
+
+    # sync the local copy, then read it
+    ledger_store.sync_orders(auth_client, product, since=since, resync=resync)
+    return list(ledger_store.iter_orders(product, since=since, status=None if status == 'all' else status))
 
 def get_current_price(product):
     """Gets current price of product on Coinbase pro.
+    Reads it from a running order_book.OrderBookClient if there is one, otherwise asks the REST API.
 
     Input:
     ------
     product: str
         Cryptocurrency product set limit orders on 
     """
+    current_price = get_live_mid_price(product)
+    if current_price is not None:
+        return current_price
+
     # initialize
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+    auth_client = get_auth_client()
 
     # retrieve current price
     order_book = auth_client.get_product_order_book(product)
@@ -179,11 +204,103 @@ def print_filled_orders_info(product, list_orders):
 
     return
 
+def parse_utc_timestamps_ns(utc_date_strings):
+    """Takes in a sequence of utc_date_strings without the trailing 'Z', like '2021-11-25T22:52:29.119195'
+    Returns the corresponding int64 epoch nanoseconds, parsed in bulk by numpy.
+    """
+    return np.array(utc_date_strings, dtype='datetime64[ns]').astype(np.int64)
+
+class AccountHistoryBuilder:
+    """Columnar builder for process_account_history.
+    Ledger entries are collected into plain lists and converted to numpy arrays every chunk_size entries,
+    so each entry is only touched once and the memory held in python objects stays bounded.
+    """
+    def __init__(self, product, chunk_size=65536):
+        self.product = product
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self.created_ats = []
+        self.balances = []
+        self.amounts = []
+        self.types = []
+        self.product_ids = []
+
+    def _flush_chunk(self):
+        if not self.created_ats:
+            return
+        chunk = {}
+        chunk['timestamps'] = parse_utc_timestamps_ns(self.created_ats)
+        chunk['balances'] = np.array(self.balances).astype(np.float64)
+        chunk['amounts'] = np.array(self.amounts).astype(np.float64)
+        chunk['types'] = np.array(self.types)
+        chunk['product_ids'] = np.array(self.product_ids)
+        self.chunks.append(chunk)
+        self._new_chunk()
+
+    def add(self, trade):
+        """Adds one ledger entry dict from the Coinbase Pro API"""
+        self.created_ats.append(trade['created_at'].rstrip('Z'))
+        self.balances.append(trade['balance'])
+        self.amounts.append(trade['amount'])
+        trade_type = trade['type']
+        self.types.append(trade_type)
+        if trade_type == 'match':
+            self.product_ids.append(trade['details']['product_id'])
+        else:
+            self.product_ids.append('')
+        if len(self.created_ats) >= self.chunk_size:
+            self._flush_chunk()
+
+    def build(self):
+        """Concatenates the chunks and returns the account_history dictionary, sorted by time"""
+        self._flush_chunk()
+        if self.chunks:
+            columns = {}
+            for key in self.chunks[0]:
+                columns[key] = np.concatenate([chunk[key] for chunk in self.chunks])
+        else:
+            columns = {
+                'timestamps': np.array([], dtype=np.int64),
+                'balances': np.array([], dtype=np.float64),
+                'amounts': np.array([], dtype=np.float64),
+                'types': np.array([], dtype=str),
+                'product_ids': np.array([], dtype=str),
+            }
+
+        amounts = columns['amounts']
+        types = columns['types']
+
+        # Transfers in and out of the account
+        total_transfer = float(amounts[types == 'transfer'].sum())
+
+        # Quick fix for buys/sells that were not with the product under consideration
+        # We will track exchanges with other crypto as a general other_crypto float
+        other_crypto_mask = (types == 'match') & (columns['product_ids'] != self.product)
+        other_crypto = float(amounts[other_crypto_mask].sum())
+
+        # sort by time, the API returns the newest entries first
+        timestamps = columns['timestamps'][::-1]
+        indices = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[indices]
+
+        account_history = {}
+        account_history['datetimes'] = timestamps.view('datetime64[ns]')
+        account_history['timestamps'] = timestamps
+        account_history['balances'] = columns['balances'][::-1][indices]
+        account_history['amounts'] = amounts[::-1][indices]
+        account_history['total_transfer'] = total_transfer
+        account_history['other_crypto'] = other_crypto
+
+        return account_history
+
 def process_account_history(product, account_generator):
     """Processes the generator returned by Coinbase Pro API,
     returning sorted datetimes, account balances, and trade amounts in a dictionary
     auth_client.get_account_history(account_id) returns a generator of your account history.
-    This processes that generator to get the data out.
+    This processes that generator to get the data out, in a single pass with AccountHistoryBuilder.
 
     Inputs:
     -------
@@ -194,84 +311,49 @@ def process_account_history(product, account_generator):
 
     Output:
     account_history: dictionary
-        dictionary with keys of the datetimes, balances, trade amounts, and total transferred
+        dictionary with keys of the datetimes (numpy datetime64[ns]), timestamps (int64 epoch nanoseconds),
+        balances, trade amounts, and total transferred
     """
-    datetimes = np.array([])
-    balances = np.array([])
-    amounts = np.array([])
-    total_transfer = 0.0
-    other_crypto = 0.0
+    builder = AccountHistoryBuilder(product)
     for trade in account_generator:
-        datetime = get_datetime_from_utc(trade['created_at'])
-        balance = float(trade['balance'])
-        amount = float(trade['amount'])
-        if trade['type'] == 'transfer':
-            total_transfer += amount
-
-        # Quick fix for buys/sells that were not with the product under consideration
-        # We will track exchanges with other crypto as a general other_crypto float
-        if trade['type'] == 'match':
-            if trade['details']['product_id'] != product:
-                other_crypto += amount
-
-        datetimes = np.append(datetime, datetimes)
-        balances = np.append(balance, balances)
-        amounts = np.append(amount, amounts)
-
-    # sort by time
-    indices = np.argsort(datetimes)
-    datetimes = datetimes[indices]
-    balances = balances[indices]
-    amounts = amounts[indices]
-
-    account_history = {}
-    account_history['datetimes'] = datetimes
-    account_history['balances'] = balances
-    account_history['amounts'] = amounts
-    account_history['total_transfer'] = total_transfer
-    account_history['other_crypto'] = other_crypto
+        builder.add(trade)
 
-    return account_history
+    return builder.build()
 
-def get_account_histories(product):
-    """Get the account histories for both the crypto and fiat in product
+def get_account_histories(product, resync=False, account_ids=None):
+    """Get the account histories for both the crypto and fiat in product.
+    Only the ledger entries that are new since the last run are downloaded, both ledgers at the same time,
+    the rest are read from the local store in data/ledger.sqlite3.
 
     Input:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    resync: bool
+        Flag. If set, throws away the local store and downloads the full ledgers again
+    account_ids: tuple
+        (crypto_id, fiat_id) of ledgers already synced, e.g. by ledger_store.sync_products().  If set, nothing is downloaded
 
     Outputs:
     crypto_history: dictionary
         account history of the 
     """
-    # initialize
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
-
     ###   Get user account history   ###
-    product_split = product.split('-')
-    product_bought = product_split[0]
-    product_sold = product_split[1]
-
-    for account in auth_client.get_accounts():
-        if account['currency'] == product_bought:
-            crypto_id = account['id']
-        if account['currency'] == product_sold: # usually USD
-            fiat_id = account['id']
+    if account_ids is None:
+        # initialize
+        auth_client = get_auth_client()
+        account_ids = ledger_store.sync_product_ledgers(auth_client, product, resync=resync)
+    crypto_id, fiat_id = account_ids
 
-    crypto_trades = auth_client.get_account_history(crypto_id)
-    fiat_trades = auth_client.get_account_history(fiat_id)
+    crypto_trades = ledger_store.iter_account_history(crypto_id)
+    fiat_trades = ledger_store.iter_account_history(fiat_id)
 
     crypto_history = process_account_history(product, crypto_trades)
     fiat_history = process_account_history(product, fiat_trades)
 
     return crypto_history, fiat_history
 
-def plot_user_account_holdings(product):
+def plot_user_account_holdings(product, resync=False, histories=None):
     """Plots the user account holdings for each part of the product, 
     i.e. if the product is ETH-USD, plots both ETH and USD holdings together.
 
@@ -279,6 +361,10 @@ def plot_user_account_holdings(product):
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    resync: bool
+        Flag. If set, downloads the full account ledgers again before plotting
+    histories: tuple
+        (crypto_history, fiat_history) from get_account_histories().  If None, they are fetched
     """
     # Make figure directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -290,7 +376,9 @@ def plot_user_account_holdings(product):
     product_bought = product_split[0]
     product_sold = product_split[1]
 
-    crypto_history, fiat_history = get_account_histories(product)
+    if histories is None:
+        histories = get_account_histories(product, resync=resync)
+    crypto_history, fiat_history = histories
 
     # Make the plot
     fig, (s1, s2) = plt.subplots(2, sharex=True)
@@ -311,19 +399,24 @@ def plot_user_account_holdings(product):
     plot_name = f'account_history_{product_bought}_{product_sold}.pdf'
     full_plot_name = os.path.join(fig_dir, plot_name)
     plt.savefig(full_plot_name)
+    plt.close(fig)
     print("\nPlot saved at")
     print(full_plot_name)
     print()
 
     return
 
-def calculate_profits(product):
+def calculate_profits(product, histories=None, current_price=None):
     """Calculate simple profits at current crypto price (current holdings vs transferred holdings)
 
     Input:
     ------
     product: str
         Cryptocurrency product set limit orders on 
+    histories: tuple
+        (crypto_history, fiat_history) from get_account_histories().  If None, they are fetched
+    current_price: float
+        current price of product.  If None, it is fetched
 
     Output:
     profits: float
@@ -334,10 +427,13 @@ def calculate_profits(product):
     fiat = product_split[1]
 
     # retrieve user history
-    crypto_history, fiat_history = get_account_histories(product)
+    if histories is None:
+        histories = get_account_histories(product)
+    crypto_history, fiat_history = histories
 
     # retrieve current price of product
-    current_price = get_current_price(product)
+    if current_price is None:
+        current_price = get_current_price(product)
 
     # find useful values
     crypto_transferred = crypto_history["total_transfer"]
@@ -407,19 +503,57 @@ def calculate_profits(product):
     return profits
 
 
-if __name__ == "__main__":
-    # get user command line arguments
-    product, quiet = parse_args()
+def build_reports(products, resync=False, since=None, workers=8, cost_method='fifo'):
+    """Prints the filled orders, plots the account history, calculates the profits
+    and the realized and unrealized PnL of the filled orders of every product.
+    Every ledger, order list and price needed is downloaded once, concurrently on a pool of workers threads,
+    then the reports are printed one product after the other.
 
-    # get current order ids 
-    list_orders = get_list_of_order_ids(product)
+    Input:
+    ------
+    products: list
+        Cryptocurrency products set limit orders on, e.g. ['ETH-USD', 'BTC-USD']
+    resync: bool
+        Flag. If set, throws away the local store and downloads the full ledgers and orders again
+    since: str
+        UTC date or time, e.g. 2021-11-25.  If set, only the orders filled since then are listed
+    workers: int
+        number of downloads at the same time
+    cost_method: str
+        cost basis of the PnL, 'fifo' or 'average', see pnl_engine.py
+    """
+    # initialize
+    auth_client = get_auth_client()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        price_futures = {product: executor.submit(get_current_price, product) for product in products}
+        account_ids = ledger_store.sync_products(auth_client, products, resync=resync, since=since, executor=executor)
+        history_futures = {product: executor.submit(get_account_histories, product, account_ids=account_ids[product])
+                           for product in products}
+
+        for product in products:
+            # print the limit order info
+            list_orders = list(ledger_store.iter_orders(product, since=since, status='done'))
+            print_filled_orders_info(product, list_orders)
+
+            # plot user account history
+            histories = history_futures[product].result()
+            plot_user_account_holdings(product, histories=histories)
+
+            # calculate profits
+            current_price = price_futures[product].result()
+            calculate_profits(product, histories, current_price)
 
-    # print the limit order info
-    print_filled_orders_info(product, list_orders)
+            # realized and unrealized PnL of the filled orders
+            pnl = pnl_engine.compute_pnl(pnl_engine.fills_from_orders(list_orders), current_price, cost_method)
+            pnl_engine.print_pnl(product, pnl, cost_method)
 
-    # plot user account history
-    plot_user_account_holdings(product)
+    return
+
+
+if __name__ == "__main__":
+    # get user command line arguments
+    products, resync, since, workers, cost_method, quiet = parse_args()
 
-    # calculate profits
-    calculate_profits(product)
-        
+    # sync the local ledger and order store once, then report on every product
+    build_reports(products, resync=resync, since=since, workers=workers, cost_method=cost_method)
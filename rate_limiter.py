@@ -0,0 +1,226 @@
+"""rate_limiter.py
+
+Client-side rate limiting for the Coinbase Pro REST API.
+
+Every request goes through a token bucket matched to the Coinbase Pro limits
+(public endpoints 3 requests/second with bursts of 6, private endpoints 5 requests/second with bursts of 10).
+When several requests are waiting for a token, cancels go first, then order placements, then read-only queries.
+The bucket state can be kept in a small file locked with fcntl, so that every process
+using the same API key (cron_roberto.py, check_limit_orders.py, dca.py, ...) shares one budget.
+
+cbpro_client.make_session() mounts ThrottledAdapter on the shared HTTP session,
+so the scripts do not need to do anything to be rate limited.
+"""
+import os
+import time
+import heapq
+import threading
+import itertools
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+import api_metrics
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, fall back to one budget per process
+    fcntl = None
+
+# https://docs.pro.coinbase.com/#rate-limits
+PUBLIC_RATE = 3.0
+PUBLIC_BURST = 6
+PRIVATE_RATE = 5.0
+PRIVATE_BURST = 10
+
+# Priority classes, lower goes first
+PRIORITY_CANCEL = 0
+PRIORITY_PLACE = 1
+PRIORITY_QUERY = 2
+
+# Endpoints which are rate limited as public, even when the request is signed
+PUBLIC_ENDPOINTS = ('/products', '/currencies', '/time')
+
+# Retries of a request answered with HTTP 429 Too Many Requests
+MAX_RETRIES_429 = 5
+
+#####   Classes   #####
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding at most burst tokens.
+    Only shared between the threads of one process.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_take(self):
+        """Takes one token if there is one.
+        Returns 0.0 on success, otherwise the number of seconds until a token is available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            return (1.0 - self.tokens) / self.rate
+
+class FileTokenBucket:
+    """Token bucket whose state lives in state_filename, locked with fcntl.flock,
+    so that all the processes using the same file share one budget.
+    """
+    def __init__(self, rate, burst, state_filename):
+        self.rate = rate
+        self.burst = burst
+        self.state_filename = state_filename
+        self.lock = threading.Lock()
+        state_dir = os.path.dirname(state_filename)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir, exist_ok=True)
+
+    def try_take(self):
+        """Takes one token if there is one.
+        Returns 0.0 on success, otherwise the number of seconds until a token is available.
+        """
+        with self.lock:
+            fd = os.open(self.state_filename, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                contents = os.read(fd, 64).split()
+                now = time.time()
+                if len(contents) == 2:
+                    tokens = float(contents[0])
+                    last = float(contents[1])
+                else:
+                    tokens = float(self.burst)
+                    last = now
+                tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+                if tokens >= 1.0:
+                    tokens -= 1.0
+                    wait = 0.0
+                else:
+                    wait = (1.0 - tokens) / self.rate
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, f"{tokens:.6f} {now:.6f}".encode())
+                return wait
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+class PriorityScheduler:
+    """Hands out the tokens of a bucket to the waiting threads in priority order,
+    first come first served within a priority class.
+    """
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.counter = itertools.count()
+
+    def acquire(self, priority=PRIORITY_QUERY):
+        """Blocks until it is the turn of the caller and a token is available."""
+        with self.condition:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                if self.waiting[0] == ticket:
+                    wait = self.bucket.try_take()
+                    if wait == 0.0:
+                        heapq.heappop(self.waiting)
+                        self.condition.notify_all()
+                        return
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait()
+
+class ThrottledAdapter(HTTPAdapter):
+    """requests HTTPAdapter which waits for the rate limiter before each request,
+    and retries requests answered with HTTP 429 Too Many Requests.
+    Since it sits under the session, every page of a paginated response is throttled too.
+    If metrics, an api_metrics.ApiMetrics, is given, every request is recorded in it.
+    """
+    def __init__(self, public_scheduler, private_scheduler, max_retries_429=MAX_RETRIES_429, metrics=None, **kwargs):
+        self.public_scheduler = public_scheduler
+        self.private_scheduler = private_scheduler
+        self.max_retries_429 = max_retries_429
+        self.metrics = metrics
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        priority = get_request_priority(request.method)
+        if is_public_endpoint(urlparse(request.url).path):
+            scheduler = self.public_scheduler
+        else:
+            scheduler = self.private_scheduler
+        if self.metrics is not None:
+            return self.send_with_metrics(request, scheduler, priority, **kwargs)
+
+        for attempt in range(self.max_retries_429 + 1):
+            scheduler.acquire(priority)
+            response = super().send(request, **kwargs)
+            if response.status_code != 429 or attempt == self.max_retries_429:
+                return response
+            # give the pooled connection back before retrying
+            response.close()
+            time.sleep(min(8.0, 0.25 * 2**attempt))
+        return response
+
+    def send_with_metrics(self, request, scheduler, priority, **kwargs):
+        """Same as send(), timing the rate limiter and the request"""
+        endpoint = api_metrics.get_endpoint(request.method, request.url)
+        continuation_page = api_metrics.is_continuation_page(request.url)
+        for attempt in range(self.max_retries_429 + 1):
+            start = time.perf_counter()
+            scheduler.acquire(priority)
+            sent = time.perf_counter()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception as error:
+                self.metrics.record_request(endpoint, time.perf_counter() - sent, sent - start,
+                                            type(error).__name__, continuation_page)
+                raise
+            status_code = response.status_code
+            self.metrics.record_request(endpoint, time.perf_counter() - sent, sent - start,
+                                        str(status_code) if status_code >= 400 else None, continuation_page)
+            if status_code != 429 or attempt == self.max_retries_429:
+                return response
+            self.metrics.record_retry(endpoint)
+            response.close()
+            time.sleep(min(8.0, 0.25 * 2**attempt))
+        return response
+
+
+#####   Functions   #####
+def get_request_priority(method):
+    """Priority class of an HTTP request: cancels before placements before queries"""
+    method = method.upper()
+    if method == 'DELETE':
+        return PRIORITY_CANCEL
+    if method == 'POST':
+        return PRIORITY_PLACE
+    return PRIORITY_QUERY
+
+def is_public_endpoint(path):
+    """True if path is one of the public endpoints, which have their own rate limit"""
+    return path.startswith(PUBLIC_ENDPOINTS)
+
+def get_state_dir():
+    """Returns the data/rate_limit/ directory next to this script, where the shared bucket files live"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, 'data', 'rate_limit')
+
+def make_scheduler(rate, burst, state_name=None):
+    """Makes a PriorityScheduler around a token bucket.
+    If state_name is given and fcntl is available, the budget is shared with the other processes
+    using the same state_name, through the file data/rate_limit/{state_name}.
+    """
+    if state_name is not None and fcntl is not None:
+        bucket = FileTokenBucket(rate, burst, os.path.join(get_state_dir(), state_name))
+    else:
+        bucket = TokenBucket(rate, burst)
+    return PriorityScheduler(bucket)
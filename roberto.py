@@ -1,7 +1,31 @@
 
-import cbpro
-from dotenv import dotenv_values
+import uuid
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from cbpro_client import get_auth_client, get_public_client
+from order_book import get_live_mid_price
+
+# attempts to place one limit order before giving up on the pair
+MAX_PLACE_ATTEMPTS = 3
+
+# ladder mode options, see set_ladder_orders()
+SPACINGS = ('linear', 'geometric')
+SIZE_RULES = ('equal', 'linear', 'geometric')
+
+# number of ladder orders submitted at the same time
+MAX_LADDER_WORKERS = 8
+
+# (price decimals, size decimals) of the products roberto was first written for,
+# used if the products can't be looked up, e.g. for a backtest without a connection
+KNOWN_PRODUCT_DECIMALS = {'ETH-USD': (2, 8), 'MATIC-USD': (2, 1)}
+
+# product -> (price decimals, size decimals), see get_product_decimals()
+_product_decimals = {}
+_product_decimals_lock = threading.Lock()
 
 def parse_args():
     """Parses the user command line arguments
@@ -15,6 +39,12 @@ def parse_args():
                         help='Percent to set limit orders above and below.  Must be between 0 and 100.  Default is 5.0')
     parser.add_argument('fiat_profits_percent', type=float, default=100.0,
                         help='Percent of profits to keep in fiat.  Must be between 0 and 100.  Default is 100.0')
+    parser.add_argument('--levels', type=int, default=1,
+                        help='Number of limit orders on each side.  If more than 1, sets up a ladder of orders, level k at k swings away.  Default is 1')
+    parser.add_argument('--spacing', type=str, default='linear', choices=SPACINGS,
+                        help='Ladder spacing, linear: level k at k * swing_percent, geometric: level k at (1 + swing_percent)^k.  Default is linear')
+    parser.add_argument('--size-rule', type=str, default='equal', choices=SIZE_RULES,
+                        help='Ladder sizes, equal: buy_amount_usd on every level, linear: k * buy_amount_usd on level k, geometric: 2^(k-1) * buy_amount_usd on level k.  Default is equal')
     parser.add_argument('--yes', '-y', action='store_true',
                         help='Flag.  If set, does not need confirmation to set up limit orders.')
     parser.add_argument('--quiet', '-q', action='store_true',
@@ -27,6 +57,9 @@ def parse_args():
     buy_amount_usd = args.buy_amount_usd
     swing_percent = args.swing_percent
     fiat_profits_percent = args.fiat_profits_percent
+    levels = args.levels
+    spacing = args.spacing
+    size_rule = args.size_rule
     yes = args.yes
     quiet = args.quiet
 
@@ -37,45 +70,285 @@ def parse_args():
         print(f"buy_amount_usd       = {buy_amount_usd}")
         print(f"swing_percent        = {swing_percent}")
         print(f"fiat_profits_percent = {fiat_profits_percent}")
+        print(f"levels               = {levels}")
+        print(f"spacing              = {spacing}")
+        print(f"size_rule            = {size_rule}")
         print(f"yes                  = {yes}")
         print(f"quiet                = {quiet}")
 
-    return product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet
+    return product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, yes, quiet
 
 
-def set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet):
-    """main function of roberto.py.
-    Sets the buy low / sell high limit orders for the cryptocurrency product specified.
+def get_increment_decimals(increment):
+    """Number of decimals of an increment of the products API, e.g. 8 for '0.00000001', 0 for '1'"""
+    if '.' not in increment:
+        return 0
+    return len(increment.rstrip('0').split('.')[1])
+
+def load_product_decimals():
+    """Looks up the quote_increment and base_increment of every product with one get_products() call,
+    and caches their decimals.  Returns False if the products could not be looked up.
+    """
+    try:
+        products = get_public_client().get_products()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"could not look up the products: {e!r}")
+        return False
+    if not isinstance(products, list):
+        print(f"could not look up the products: {products}")
+        return False
+    for product_info in products:
+        _product_decimals[product_info['id']] = (get_increment_decimals(product_info['quote_increment']),
+                                                 get_increment_decimals(product_info['base_increment']))
+    return True
+
+def get_product_decimals(product):
+    """Number of decimals the order prices and sizes of product are rounded to,
+    from its quote_increment and base_increment, looked up once per process.
+    Raises ValueError if product is not traded.
+
+    Output:
+    -------
+    price_decimals, size_decimals: int
+    """
+    with _product_decimals_lock:
+        if product not in _product_decimals:
+            if not load_product_decimals() and product in KNOWN_PRODUCT_DECIMALS:
+                _product_decimals[product] = KNOWN_PRODUCT_DECIMALS[product]
+        decimals = _product_decimals.get(product)
+    if decimals is None:
+        raise ValueError(f"{product} is not a product of the exchange, its order prices and sizes are unknown")
+    return decimals
+
+def calculate_limit_orders(product, current_price, buy_amount_usd, swing_size, ratio_profits_in_fiat, sell_swing_size=None, decimals=None):
+    """Calculates the prices and sizes of the buy low / sell high limit orders around current_price.
 
     Inputs:
     -------
     product: str
         Coinbase pro cryptocurrency to set limit orders on, e.g. 'ETH-USD', or 'MATIC-USD'
+    current_price: float
+        Current price of the product, e.g. the mid of the best bid and ask
     buy_amount_usd: float
         Central amount of cryptocurrency to trade at the current price, e.g. 1000.0
-    swing_percent: float
-        Percent amount above and below the current price to set the limit orders at, e.g. 5.0
-    fiat_profits_percent: float
-        Percent of profits to keep in fiat, e.g. 100.0
-    yes: bool
-        Flag. If set, user will not need to manually type 'y' to activate limit orders
-    quiet: bool
-        Flag. If set, does not print so much to terminal.
+    swing_size: float
+        Fraction above and below the current price to set the limit orders at, e.g. 0.05
+    ratio_profits_in_fiat: float
+        Fraction of profits to keep in fiat, e.g. 1.0
+    sell_swing_size: float
+        Fraction above the current price to set the sell order at, if different from swing_size
+    decimals: tuple
+        (price_decimals, size_decimals) to round to, looked up with get_product_decimals() if None
 
     Outputs:
     --------
-    buy_order: dict
-        limit order buy Coinbase pro API information
-    sell_order: dict
-        limit order sell Coinbase pro API information
+    buy_price, buy_size, sell_price, sell_size: float
     """
+    if sell_swing_size is None:
+        sell_swing_size = swing_size
+    if decimals is None:
+        decimals = get_product_decimals(product)
+    price_decimals, size_decimals = decimals
 
-    # Check out user inputs
+    # calculate prices
+    buy_price = round((1 - swing_size) * current_price, price_decimals)
+    sell_price = round((1 + sell_swing_size) * current_price, price_decimals)
+
+    # calculate amount, i.e. "size", of crypto to buy, for now the same
+    buy_size = round(buy_amount_usd * (1 - ratio_profits_in_fiat * swing_size) / buy_price, size_decimals)
+    sell_size = round(buy_amount_usd * (1 + ratio_profits_in_fiat * sell_swing_size) / sell_price, size_decimals)
+
+    return buy_price, buy_size, sell_price, sell_size
+
+def get_order_by_client_oid(auth_client, client_oid):
+    """Looks up an order by the client_oid we gave it.  Returns None if there is no such order."""
+    order = auth_client._send_message('get', f'/orders/client:{client_oid}')
+    if not isinstance(order, dict) or 'message' in order:
+        return None
+    return order
+
+def place_limit_order_leg(auth_client, product, side, price, size, client_oid):
+    """Places one limit order.
+    If the request fails before we get an answer, the order may or may not have reached the exchange,
+    so we look it up by client_oid before trying again with the same client_oid.
+    This way a retry never places the same order twice.
+
+    Output:
+    -------
+    order: dict
+        limit order Coinbase pro API information, with a 'message' key if the order was not placed
+    """
+    for attempt in range(1, MAX_PLACE_ATTEMPTS + 1):
+        try:
+            return auth_client.place_limit_order(product_id=product,
+                                                 side=side,
+                                                 price=price,
+                                                 size=size,
+                                                 client_oid=client_oid)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            error = e
+            try:
+                order = get_order_by_client_oid(auth_client, client_oid)
+            except (requests.exceptions.RequestException, ValueError):
+                order = None
+            if order is not None:
+                return order
+
+    return {'message': f"{side} order not placed after {MAX_PLACE_ATTEMPTS} attempts: {error!r}"}
+
+def cancel_leg(auth_client, order):
+    """Cancels one order of a pair.  Returns True if the exchange confirmed the cancel."""
+    try:
+        response = auth_client.cancel_order(order['id'])
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"cancel of the {order['side']} order {order['id']} failed: {e!r}")
+        return False
+    if isinstance(response, dict) and 'message' in response:
+        print(f"cancel of the {order['side']} order {order['id']} failed: {response['message']}")
+        return False
+    return True
+
+def keep_complete_pair(auth_client, buy_order, sell_order):
+    """All or nothing: if one order of the pair was rejected, cancels the other one.
+    If that cancel fails, the order may still be live, so the half pair is returned instead of None, None:
+    the rejected leg keeps its 'message' key, and the caller records the other one so the next run can retry the cancel.
+
+    Outputs:
+    --------
+    buy_order, sell_order: dict
+        limit order Coinbase pro API information, or None, None if the pair is not complete
+    """
+    if 'message' in buy_order:
+        print('buy error:', buy_order['message'])
+    if 'message' in sell_order:
+        print('sell error:', sell_order['message'])
+
+    if 'message' in buy_order or 'message' in sell_order:
+        # don't leave half a pair behind
+        orphaned = False
+        for order in (buy_order, sell_order):
+            if 'message' not in order:
+                print(f"canceling the {order['side']} order {order['id']}, the other order of the pair failed")
+                if not cancel_leg(auth_client, order):
+                    print(f"the {order['side']} order {order['id']} may still be open, keeping track of it")
+                    orphaned = True
+        if orphaned:
+            return buy_order, sell_order
+        return None, None
+
+    return buy_order, sell_order
+
+def get_leg_result(future, side):
+    """Order of a place_limit_order_leg() future, or an error order with a 'message' key if it raised"""
+    try:
+        return future.result()
+    except Exception as e:
+        return {'message': f"{side} order failed: {e!r}"}
+
+def place_limit_order_pair(auth_client, product, buy_price, buy_size, sell_price, sell_size):
+    """Places the buy and sell limit orders at the same time, so the pair takes one round trip.
+    All or nothing: if one of them is rejected, the other one is canceled, see keep_complete_pair().
+
+    Outputs:
+    --------
+    buy_order, sell_order: dict
+        limit order Coinbase pro API information, or None, None if the pair could not be placed
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        buy_future = executor.submit(place_limit_order_leg, auth_client, product, 'buy', buy_price, buy_size, str(uuid.uuid4()))
+        sell_future = executor.submit(place_limit_order_leg, auth_client, product, 'sell', sell_price, sell_size, str(uuid.uuid4()))
+        buy_order = get_leg_result(buy_future, 'buy')
+        sell_order = get_leg_result(sell_future, 'sell')
+
+    return keep_complete_pair(auth_client, buy_order, sell_order)
+
+def calculate_ladder_swings(swing_size, levels, spacing):
+    """Fractions below and above the current price of each level of a ladder.
+    linear: level k at k * swing_size, geometric: level k at (1 - swing_size)^k below and (1 + swing_size)^k above.
+
+    Output:
+    -------
+    ladder_swings: dict
+        level -> (buy_swing_size, sell_swing_size), levels counted from 1
+    """
+    ladder_swings = {}
+    for level in range(1, levels + 1):
+        if spacing == 'geometric':
+            ladder_swings[level] = (1 - (1 - swing_size)**level, (1 + swing_size)**level - 1)
+        else:
+            ladder_swings[level] = (level * swing_size, level * swing_size)
+    return ladder_swings
+
+def get_size_multiplier(level, size_rule):
+    """How many times buy_amount_usd is traded on a ladder level"""
+    if size_rule == 'linear':
+        return level
+    elif size_rule == 'geometric':
+        return 2**(level - 1)
+    return 1
+
+def calculate_ladder_orders(product, current_price, buy_amount_usd, swing_size, ratio_profits_in_fiat, levels, spacing, size_rule, only_levels=None):
+    """Calculates the prices and sizes of every level of a ladder, with the same formula as calculate_limit_orders().
+
+    Output:
+    -------
+    ladder_orders: dict
+        level -> (buy_price, buy_size, sell_price, sell_size)
+    """
+    ladder_orders = {}
+    for level, (buy_swing_size, sell_swing_size) in calculate_ladder_swings(swing_size, levels, spacing).items():
+        if only_levels is not None and level not in only_levels:
+            continue
+        level_amount_usd = buy_amount_usd * get_size_multiplier(level, size_rule)
+        ladder_orders[level] = calculate_limit_orders(product, current_price, level_amount_usd, buy_swing_size,
+                                                      ratio_profits_in_fiat, sell_swing_size=sell_swing_size)
+    return ladder_orders
+
+def place_limit_order_ladder(auth_client, product, ladder_orders, max_workers=MAX_LADDER_WORKERS):
+    """Places all the orders of a ladder through a pool of at most max_workers concurrent requests.
+    Each level is all or nothing, like place_limit_order_pair().
+
+    Output:
+    -------
+    placed_levels: dict
+        level -> (buy_order, sell_order), only for the levels where both orders were placed,
+        or where one order was left open by a failed cancel, see keep_complete_pair()
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for level, (buy_price, buy_size, sell_price, sell_size) in ladder_orders.items():
+            futures[level] = (
+                executor.submit(place_limit_order_leg, auth_client, product, 'buy', buy_price, buy_size, str(uuid.uuid4())),
+                executor.submit(place_limit_order_leg, auth_client, product, 'sell', sell_price, sell_size, str(uuid.uuid4())),
+            )
+
+        placed_levels = {}
+        for level, (buy_future, sell_future) in futures.items():
+            # one failing level doesn't lose the levels already placed
+            try:
+                buy_order, sell_order = keep_complete_pair(auth_client, get_leg_result(buy_future, 'buy'),
+                                                           get_leg_result(sell_future, 'sell'))
+            except Exception as e:
+                print(f"level {level} failed: {e!r}")
+                continue
+            if buy_order is not None:
+                placed_levels[level] = (buy_order, sell_order)
+
+    return placed_levels
+
+def get_swing_and_profits_ratio(swing_percent, fiat_profits_percent):
+    """Checks out user inputs.
+
+    Outputs:
+    --------
+    swing_size, ratio_profits_in_fiat: float
+        swing_percent and fiat_profits_percent as fractions, or None, None if they are not valid
+    """
     if swing_percent < 0.0 or swing_percent > 100.0:
         print()
         print(f"swing_percent = {swing_percent} is not valid")
         print("no orders placed")
-        return
+        return None, None
     else:
         swing_size = swing_percent / 100.0
 
@@ -83,39 +356,72 @@ def set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percen
         print()
         print(f"fiat_profits_percent = {fiat_profits_percent} is not valid")
         print("no orders placed")
-        return
+        return None, None
     else:
         ratio_profits_in_fiat = fiat_profits_percent / 100.0
 
-    # initialize
-    config = dotenv_values(".env")
-    key = config['API_KEY']
-    b64secret = config['API_SECRET']
-    passphrase = config['PASSPHRASE']
-    auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+    return swing_size, ratio_profits_in_fiat
+
+def get_mid_price(auth_client, product):
+    """Retrieves the current price of product, the mid of the best bid and ask.
+    Reads it from a running order_book.OrderBookClient if there is one, otherwise asks the REST API.
+    """
+    current_price = get_live_mid_price(product)
+    if current_price is not None:
+        return current_price
 
-    # retrieve current price
     order_book = auth_client.get_product_order_book(product)
     current_bid = float(order_book['bids'][0][0])
     current_ask = float(order_book['asks'][0][0])
     current_price = (current_bid + current_ask) / 2
+    return current_price
 
-    # calculate prices
-    buy_price = round((1 - swing_size) * current_price, 2)
-    sell_price = round((1 + swing_size) * current_price, 2)
+def set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet):
+    """main function of roberto.py.
+    Sets the buy low / sell high limit orders for the cryptocurrency product specified.
+    Both orders are placed at the same time, and either both are placed or none is,
+    unless canceling the placed one fails, see keep_complete_pair().
+
+    Inputs:
+    -------
+    product: str
+        Coinbase pro cryptocurrency to set limit orders on, e.g. 'ETH-USD', or 'MATIC-USD'
+    buy_amount_usd: float
+        Central amount of cryptocurrency to trade at the current price, e.g. 1000.0
+    swing_percent: float
+        Percent amount above and below the current price to set the limit orders at, e.g. 5.0
+    fiat_profits_percent: float
+        Percent of profits to keep in fiat, e.g. 100.0
+    yes: bool
+        Flag. If set, user will not need to manually type 'y' to activate limit orders
+    quiet: bool
+        Flag. If set, does not print so much to terminal.
 
-    def round_size(product):
-        if product == "MATIC-USD":
-            return 1
-        elif product == 'ETH-USD':
-            return 8
+    Outputs:
+    --------
+    buy_order: dict
+        limit order buy Coinbase pro API information
+    sell_order: dict
+        limit order sell Coinbase pro API information
+    Returns None if no orders were placed.
+    """
+
+    # Check out user inputs
+    swing_size, ratio_profits_in_fiat = get_swing_and_profits_ratio(swing_percent, fiat_profits_percent)
+    if swing_size is None:
+        return
+
+    # initialize
+    auth_client = get_auth_client()
+
+    # retrieve current price
+    current_price = get_mid_price(auth_client, product)
 
     # decide how much profits to keep in crypto versus fiat
     # ratio_profits_in_fiat = 1.0
 
-    # calculate amount, i.e. "size", of crypto to buy, for now the same
-    buy_size = round(buy_amount_usd * (1 - ratio_profits_in_fiat * swing_size) / buy_price, round_size(product))
-    sell_size = round(buy_amount_usd * (1 + ratio_profits_in_fiat * swing_size) / sell_price, round_size(product))
+    # calculate prices and amounts
+    buy_price, buy_size, sell_price, sell_size = calculate_limit_orders(product, current_price, buy_amount_usd, swing_size, ratio_profits_in_fiat)
 
     crypto = product.split('-')[0]
     if not quiet:
@@ -136,29 +442,99 @@ def set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percen
         ans = input()
 
     if ans == 'y':
-        buy_order = auth_client.place_limit_order(product_id=product,
-                                        side='buy',
-                                        price=buy_price,
-                                        size=buy_size)
-
-        sell_order = auth_client.place_limit_order(product_id=product,
-                                        side='sell',
-                                        price=sell_price,
-                                        size=sell_size)
-
-        if 'message' in buy_order:
-            print('buy error:', buy_order['message'])
-        if 'message' in sell_order:
-            print('sell error:', sell_order['message'])
+        buy_order, sell_order = place_limit_order_pair(auth_client, product, buy_price, buy_size, sell_price, sell_size)
+        if buy_order is None:
+            print("no orders placed")
+            return
     else:
         print(f"orders aborted")
         return 
 
     return buy_order, sell_order
 
+def set_ladder_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet, levels,
+                      spacing='linear', size_rule='equal', only_levels=None, max_workers=MAX_LADDER_WORKERS):
+    """Ladder version of set_limit_orders().
+    Sets levels buy low / sell high pairs of limit orders, level k at k swings away from the current price,
+    all submitted at once through a pool of max_workers concurrent requests.
+
+    Inputs:
+    -------
+    product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet:
+        same as set_limit_orders()
+    levels: int
+        Number of limit orders on each side, e.g. 5
+    spacing: str
+        'linear' or 'geometric', see calculate_ladder_swings()
+    size_rule: str
+        'equal', 'linear' or 'geometric', see get_size_multiplier()
+    only_levels: list
+        If given, only sets these levels, e.g. to re-arm the levels that went off
+    max_workers: int
+        Maximum number of orders submitted at the same time
+
+    Outputs:
+    --------
+    placed_levels: dict
+        level -> (buy_order, sell_order), only for the levels where both orders were placed,
+        or where one order was left open, see place_limit_order_ladder().
+    Returns None if no orders were placed.
+    """
+    # Check out user inputs
+    swing_size, ratio_profits_in_fiat = get_swing_and_profits_ratio(swing_percent, fiat_profits_percent)
+    if swing_size is None:
+        return
+    if spacing == 'linear' and levels * swing_size >= 1.0:
+        print()
+        print(f"levels * swing_percent = {levels * swing_percent} must be below 100 with linear spacing")
+        print("no orders placed")
+        return
+
+    # initialize
+    auth_client = get_auth_client()
+
+    # retrieve current price
+    current_price = get_mid_price(auth_client, product)
+
+    # calculate prices and amounts of every level
+    ladder_orders = calculate_ladder_orders(product, current_price, buy_amount_usd, swing_size, ratio_profits_in_fiat,
+                                            levels, spacing, size_rule, only_levels)
+
+    crypto = product.split('-')[0]
+    if not quiet:
+        print()
+        print(f"{crypto} current price: ${current_price}")
+        for level, (buy_price, buy_size, sell_price, sell_size) in ladder_orders.items():
+            print("\033[92m", end="")
+            print(f"level {level} buy  {product} ${buy_price} ${buy_price * buy_size} ({buy_size} {crypto})")
+            print("\033[0m", end="")
+            print("\033[91m", end="")
+            print(f"level {level} sell {product} ${sell_price} ${sell_price * sell_size} ({sell_size} {crypto})")
+            print("\033[0m", end="")
+
+    if yes:
+        ans = 'y'
+    else:
+        print("place limit orders? (y/n)")
+        ans = input()
+
+    if ans != 'y':
+        print(f"orders aborted")
+        return
+
+    placed_levels = place_limit_order_ladder(auth_client, product, ladder_orders, max_workers)
+    if not placed_levels:
+        print("no orders placed")
+        return
+
+    return placed_levels
+
 if __name__ == "__main__":
-    product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet = parse_args()
-    set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet)
+    product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, yes, quiet = parse_args()
+    if levels > 1:
+        set_ladder_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet, levels, spacing, size_rule)
+    else:
+        set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet)
 
 # sample order
 # 'id':'3db19014-f97d-449c-b40e-2122a1d73e50'
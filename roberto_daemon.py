@@ -0,0 +1,218 @@
+"""roberto_daemon.py
+
+Long-running alternative to running cron_roberto.py every minute.
+
+Subscribes to the authenticated "user" websocket channel of Coinbase Pro, and as soon as
+one of the tracked limit orders is done, cancels the other order of the pair and sets up a new pair
+with roberto.set_limit_orders().
+The full REST check of cron_roberto.py only runs when the websocket (re)connects,
+to catch fills that happened while we were not listening.
+
+Example:
+python roberto_daemon.py ETH-USD 1000.0 5.0 100.0
+"""
+import time
+import queue
+import argparse
+
+import cbpro
+
+import order_state
+import trade_journal
+
+from roberto import set_limit_orders
+from cbpro_client import get_websocket_url, load_config
+from order_book import OrderBookClient
+from cron_roberto import (
+    cancel_order_by_id,
+    clear_current_order_ids,
+    get_log_dir,
+    read_current_order_ids,
+    record_failed_limit_orders,
+    record_new_limit_orders,
+    run_roberto_cycle,
+)
+
+# seconds to wait before reconnecting after the websocket drops
+RECONNECT_WAIT = 5.0
+
+# seconds to wait before trying again when no full pair of limit orders is live
+RETRY_WAIT = 60.0
+
+#####   Classes   #####
+class UserChannelClient(cbpro.WebsocketClient):
+    """Authenticated websocket client for the "user" channel.
+    The websocket thread only puts the "done" messages on the events queue,
+    all the REST calls happen on the main thread.
+    """
+    def __init__(self, products, events, env_file=".env"):
+        config = load_config(env_file)
+        super().__init__(url=get_websocket_url(env_file), products=products, channels=["user"], should_print=False,
+                         auth=True, api_key=config['API_KEY'], api_secret=config['API_SECRET'],
+                         api_passphrase=config['PASSPHRASE'])
+        self.events = events
+
+    def on_message(self, msg):
+        if msg.get("type") == "done":
+            self.events.put(msg)
+
+    def on_error(self, e, data=None):
+        # errors raised by our own close() are expected
+        if not self.stop:
+            print(f"websocket error: {e}")
+        self.error = e
+        self.stop = True
+
+    def close(self):
+        # closing the socket wakes up the websocket thread blocked in recv()
+        self.stop = True
+        if self.ws:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+        self.thread.join()
+
+
+#####   Functions   #####
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Keeps a pair of limit orders set for the chosen cryptocurrency product on Coinbase Pro, re-arming as soon as one fills.\nExample:\npython roberto_daemon.py ETH-USD 1000.0 5.0 100.0')
+    parser.add_argument('product', type=str,
+                        help='Cryptocurrency product to buy, e.g. ETH-USD, BTC-USD, MATIC-USD')
+    parser.add_argument('buy_amount_usd', type=float,
+                        help='Amount of crypto to buy in US dollars')
+    parser.add_argument('swing_percent', type=float, default=5.0,
+                        help='Percent to set limit orders above and below.  Must be between 0 and 100.  Default is 5.0')
+    parser.add_argument('fiat_profits_percent', type=float, default=100.0,
+                        help='Percent of profits to keep in fiat.  Must be between 0 and 100.  Default is 100.0')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='Flag.  If set, runs code in quiet mode.')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    product = args.product
+    buy_amount_usd = args.buy_amount_usd
+    swing_percent = args.swing_percent
+    fiat_profits_percent = args.fiat_profits_percent
+    quiet = args.quiet
+
+    if not quiet:
+        print(f"product              = {product}")
+        print(f"buy_amount_usd       = {buy_amount_usd}")
+        print(f"swing_percent        = {swing_percent}")
+        print(f"fiat_profits_percent = {fiat_profits_percent}")
+        print(f"quiet                = {quiet}")
+
+    return product, buy_amount_usd, swing_percent, fiat_profits_percent, quiet
+
+def rearm_limit_orders(product, done_order_id, tracked_order_ids, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet):
+    """Cancels the other order of the pair of done_order_id and sets up a new pair.
+    The pair is read again from the order state store once the lock is held,
+    and nothing is done if done_order_id is not part of it anymore.
+
+    Output:
+    -------
+    tracked_order_ids: set
+        the order ids of the new pair, empty if no pair could be placed.
+        If a cancel failed, the pair stays stored and its other order ids are still tracked,
+        so its next done message, or the cron_roberto.py check on reconnect, tries again.
+    """
+    # waits for a cron_roberto.py run of the same product to finish, instead of racing it
+    with order_state.product_lock(product, log_dir, blocking=True):
+        # a cron_roberto.py run may have re-armed the product while we waited for the lock
+        pair_order_ids = set(read_current_order_ids(product, log_dir) or [])
+        if done_order_id not in pair_order_ids:
+            if not quiet:
+                print(f"Order {done_order_id} is not in the stored pair anymore, nothing to re-arm")
+            return pair_order_ids
+
+        canceled_order_ids = []
+        # the tracked ids leave out the orders already known to be done
+        for order_id in sorted((pair_order_ids & tracked_order_ids) - {done_order_id}):
+            if not quiet:
+                print(f"Canceling the other order of the pair: order id = {order_id}")
+            if not cancel_order_by_id(order_id):
+                # like check_if_limits_executed(), no new pair next to an order which may still be live
+                print(f"Could not cancel order id = {order_id}, no new orders until it is canceled")
+                return (pair_order_ids & tracked_order_ids) - {done_order_id}
+            canceled_order_ids.append(order_id)
+        # the same record as a cron_roberto.py run which finds the pair done
+        trade_journal.get_journal(log_dir).write('pair_done', product, sorted(pair_order_ids), level=0,
+                                                 done=sorted(pair_order_ids - set(canceled_order_ids)),
+                                                 canceled=canceled_order_ids)
+        clear_current_order_ids(product, log_dir)
+
+        yes = True
+        limit_orders = set_limit_orders(product, buy_amount_usd, swing_percent, fiat_profits_percent, yes, quiet)
+        if limit_orders is None:
+            record_failed_limit_orders(product, log_dir)
+            return set()
+        buy_order, sell_order = limit_orders
+        record_new_limit_orders(product, buy_order, sell_order, log_dir)
+
+        return set(read_current_order_ids(product, log_dir) or [])
+
+def run_daemon(product, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet):
+    """Main loop of roberto_daemon.py.
+    (Re)connects the user channel, reconciles with one cron_roberto.py cycle over REST,
+    then re-arms the pair on every done message for one of our tracked orders.
+    """
+    events = queue.Queue()
+    while True:
+        # live order book, so re-arming does not need a REST call for the current price
+        book_client = OrderBookClient([product])
+        book_client.start()
+
+        ws_client = UserChannelClient([product], events)
+        # subscribe first, so that fills during the reconciliation end up on the queue
+        ws_client.start()
+        run_roberto_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet)
+        tracked_order_ids = set(read_current_order_ids(product, log_dir) or [])
+        last_attempt = time.time()
+        trade_journal.flush_all()
+
+        try:
+            while not ws_client.stop:
+                try:
+                    msg = events.get(timeout=1.0)
+                except queue.Empty:
+                    # no full pair is live, e.g. the last placement was rejected or a cancel failed,
+                    # so let the cron_roberto.py check try again once in a while
+                    if len(tracked_order_ids) < 2 and time.time() - last_attempt > RETRY_WAIT:
+                        run_roberto_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet)
+                        tracked_order_ids = set(read_current_order_ids(product, log_dir) or [])
+                        last_attempt = time.time()
+                        trade_journal.flush_all()
+                    continue
+
+                if msg.get("order_id") not in tracked_order_ids:
+                    continue
+
+                if not quiet:
+                    print()
+                    print(f"Order {msg['order_id']} is done: {msg.get('reason')} at {msg.get('price')}")
+                tracked_order_ids = rearm_limit_orders(product, msg["order_id"], tracked_order_ids,
+                                                       buy_amount_usd, swing_percent, fiat_profits_percent,
+                                                       log_dir, quiet)
+                trade_journal.flush_all()
+                last_attempt = time.time()
+        except KeyboardInterrupt:
+            ws_client.close()
+            book_client.close()
+            return
+
+        ws_client.close()
+        book_client.close()
+        print(f"websocket disconnected, reconnecting in {RECONNECT_WAIT} seconds")
+        time.sleep(RECONNECT_WAIT)
+
+
+if __name__ == "__main__":
+    # First, make sure a log/ directory exists
+    log_dir = get_log_dir()
+
+    product, buy_amount_usd, swing_percent, fiat_profits_percent, quiet = parse_args()
+    run_daemon(product, buy_amount_usd, swing_percent, fiat_profits_percent, log_dir, quiet)
@@ -0,0 +1,191 @@
+"""roberto_worker.py
+
+Resident worker for cron_roberto.py.
+
+Keeps the imports, the .env credentials and the keep-alive HTTP sessions of cbpro_client.py in memory,
+and runs one cron_roberto.py cycle for every command line forwarded by cron_roberto_client.py
+over the Unix socket log/cron_roberto.sock.  Requests are run one at a time, in the order they arrive.
+A light request every KEEPALIVE_SECONDS keeps the TLS connection to Coinbase Pro open between cron runs.
+
+Example:
+python roberto_worker.py &
+python cron_roberto_client.py ETH-USD 1000.0 5.0 100.0
+"""
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+import contextlib
+
+import cron_roberto
+import trade_journal
+from cbpro_client import get_auth_client
+from cron_roberto_client import get_socket_path
+
+# seconds between two keep-alive requests, 0 to turn them off
+KEEPALIVE_SECONDS = 30.0
+
+#####   Classes   #####
+class RobertoWorker:
+    """Listens on socket_path and runs the cron_roberto.py command lines sent by cron_roberto_client.py.
+
+    Inputs:
+    -------
+    socket_path: str
+        Unix socket to listen on, only accessible to the user running the worker
+    log_dir: str
+        log/ directory of cron_roberto.py
+    keepalive_seconds: float
+        seconds between two keep-alive requests, 0 to turn them off
+    """
+    def __init__(self, socket_path, log_dir, keepalive_seconds=KEEPALIVE_SECONDS):
+        self.socket_path = socket_path
+        self.log_dir = log_dir
+        self.keepalive_seconds = keepalive_seconds
+        self.requests = 0
+        self.cpu_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.lock = threading.Lock()
+        self.stop = False
+
+        # warm up: imports are done, now read .env and build the client and its session
+        self.auth_client = get_auth_client()
+
+        # a socket file left by a worker which died is removed, a live worker is not replaced
+        if os.path.exists(socket_path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(socket_path)
+                raise RuntimeError(f"a worker is already listening on {socket_path}")
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.server.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        self.server.listen(16)
+
+    def serve_forever(self):
+        """Answers the requests one at a time until close() is called"""
+        if self.keepalive_seconds:
+            threading.Thread(target=self.keep_alive, daemon=True).start()
+        while not self.stop:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                break
+            with connection:
+                try:
+                    data = b"".join(iter(lambda: connection.recv(65536), b""))
+                    response = self.handle_request(json.loads(data))
+                    connection.sendall(json.dumps(response).encode())
+                except (OSError, ValueError):
+                    traceback.print_exc()
+
+    def handle_request(self, request):
+        """Runs one request.
+
+        Inputs:
+        -------
+        request: dict
+            {'argv': [...]} with the command line of cron_roberto.py, or {'command': 'stats'}
+
+        Output:
+        -------
+        response: dict
+            'exit_code' and 'output' of the run, with its 'cpu_seconds' and 'wall_seconds' in the worker,
+            or the totals of the worker for 'stats'
+        """
+        if request.get('command') == 'stats':
+            return {'requests': self.requests, 'cpu_seconds': self.cpu_seconds, 'wall_seconds': self.wall_seconds,
+                    'exit_code': 0, 'output': ""}
+
+        output = io.StringIO()
+        exit_code = 0
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        with self.lock, contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, quiet = cron_roberto.parse_args(request['argv'])
+                if levels > 1:
+                    cron_roberto.run_ladder_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, levels, spacing, size_rule, self.log_dir, quiet)
+                else:
+                    cron_roberto.run_roberto_cycle(product, buy_amount_usd, swing_percent, fiat_profits_percent, self.log_dir, quiet)
+            except SystemExit as e:
+                # argparse errors and --help
+                exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+            # what a cron_roberto.py process writes at exit
+            trade_journal.flush_all()
+        cpu_seconds = time.process_time() - start_cpu
+        wall_seconds = time.perf_counter() - start
+        self.requests += 1
+        self.cpu_seconds += cpu_seconds
+        self.wall_seconds += wall_seconds
+        return {'exit_code': exit_code, 'output': output.getvalue(), 'cpu_seconds': cpu_seconds, 'wall_seconds': wall_seconds}
+
+    def keep_alive(self):
+        """Sends a light public request every keepalive_seconds, so the next cron run finds the connection open"""
+        while not self.stop:
+            time.sleep(self.keepalive_seconds)
+            with self.lock:
+                try:
+                    self.auth_client.get_time()
+                except Exception:
+                    pass
+
+    def close(self):
+        self.stop = True
+        self.server.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+#####   Functions   #####
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Resident worker running the cron_roberto.py cycles forwarded by cron_roberto_client.py.\nExample:\npython roberto_worker.py')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Unix socket to listen on.  Default is log/cron_roberto.sock')
+    parser.add_argument('--keepalive', type=float, default=KEEPALIVE_SECONDS,
+                        help=f'Seconds between two keep-alive requests, 0 to turn them off.  Default is {KEEPALIVE_SECONDS}')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    socket_path = args.socket
+    keepalive_seconds = args.keepalive
+
+    return socket_path, keepalive_seconds
+
+
+if __name__ == "__main__":
+    # First, make sure a log/ directory exists
+    log_dir = cron_roberto.get_log_dir()
+
+    socket_path, keepalive_seconds = parse_args()
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    worker = RobertoWorker(socket_path, log_dir, keepalive_seconds)
+    # stopped by kill too, so that the socket file is removed
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    print(f"cron_roberto worker listening on {socket_path}")
+    sys.stdout.flush()
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.close()
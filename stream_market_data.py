@@ -1,95 +1,156 @@
 """stream_market_data.py
 Opens a subscription to real-time market data via Coinbase pro API,
-and plots it live using pyqtgraph.
+and plots it live using pyqtgraph, one scrolling plot per product in one window.
+
+The websocket thread puts every tick on a lock-free TickQueue per product,
+and the Qt timer takes all the ticks received since the last redraw in one batch,
+appending them to the chunked curves with NumPy slicing, so no tick is left out of the curves.
+
+Example:
+python stream_market_data.py ETH-USD BTC-USD MATIC-USD
 """
 import sys
 import time
-import json
+import argparse
 
 import cbpro
 
 import pyqtgraph as pg
-from pyqtgraph.Qt import QtCore, QtGui
 import numpy as np
 
-win = pg.GraphicsLayoutWidget(show=True)
-win.setWindowTitle('pyqtgraph example: Scrolling Plots')
+from cbpro_client import get_websocket_url
+from ticker_ingest import TickerIngest
+
+# Ticks kept in memory, at most TICK_CAPACITY per product
+TICK_CAPACITY = 100000
+# Ticks waiting for the next redraw, at most TICK_QUEUE_CAPACITY per product
+TICK_QUEUE_CAPACITY = 65536
+# Points per curve chunk: only the last chunk is sent to Qt again when ticks are appended
+CHUNK_SIZE = 2000
+# Seconds of ticks shown
+HISTORY_SECONDS = 60.0
+# Milliseconds between redraws
+REDRAW_INTERVAL_MS = 50
+# Set to True to print every message, from a separate thread
+DEBUG = False
 
 
 #####   Classes   #####
 class MyWebsocketClient(cbpro.WebsocketClient):
     def on_open(self):
-        self.url = "wss://ws-feed.pro.coinbase.com/"
-        self.products = ["ETH-USD"]
+        self.url = get_websocket_url()
         self.channels = ["ticker"]
         self.message_count = 0
-        self.times = []
-        self.prices = []
+        self.ingest = TickerIngest(self.products, TICK_CAPACITY, debug=DEBUG, queue_capacity=TICK_QUEUE_CAPACITY)
         print("Let's count the messages!")
 
     def on_message(self, msg):
-        print(json.dumps(msg, indent=4, sort_keys=True))
+        self.ingest.on_message(msg)
         self.message_count += 1
 
-        cur_price = msg["price"]
-        cur_datetime = msg["time"]
-        cur_gpstime = gpstime.gpstime.parse(cur_datetime).gps()
-
-        self.prices.append(cur_price)
-        self.times.append(cur_gpstime)
-
     def on_close(self):
         print("-- Goodbye! --")
 
-
-wsClient = MyWebsocketClient()
-wsClient.start()
-print(wsClient.url, wsClient.products)
-
-# Set up the plot window
-win = pg.GraphicsLayoutWidget(show=True)
-win.setWindowTitle(f'Scrolling {wsClient.products}')
-
-startTime = pg.ptime.time()
-chunkSize = 100
-maxChunks = 10
-
-p5 = win.addPlot()
-p5.setLabel('left', 'Price', '$')
-p5.setLabel('bottom', 'Time', 's')
-p5.setXRange(-10, 0)
-curves = []
-data5 = np.empty((chunkSize+1,2))
-ptr5 = 0
+class ProductCurves:
+    """Scrolling curves of the ticks of one product, in chunks of CHUNK_SIZE points.
+
+    Inputs:
+    -------
+    plot: pyqtgraph.PlotItem
+    queue: TickQueue
+        ticks of the product, filled by the websocket thread
+    """
+    def __init__(self, plot, queue):
+        self.plot = plot
+        self.queue = queue
+        # (curve, data) of every chunk, oldest first, and number of points in the last chunk
+        self.chunks = []
+        self.fill = 0
+
+    def update(self, now):
+        """Appends the ticks put on the queue since the last call, and scrolls to now"""
+        times, prices = self.queue.drain()
+        start = 0
+        while start < len(times):
+            if not self.chunks or self.fill == CHUNK_SIZE + 1:
+                self.add_chunk()
+            curve, data = self.chunks[-1]
+            count = min(len(times) - start, CHUNK_SIZE + 1 - self.fill)
+            data[self.fill:self.fill + count, 0] = times[start:start + count]
+            data[self.fill:self.fill + count, 1] = prices[start:start + count]
+            self.fill += count
+            start += count
+            curve.setData(x=data[:self.fill, 0], y=data[:self.fill, 1])
+
+        # drop the chunks which scrolled out of view
+        while len(self.chunks) > 1 and self.chunks[0][1][-1, 0] < now - HISTORY_SECONDS:
+            curve, data = self.chunks.pop(0)
+            self.plot.removeItem(curve)
+
+        for curve, data in self.chunks:
+            curve.setPos(-now, 0)
+
+    def add_chunk(self):
+        """Starts a new chunk, from the last point of the previous one so that the line has no gap"""
+        data = np.empty((CHUNK_SIZE + 1, 2))
+        self.fill = 0
+        if self.chunks:
+            data[0] = self.chunks[-1][1][-1]
+            self.fill = 1
+        curve = self.plot.plot()
+        self.chunks.append((curve, data))
+
+
+#####   Functions   #####
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Plots the live prices of Coinbase Pro products.\nExample:\npython stream_market_data.py ETH-USD BTC-USD')
+    parser.add_argument('products', type=str, nargs='*', default=["ETH-USD"],
+                        help='Cryptocurrency products to plot, e.g. ETH-USD BTC-USD.  Default is ETH-USD')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    products = args.products
+
+    return products
 
 def update():
-    global p5, data5, ptr5, curves
-    now = pg.ptime.time()
-    for c in curves:
-        c.setPos(-(now-startTime), 0)
-    
-    i = ptr5 % chunkSize
-    if i == 0:
-        curve = p5.plot()
-        curves.append(curve)
-        last = data5[-1]
-        data5 = np.empty((chunkSize+1,2))        
-        data5[0] = last
-        while len(curves) > maxChunks:
-            c = curves.pop(0)
-            p5.removeItem(c)
-    else:
-        curve = curves[-1]
-    data5[i+1,0] = wsClient.times[-1]
-    data5[i+1,1] = wsClient.prices[-1]
-    curve.setData(x=data5[:i+2, 0], y=data5[:i+2, 1])
-    ptr5 += 1
-
-# update all plots
-timer = pg.QtCore.QTimer()
-timer.timeout.connect(update)
-timer.start(50)
+    """Redraws every product with the ticks received since the last redraw.
+    Tick times are seconds since the first tick, the wall clock scrolls the plots.
+    """
+    start_us = wsClient.ingest.start_us
+    if start_us is None:
+        return
+    now = time.time() - start_us * 1e-6
+    for product_curves in product_plots:
+        product_curves.update(now)
+
 
 if __name__ == '__main__':
-    pg.exec()
+    products = parse_args()
+
+    wsClient = MyWebsocketClient(products=products)
+    wsClient.start()
+    print(wsClient.url, wsClient.products)
+
+    # Set up the plot window, one plot per product
+    win = pg.GraphicsLayoutWidget(show=True)
+    win.setWindowTitle(f'Scrolling {wsClient.products}')
+
+    product_plots = []
+    for product in wsClient.products:
+        plot = win.addPlot(title=product)
+        plot.setLabel('left', 'Price', '$')
+        plot.setLabel('bottom', 'Time', 's')
+        plot.setXRange(-HISTORY_SECONDS, 0)
+        product_plots.append(ProductCurves(plot, wsClient.ingest.queues[product]))
+        win.nextRow()
+
+    # update all plots
+    timer = pg.QtCore.QTimer()
+    timer.timeout.connect(update)
+    timer.start(REDRAW_INTERVAL_MS)
 
+    pg.exec()
@@ -1,12 +1,6 @@
-import cbpro
-from dotenv import dotenv_values
+from cbpro_client import get_auth_client
 
-config = dotenv_values(".env")  # config = {"USER": "foo", "EMAIL": "foo@example.org"}
-key = config['API_KEY']
-b64secret = config['API_SECRET']
-passphrase = config['PASSPHRASE']
-
-auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+auth_client = get_auth_client()
 pass
 accounts = auth_client.get_accounts()
 if type(accounts) is dict:
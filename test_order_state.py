@@ -0,0 +1,102 @@
+"""test_order_state.py
+
+Checks the order pair store and per-product locks of order_state.py, in a temporary log directory.
+python -m pytest test_order_state.py
+"""
+import os
+import threading
+
+import pytest
+
+import order_state
+
+###   Tests   ###
+def test_unknown_product(tmp_path):
+    assert order_state.get_open_pairs('ETH-USD', str(tmp_path)) is None
+    assert order_state.get_pair_history('ETH-USD', str(tmp_path)) == []
+
+def test_record_and_replace_pair(tmp_path):
+    log_dir = str(tmp_path)
+    order_state.record_pair('ETH-USD', 'buy-1', 'sell-1', log_dir)
+    assert order_state.get_open_pairs('ETH-USD', log_dir) == {0: ('buy-1', 'sell-1')}
+
+    # a new pair at the same level closes the one it replaces
+    order_state.record_pair('ETH-USD', 'buy-2', None, log_dir)
+    assert order_state.get_open_pairs('ETH-USD', log_dir) == {0: ('buy-2', None)}
+    history = order_state.get_pair_history('ETH-USD', log_dir)
+    assert [(pair['buy_id'], pair['status']) for pair in history] == [('buy-1', 'done'), ('buy-2', 'open')]
+    assert history[0]['closed_at'] is not None
+    assert history[1]['closed_at'] is None
+
+    # other products are untouched
+    assert order_state.get_open_pairs('BTC-USD', log_dir) is None
+
+def test_close_pairs(tmp_path):
+    log_dir = str(tmp_path)
+    for level in range(3):
+        order_state.record_pair('ETH-USD', f'buy-{level}', f'sell-{level}', log_dir, level=level)
+    order_state.close_pairs('ETH-USD', log_dir, levels=[1])
+    assert sorted(order_state.get_open_pairs('ETH-USD', log_dir)) == [0, 2]
+    order_state.close_pairs('ETH-USD', log_dir)
+    # a product with every pair done is known, with no live pair
+    assert order_state.get_open_pairs('ETH-USD', log_dir) == {}
+
+def test_transaction_rolls_back(tmp_path):
+    log_dir = str(tmp_path)
+    order_state.record_pair('ETH-USD', 'buy-1', 'sell-1', log_dir)
+    conn = order_state.connect(log_dir)
+    with pytest.raises(RuntimeError):
+        with order_state.transaction(conn):
+            conn.execute("UPDATE pairs SET status = 'done' WHERE product = 'ETH-USD'")
+            raise RuntimeError("killed halfway")
+    assert order_state.get_open_pairs('ETH-USD', log_dir) == {0: ('buy-1', 'sell-1')}
+
+def test_imports_text_files(tmp_path):
+    log_dir = str(tmp_path)
+    with open(os.path.join(log_dir, "current_order_ids_ETH_USD.txt"), "w") as file1:
+        file1.write("buy-1\nsell-1\n")
+    with open(os.path.join(log_dir, "current_ladder_ids_ETH_USD.txt"), "w") as file1:
+        file1.write("1 buy-l1 sell-l1\n2 buy-l2 sell-l2\n")
+    with open(os.path.join(log_dir, "current_order_ids_BTC_USD.txt"), "w") as file1:
+        file1.write("buy-only\n")
+
+    assert order_state.get_open_pairs('ETH-USD', log_dir) == {
+        0: ('buy-1', 'sell-1'), 1: ('buy-l1', 'sell-l1'), 2: ('buy-l2', 'sell-l2')}
+    # a pair with one failed leg
+    assert order_state.get_open_pairs('BTC-USD', log_dir) == {0: ('buy-only', None)}
+
+    # the files are only imported once, later changes live in the database
+    order_state.close_pairs('ETH-USD', log_dir)
+    assert order_state.get_open_pairs('ETH-USD', log_dir) == {}
+
+def test_product_lock(tmp_path):
+    log_dir = str(tmp_path)
+    results = []
+
+    def try_lock(product):
+        with order_state.product_lock(product, log_dir) as locked:
+            results.append(locked)
+
+    with order_state.product_lock('ETH-USD', log_dir) as locked:
+        assert locked
+        # flock locks are per open file, so a second open in another thread is refused like another process
+        thread = threading.Thread(target=try_lock, args=('ETH-USD',))
+        thread.start()
+        thread.join()
+        thread = threading.Thread(target=try_lock, args=('BTC-USD',))
+        thread.start()
+        thread.join()
+    assert results == [False, True]
+
+    # released at the end of the with block
+    try_lock('ETH-USD')
+    assert results[-1] is True
+
+def test_connections_per_thread(tmp_path):
+    log_dir = str(tmp_path)
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(order_state.connect(log_dir)))
+    thread.start()
+    thread.join()
+    assert connections[0] is not order_state.connect(log_dir)
+    assert order_state.connect(log_dir) is order_state.connect(log_dir)
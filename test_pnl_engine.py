@@ -0,0 +1,190 @@
+"""test_pnl_engine.py
+
+Checks pnl_engine.py against a naive lot-by-lot FIFO loop.
+python -m pytest test_pnl_engine.py
+"""
+from collections import deque
+
+import numpy as np
+import pytest
+
+import pnl_engine
+
+###   Functions   ###
+def make_fills(rows, product='ETH-USD'):
+    """Fill arrays from (side, size, price, fee) rows, one second apart"""
+    n = len(rows)
+    return {
+        'timestamps': np.arange(n, dtype=np.int64) * 1000000000,
+        'products': np.array([product] * n, dtype=str),
+        'sides': np.array([side for side, size, price, fee in rows], dtype=np.int8),
+        'sizes': np.array([size for side, size, price, fee in rows], dtype=np.float64),
+        'prices': np.array([price for side, size, price, fee in rows], dtype=np.float64),
+        'fees': np.array([fee for side, size, price, fee in rows], dtype=np.float64),
+    }
+
+def naive_fifo_pnl(rows, current_price, opening_size=0.0, opening_price=0.0):
+    """Realized and unrealized PnL matching every sell against a deque of [size, unit cost] lots"""
+    lots = deque()
+    if opening_size > 0.0:
+        lots.append([opening_size, opening_price])
+    realized = 0.0
+    for side, size, price, fee in rows:
+        if side > 0:
+            lots.append([size, price + fee / size])
+            continue
+        cost = 0.0
+        left = size
+        while left > 1e-15:
+            lot = lots[0]
+            taken = min(left, lot[0])
+            cost += taken * lot[1]
+            lot[0] -= taken
+            left -= taken
+            if lot[0] <= 1e-15:
+                lots.popleft()
+        realized += size * price - fee - cost
+    position = sum(lot[0] for lot in lots)
+    unrealized = sum(lot[0] * (current_price - lot[1]) for lot in lots)
+    return realized, unrealized, position
+
+def random_rows(rng, n):
+    """n random fills which never sell more than the position held"""
+    rows = []
+    position = 0.0
+    for _ in range(n):
+        price = float(rng.uniform(1000.0, 5000.0))
+        if position > 0.0 and rng.random() < 0.5:
+            size = float(rng.uniform(0.0, position))
+            position -= size
+            rows.append((-1, size, price, size * price * 0.005))
+        else:
+            size = float(rng.uniform(0.01, 2.0))
+            position += size
+            rows.append((1, size, price, size * price * 0.005))
+    return rows
+
+###   Tests   ###
+@pytest.mark.parametrize('seed', range(5))
+def test_fifo_matches_naive_loop(seed):
+    rows = random_rows(np.random.default_rng(seed), 500)
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 3000.0, method='fifo')
+    realized, unrealized, position = naive_fifo_pnl(rows, 3000.0)
+    assert pnl['opening_size'] == 0.0
+    assert pnl['realized_pnl'] == pytest.approx(realized, rel=1e-9, abs=1e-6)
+    assert pnl['unrealized_pnl'] == pytest.approx(unrealized, rel=1e-9, abs=1e-6)
+    assert pnl['position'] == pytest.approx(position, abs=1e-9)
+    assert pnl['total_pnl'] == pytest.approx(realized + unrealized, rel=1e-9, abs=1e-6)
+    assert np.cumsum(pnl['realized'])[-1] == pytest.approx(pnl['cumulative_realized'][-1])
+
+def test_fifo_matches_hand_computed():
+    # 1 @ 100 then 1 @ 200, selling 1.5 @ 300 takes all of the first lot and half of the second
+    rows = [(1, 1.0, 100.0, 0.0), (1, 1.0, 200.0, 0.0), (-1, 1.5, 300.0, 0.0)]
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 400.0, method='fifo')
+    assert pnl['realized_pnl'] == pytest.approx(450.0 - 100.0 - 100.0)
+    assert pnl['position'] == pytest.approx(0.5)
+    assert pnl['cost_basis'] == pytest.approx(100.0)
+    assert pnl['average_cost'] == pytest.approx(200.0)
+    assert pnl['unrealized_pnl'] == pytest.approx(0.5 * 400.0 - 100.0)
+
+def test_average_cost_matches_hand_computed():
+    rows = [(1, 1.0, 100.0, 0.0), (1, 1.0, 200.0, 0.0), (-1, 1.5, 300.0, 0.0)]
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 400.0, method='average')
+    assert pnl['realized_pnl'] == pytest.approx(450.0 - 1.5 * 150.0)
+    assert pnl['average_cost'] == pytest.approx(150.0)
+    assert pnl['unrealized_pnl'] == pytest.approx(0.5 * (400.0 - 150.0))
+
+def test_fees_are_in_cost_and_proceeds():
+    rows = [(1, 1.0, 100.0, 1.0), (-1, 1.0, 200.0, 2.0)]
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 200.0)
+    assert pnl['realized_pnl'] == pytest.approx(200.0 - 2.0 - 101.0)
+    assert pnl['buy_fees'] == pytest.approx(1.0)
+    assert pnl['sell_fees'] == pytest.approx(2.0)
+    assert pnl['fees'] == pytest.approx(3.0)
+
+@pytest.mark.parametrize('method', pnl_engine.METHODS)
+def test_opening_lot(method):
+    # 2 coins sold before any buy come from an opening lot at opening_price
+    rows = [(-1, 2.0, 150.0, 0.0), (1, 1.0, 100.0, 0.0), (-1, 0.5, 200.0, 0.0)]
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 300.0, method=method, opening_price=120.0)
+    assert pnl['opening_size'] == pytest.approx(2.0)
+    assert pnl['opening_price'] == 120.0
+    assert pnl['realized'][0] == pytest.approx(2.0 * (150.0 - 120.0))
+    assert pnl['position'] == pytest.approx(0.5)
+    if method == 'fifo':
+        realized, unrealized, position = naive_fifo_pnl(rows, 300.0, opening_size=2.0, opening_price=120.0)
+        assert pnl['realized_pnl'] == pytest.approx(realized)
+        assert pnl['unrealized_pnl'] == pytest.approx(unrealized)
+
+def test_opening_price_defaults_to_first_fill():
+    rows = [(-1, 1.0, 150.0, 0.0)]
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 300.0)
+    assert pnl['opening_size'] == pytest.approx(1.0)
+    assert pnl['opening_price'] == 150.0
+    assert pnl['realized_pnl'] == pytest.approx(0.0)
+
+@pytest.mark.parametrize('method', pnl_engine.METHODS)
+def test_position_sold_out(method):
+    rows = [(1, 0.1, 1000.0, 0.1), (1, 0.2, 1100.0, 0.1), (1, 0.3, 1200.0, 0.1), (-1, 0.6, 1300.0, 0.1)]
+    pnl = pnl_engine.compute_pnl(make_fills(rows), 5000.0, method=method)
+    # the sums of 0.1 + 0.2 + 0.3 - 0.6 leave round-off, which must not show up as a position
+    assert pnl['position'] == 0.0
+    assert pnl['cost_basis'] == 0.0
+    assert pnl['average_cost'] == 0.0
+    assert pnl['unrealized_pnl'] == 0.0
+    cost = 0.1 * 1000.0 + 0.2 * 1100.0 + 0.3 * 1200.0 + 0.3
+    assert pnl['realized_pnl'] == pytest.approx(0.6 * 1300.0 - 0.1 - cost)
+    assert pnl['total_pnl'] == pnl['realized_pnl']
+
+@pytest.mark.parametrize('method', pnl_engine.METHODS)
+def test_no_fills(method):
+    fills = pnl_engine.fills_from_orders([])
+    pnl = pnl_engine.compute_pnl(fills, 3000.0, method=method)
+    assert len(pnl['realized']) == 0
+    assert pnl['realized_pnl'] == 0.0
+    assert pnl['unrealized_pnl'] == 0.0
+    assert pnl['position'] == 0.0
+    assert pnl['fees'] == 0.0
+    assert pnl['opening_size'] == 0.0
+    assert pnl['num_buys'] == 0
+    assert pnl['num_sells'] == 0
+    assert pnl_engine.compute_pnl_by_product(fills, {}, method=method) == {}
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        pnl_engine.compute_pnl(make_fills([]), 3000.0, method='lifo')
+
+def test_fills_from_orders():
+    orders = [
+        {'status': 'done', 'product_id': 'ETH-USD', 'side': 'sell', 'filled_size': '0.5', 'executed_value': '1500',
+         'fill_fees': '1.5', 'created_at': '2021-11-25T22:52:30.000000Z', 'done_at': '2021-11-25T22:53:00.000000Z'},
+        {'status': 'done', 'product_id': 'ETH-USD', 'side': 'buy', 'filled_size': '1.0', 'executed_value': '2000',
+         'fill_fees': '2.0', 'created_at': '2021-11-25T22:52:29.000000Z', 'done_at': '2021-11-25T22:52:29.500000Z'},
+        # open and unfilled orders are not fills
+        {'status': 'open', 'product_id': 'ETH-USD', 'side': 'buy', 'filled_size': '0', 'executed_value': '0',
+         'fill_fees': '0', 'created_at': '2021-11-25T22:54:00.000000Z'},
+        {'status': 'done', 'product_id': 'ETH-USD', 'side': 'buy', 'filled_size': '0', 'executed_value': '0',
+         'fill_fees': '0', 'created_at': '2021-11-25T22:55:00.000000Z'},
+    ]
+    fills = pnl_engine.fills_from_orders(orders)
+    assert fills['sides'].tolist() == [1, -1]
+    assert fills['sizes'].tolist() == [1.0, 0.5]
+    assert fills['prices'].tolist() == [2000.0, 3000.0]
+    assert fills['fees'].tolist() == [2.0, 1.5]
+
+def test_by_product_matches_single_product():
+    rng = np.random.default_rng(7)
+    eth_rows = random_rows(rng, 50)
+    btc_rows = random_rows(rng, 50)
+    eth = make_fills(eth_rows, 'ETH-USD')
+    btc = make_fills(btc_rows, 'BTC-USD')
+    # interleave the two products in time
+    btc['timestamps'] = btc['timestamps'] + 500000000
+    fills = {key: np.concatenate((eth[key], btc[key])) for key in eth}
+    order_by_time = np.argsort(fills['timestamps'], kind='stable')
+    fills = {key: column[order_by_time] for key, column in fills.items()}
+
+    pnls = pnl_engine.compute_pnl_by_product(fills, {'ETH-USD': 3000.0, 'BTC-USD': 4000.0})
+    assert sorted(pnls) == ['BTC-USD', 'ETH-USD']
+    assert pnls['ETH-USD']['realized_pnl'] == pytest.approx(pnl_engine.compute_pnl(eth, 3000.0)['realized_pnl'])
+    assert pnls['BTC-USD']['unrealized_pnl'] == pytest.approx(pnl_engine.compute_pnl(btc, 4000.0)['unrealized_pnl'])
@@ -0,0 +1,125 @@
+"""test_tick_buffer.py
+
+Checks TickBuffer and TickQueue of tick_buffer.py against plain lists.
+python -m pytest test_tick_buffer.py
+"""
+import numpy as np
+import pytest
+
+from tick_buffer import TickBuffer, TickQueue
+
+###   Tests   ###
+def test_empty():
+    buffer = TickBuffer(capacity=4)
+    assert len(buffer) == 0
+    assert buffer.min() is None
+    assert buffer.max() is None
+    assert buffer.first_time() is None
+    assert buffer.last() is None
+    times, prices = buffer.view()
+    assert len(times) == 0 and len(prices) == 0
+
+def test_fills_up_to_capacity():
+    buffer = TickBuffer(capacity=4)
+    for ii, price in enumerate([3.0, 1.0, 2.0]):
+        buffer.append(float(ii), price)
+    times, prices = buffer.view()
+    assert times.tolist() == [0.0, 1.0, 2.0]
+    assert prices.tolist() == [3.0, 1.0, 2.0]
+    assert buffer.min() == 1.0
+    assert buffer.max() == 3.0
+    assert buffer.first_time() == 0.0
+    assert buffer.last() == (2.0, 2.0)
+
+def test_capacity_wraps_around():
+    buffer = TickBuffer(capacity=4)
+    for ii in range(10):
+        buffer.append(float(ii), float(100 - ii))
+    assert len(buffer) == 4
+    times, prices = buffer.view()
+    # the oldest ticks are dropped and the view stays contiguous after the wrap
+    assert times.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert prices.tolist() == [94.0, 93.0, 92.0, 91.0]
+    assert buffer.max() == 94.0
+    assert buffer.min() == 91.0
+    assert buffer.first_time() == 6.0
+    assert buffer.last() == (9.0, 91.0)
+
+def test_view_is_not_a_copy():
+    buffer = TickBuffer(capacity=4)
+    for ii in range(6):
+        buffer.append(float(ii), float(ii))
+    times, prices = buffer.view()
+    assert np.shares_memory(times, buffer._times)
+    assert np.shares_memory(prices, buffer._prices)
+
+def test_time_window():
+    buffer = TickBuffer(capacity=100, window_seconds=2.5)
+    for ii in range(10):
+        buffer.append(float(ii), float(ii))
+    times, prices = buffer.view()
+    assert times.tolist() == [7.0, 8.0, 9.0]
+    assert buffer.min() == 7.0
+    assert buffer.first_time() == 7.0
+    # a gap longer than the window leaves only the newest tick
+    buffer.append(100.0, 1.0)
+    assert len(buffer) == 1
+    assert buffer.min() == 1.0
+    assert buffer.max() == 1.0
+
+@pytest.mark.parametrize('capacity, window_seconds', [(16, None), (16, 5.0), (1, None), (1000, 20.0)])
+def test_matches_plain_list(capacity, window_seconds):
+    rng = np.random.default_rng(capacity)
+    buffer = TickBuffer(capacity=capacity, window_seconds=window_seconds)
+    ticks = []
+    tick_time = 0.0
+    for _ in range(2000):
+        tick_time += float(rng.exponential(0.5))
+        price = float(rng.normal(3000.0, 50.0))
+        buffer.append(tick_time, price)
+        ticks.append((tick_time, price))
+        ticks = ticks[-capacity:]
+        if window_seconds is not None:
+            ticks = [tick for tick in ticks if tick[0] >= tick_time - window_seconds]
+
+        times, prices = buffer.view()
+        assert len(buffer) == len(ticks)
+        assert times.tolist() == [tick[0] for tick in ticks]
+        assert prices.tolist() == [tick[1] for tick in ticks]
+        assert buffer.min() == min(tick[1] for tick in ticks)
+        assert buffer.max() == max(tick[1] for tick in ticks)
+        assert buffer.last() == ticks[-1]
+
+def test_queue_drains_in_order():
+    queue = TickQueue(capacity=4)
+    times, prices = queue.drain()
+    assert len(times) == 0 and len(prices) == 0
+    for ii in range(3):
+        assert queue.put(float(ii), float(10 + ii))
+    assert len(queue) == 3
+    times, prices = queue.drain()
+    assert times.tolist() == [0.0, 1.0, 2.0]
+    assert prices.tolist() == [10.0, 11.0, 12.0]
+    assert len(queue) == 0
+
+def test_queue_wraps_around():
+    queue = TickQueue(capacity=4)
+    for ii in range(3):
+        queue.put(float(ii), float(ii))
+    queue.drain()
+    # slots 3, 0, 1 after the wrap
+    for ii in range(3, 6):
+        queue.put(float(ii), float(ii))
+    times, prices = queue.drain()
+    assert times.tolist() == [3.0, 4.0, 5.0]
+    assert prices.tolist() == [3.0, 4.0, 5.0]
+
+def test_queue_drops_when_full():
+    queue = TickQueue(capacity=2)
+    assert queue.put(0.0, 0.0)
+    assert queue.put(1.0, 1.0)
+    assert not queue.put(2.0, 2.0)
+    assert queue.dropped == 1
+    times, prices = queue.drain()
+    # the ticks not read yet are kept, not overwritten
+    assert times.tolist() == [0.0, 1.0]
@@ -0,0 +1,172 @@
+"""tick_buffer.py
+
+Bounded storage for the ticks of the streaming clients.
+
+TickBuffer is a preallocated NumPy circular buffer of (time, price) ticks.
+It keeps at most capacity ticks, and optionally only the ticks of the last window_seconds,
+so memory stays flat no matter how long the stream has been up.
+
+TickQueue hands ticks over from the websocket thread to a GUI thread without a lock,
+so the GUI can take every tick received since its last redraw in one batch.
+"""
+from collections import deque
+
+import numpy as np
+
+#####   Classes   #####
+class TickBuffer:
+    """Circular buffer of (time, price) ticks with O(1) running min and max of the prices.
+
+    Every tick is written twice, at slot i and slot i + capacity of arrays twice the capacity long,
+    so the stored ticks are always one contiguous slice and view() never copies.
+    The running min and max are kept in monotonic deques, amortized O(1) per tick.
+
+    Inputs:
+    -------
+    capacity: int
+        Maximum number of ticks kept
+    window_seconds: float
+        If set, ticks older than window_seconds before the newest tick are dropped too
+    """
+    def __init__(self, capacity=100000, window_seconds=None):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self._times = np.empty(2 * capacity, dtype=np.float64)
+        self._prices = np.empty(2 * capacity, dtype=np.float64)
+        # total number of ticks ever appended, and index of the oldest tick kept
+        self.count = 0
+        self.start = 0
+        # (tick index, price), prices increasing in _mins and decreasing in _maxs
+        self._mins = deque()
+        self._maxs = deque()
+
+    def __len__(self):
+        return self.count - self.start
+
+    def append(self, tick_time, price):
+        """Adds one tick, dropping the oldest ticks outside of the capacity or time window"""
+        slot = self.count % self.capacity
+        self._times[slot] = tick_time
+        self._times[slot + self.capacity] = tick_time
+        self._prices[slot] = price
+        self._prices[slot + self.capacity] = price
+        index = self.count
+        self.count += 1
+
+        # window policy
+        if self.count - self.start > self.capacity:
+            self.start = self.count - self.capacity
+        if self.window_seconds is not None:
+            oldest_time = tick_time - self.window_seconds
+            while self._times[self.start % self.capacity] < oldest_time:
+                self.start += 1
+
+        # running min and max
+        mins = self._mins
+        while mins and mins[-1][1] >= price:
+            mins.pop()
+        mins.append((index, price))
+        while mins[0][0] < self.start:
+            mins.popleft()
+
+        maxs = self._maxs
+        while maxs and maxs[-1][1] <= price:
+            maxs.pop()
+        maxs.append((index, price))
+        while maxs[0][0] < self.start:
+            maxs.popleft()
+
+    def view(self):
+        """Zero-copy views of the stored ticks, oldest first.
+
+        Outputs:
+        --------
+        times, prices: numpy.ndarray
+            views into the buffer, only valid until the next append()
+        """
+        begin = self.start % self.capacity
+        end = begin + len(self)
+        return self._times[begin:end], self._prices[begin:end]
+
+    def min(self):
+        """Lowest price stored, or None if the buffer is empty"""
+        if not len(self):
+            return None
+        return self._mins[0][1]
+
+    def max(self):
+        """Highest price stored, or None if the buffer is empty"""
+        if not len(self):
+            return None
+        return self._maxs[0][1]
+
+    def first_time(self):
+        """Time of the oldest tick stored, or None if the buffer is empty"""
+        if not len(self):
+            return None
+        return self._times[self.start % self.capacity]
+
+    def last(self):
+        """Newest (time, price) tick, or None if the buffer is empty"""
+        if not len(self):
+            return None
+        slot = (self.count - 1) % self.capacity
+        return self._times[slot], self._prices[slot]
+
+class TickQueue:
+    """Single-producer, single-consumer queue of (time, price) ticks, e.g. from a websocket thread to a GUI thread.
+
+    Only the producer writes write_count and only the consumer writes read_count, each after the slots
+    they cover are written or read, so no lock is needed: an int assignment is atomic in CPython.
+    When the consumer falls capacity ticks behind, new ticks are dropped and counted in dropped,
+    instead of overwriting ticks not read yet.
+
+    Inputs:
+    -------
+    capacity: int
+        Maximum number of ticks waiting to be read
+    """
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._prices = np.empty(capacity, dtype=np.float64)
+        # total number of ticks ever put, and ever drained
+        self.write_count = 0
+        self.read_count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.write_count - self.read_count
+
+    def put(self, tick_time, price):
+        """Adds one tick, from the producer thread.  Returns False if the queue is full and the tick was dropped."""
+        count = self.write_count
+        if count - self.read_count >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = count % self.capacity
+        self._times[slot] = tick_time
+        self._prices[slot] = price
+        self.write_count = count + 1
+        return True
+
+    def drain(self):
+        """Takes every tick put so far, from the consumer thread.
+
+        Outputs:
+        --------
+        times, prices: numpy.ndarray
+            copies of the ticks, oldest first, empty if there was none
+        """
+        start = self.read_count
+        end = self.write_count
+        begin = start % self.capacity
+        stop = begin + end - start
+        if stop <= self.capacity:
+            times = self._times[begin:stop].copy()
+            prices = self._prices[begin:stop].copy()
+        else:
+            times = np.concatenate((self._times[begin:], self._times[:stop - self.capacity]))
+            prices = np.concatenate((self._prices[begin:], self._prices[:stop - self.capacity]))
+        self.read_count = end
+        return times, prices
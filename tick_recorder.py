@@ -0,0 +1,384 @@
+"""tick_recorder.py
+
+Records Coinbase Pro websocket messages to disk, and replays them.
+
+Each channel of each product gets one append-only file per UTC day,
+data/ticks/{product}/{YYYY-MM-DD}.{channel}.bin, made of fixed-width little-endian records
+(TICKER_DTYPE, MATCHES_DTYPE or LEVEL2_DTYPE).
+Records are written in batches, and read back with np.memmap as NumPy structured arrays,
+so loading a day of ticks costs no parsing and no copy: load_ticks(...)['price'] is a column view.
+
+replay() feeds the recorded messages back, in time order, into any on_message handler,
+at maximum speed or at real time.
+
+Examples:
+python tick_recorder.py ETH-USD BTC-USD --channels ticker matches
+python tick_recorder.py ETH-USD --replay 2021-11-25 --speed 10
+"""
+import os
+import sys
+import time
+import heapq
+import signal
+import argparse
+import datetime
+import threading
+
+import cbpro
+import numpy as np
+
+from cbpro_client import get_websocket_url
+from ticker_ingest import parse_utc_epoch_us
+
+CHANNELS = ('ticker', 'matches', 'level2')
+
+# sides are stored as int8
+SIDE_CODES = {'buy': 1, 'sell': -1}
+SIDE_NAMES = {1: 'buy', -1: 'sell'}
+
+TICKER_DTYPE = np.dtype([
+    ('time_us', '<i8'),
+    ('sequence', '<i8'),
+    ('trade_id', '<i8'),
+    ('price', '<f8'),
+    ('last_size', '<f8'),
+    ('best_bid', '<f8'),
+    ('best_ask', '<f8'),
+    ('side', 'i1'),
+])
+MATCHES_DTYPE = np.dtype([
+    ('time_us', '<i8'),
+    ('sequence', '<i8'),
+    ('trade_id', '<i8'),
+    ('price', '<f8'),
+    ('size', '<f8'),
+    ('side', 'i1'),
+])
+# one record per price level change, snapshot levels have snapshot == 1
+LEVEL2_DTYPE = np.dtype([
+    ('time_us', '<i8'),
+    ('price', '<f8'),
+    ('size', '<f8'),
+    ('side', 'i1'),
+    ('snapshot', 'i1'),
+])
+DTYPES = {'ticker': TICKER_DTYPE, 'matches': MATCHES_DTYPE, 'level2': LEVEL2_DTYPE}
+
+# records kept in memory before being written, per file
+BATCH_SIZE = 4096
+# and the longest they are kept in memory, in seconds
+FLUSH_SECONDS = 1.0
+
+###   Functions   ###
+def get_default_root_dir():
+    """Returns data/ticks/ next to this script"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ticks")
+
+def get_tick_filename(product, date_string, channel, root_dir=None):
+    """Path of the file of one channel of one product on one UTC day, like '2021-11-25'"""
+    if root_dir is None:
+        root_dir = get_default_root_dir()
+    return os.path.join(root_dir, product, f"{date_string}.{channel}.bin")
+
+def format_utc_epoch_us(epoch_us):
+    """Inverse of ticker_ingest.parse_utc_epoch_us(), returns a string like '2021-11-25T22:52:29.119195Z'"""
+    dt = datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=int(epoch_us))
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def get_message_rows(msg, channel, receive_us):
+    """Converts one websocket message into the records of its channel.
+
+    Inputs:
+    -------
+    msg: dict
+        websocket message
+    channel: str
+        'ticker', 'matches' or 'level2'
+    receive_us: int
+        epoch microseconds, used for the messages without a time, i.e. level2 snapshots
+
+    Output:
+    -------
+    rows: list
+        tuples in the order of the fields of DTYPES[channel]
+    """
+    if channel == 'ticker':
+        return [(parse_utc_epoch_us(msg['time']), msg.get('sequence', 0), msg.get('trade_id', 0),
+                 float(msg['price']), float(msg.get('last_size', 0.0)),
+                 float(msg.get('best_bid', 'nan')), float(msg.get('best_ask', 'nan')),
+                 SIDE_CODES.get(msg.get('side'), 0))]
+    if channel == 'matches':
+        return [(parse_utc_epoch_us(msg['time']), msg.get('sequence', 0), msg.get('trade_id', 0),
+                 float(msg['price']), float(msg['size']), SIDE_CODES.get(msg.get('side'), 0))]
+    if msg['type'] == 'snapshot':
+        rows = [(receive_us, float(price), float(size), 1, 1) for price, size in msg['bids']]
+        rows.extend((receive_us, float(price), float(size), -1, 1) for price, size in msg['asks'])
+        return rows
+    time_us = parse_utc_epoch_us(msg['time']) if 'time' in msg else receive_us
+    return [(time_us, float(price), float(size), SIDE_CODES[side], 0) for side, price, size in msg['changes']]
+
+def get_message_channel(msg):
+    """Channel of a websocket message, or None if it is not a recorded message type"""
+    msg_type = msg.get('type')
+    if msg_type == 'ticker':
+        return 'ticker'
+    if msg_type in ('match', 'last_match'):
+        return 'matches'
+    if msg_type in ('snapshot', 'l2update'):
+        return 'level2'
+    return None
+
+def load_ticks(product, date_string, channel='ticker', root_dir=None):
+    """Memory-maps the records of one channel of one product on one UTC day.
+
+    Output:
+    -------
+    records: numpy.ndarray
+        read-only structured array with dtype DTYPES[channel], empty if nothing was recorded.
+        A partially written last record is left out.
+    """
+    dtype = DTYPES[channel]
+    filename = get_tick_filename(product, date_string, channel, root_dir)
+    if not os.path.exists(filename):
+        return np.empty(0, dtype=dtype)
+    num_records = os.path.getsize(filename) // dtype.itemsize
+    if num_records == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(num_records,))
+
+def get_recorded_dates(product, root_dir=None):
+    """Sorted list of the UTC days with recorded messages of product"""
+    if root_dir is None:
+        root_dir = get_default_root_dir()
+    product_dir = os.path.join(root_dir, product)
+    if not os.path.isdir(product_dir):
+        return []
+    return sorted({filename.split('.')[0] for filename in os.listdir(product_dir) if filename.endswith('.bin')})
+
+def iter_channel_messages(product, date_string, channel, root_dir=None):
+    """Yields (time_us, msg) of one file, with msg in the format of the websocket messages"""
+    records = load_ticks(product, date_string, channel, root_dir)
+    if channel == 'ticker':
+        for record in records.tolist():
+            time_us, sequence, trade_id, price, last_size, best_bid, best_ask, side = record
+            yield time_us, {'type': 'ticker', 'product_id': product, 'sequence': sequence, 'trade_id': trade_id,
+                            'price': repr(price), 'last_size': repr(last_size),
+                            'best_bid': repr(best_bid), 'best_ask': repr(best_ask),
+                            'side': SIDE_NAMES.get(side), 'time': format_utc_epoch_us(time_us)}
+    elif channel == 'matches':
+        for record in records.tolist():
+            time_us, sequence, trade_id, price, size, side = record
+            yield time_us, {'type': 'match', 'product_id': product, 'sequence': sequence, 'trade_id': trade_id,
+                            'price': repr(price), 'size': repr(size),
+                            'side': SIDE_NAMES.get(side), 'time': format_utc_epoch_us(time_us)}
+    else:
+        # consecutive records of the same kind and time were one message
+        msg = None
+        msg_key = None
+        for time_us, price, size, side, snapshot in records.tolist():
+            key = (time_us, snapshot)
+            if key != msg_key:
+                if msg is not None:
+                    yield msg_key[0], msg
+                msg_key = key
+                if snapshot:
+                    msg = {'type': 'snapshot', 'product_id': product, 'bids': [], 'asks': []}
+                else:
+                    msg = {'type': 'l2update', 'product_id': product, 'changes': [],
+                           'time': format_utc_epoch_us(time_us)}
+            if snapshot:
+                msg['bids' if side == 1 else 'asks'].append([repr(price), repr(size)])
+            else:
+                msg['changes'].append([SIDE_NAMES[side], repr(price), repr(size)])
+        if msg is not None:
+            yield msg_key[0], msg
+
+def iter_recorded_messages(products, date_strings, channels=('ticker',), root_dir=None):
+    """Yields (time_us, msg) of all the recorded products and channels on the given days, in time order"""
+    for date_string in date_strings:
+        streams = [iter_channel_messages(product, date_string, channel, root_dir)
+                   for product in products for channel in channels]
+        yield from heapq.merge(*streams, key=lambda time_msg: time_msg[0])
+
+def replay(on_message, products, date_strings, channels=('ticker',), speed=None, root_dir=None):
+    """Feeds recorded messages to on_message, e.g. a MyWebsocketClient().on_message, in time order.
+
+    Inputs:
+    -------
+    on_message: callable
+        called with each message dict
+    products, date_strings, channels:
+        what to replay, e.g. ["ETH-USD"], ["2021-11-25"], ("ticker",)
+    speed: float
+        None to replay as fast as possible, 1.0 for real time, 10.0 for ten times real time
+    root_dir: str
+        Directory of the recordings.  Default is data/ticks/
+
+    Output:
+    -------
+    message_count: int
+        number of messages replayed
+    """
+    message_count = 0
+    first_time_us = None
+    start = time.perf_counter()
+    for time_us, msg in iter_recorded_messages(products, date_strings, channels, root_dir):
+        if speed is not None:
+            if first_time_us is None:
+                first_time_us = time_us
+            wait = (time_us - first_time_us) * 1e-6 / speed - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+        on_message(msg)
+        message_count += 1
+    return message_count
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Records the websocket messages of Coinbase Pro products to data/ticks/, or replays them.\nExample:\npython tick_recorder.py ETH-USD BTC-USD --channels ticker matches')
+    parser.add_argument('products', type=str, nargs='+',
+                        help='Cryptocurrency products to record, e.g. ETH-USD BTC-USD')
+    parser.add_argument('--channels', type=str, nargs='+', default=['ticker'], choices=CHANNELS,
+                        help='Channels to record.  Default is ticker')
+    parser.add_argument('--replay', type=str, nargs='+', default=None,
+                        help='UTC days to replay instead of recording, e.g. 2021-11-25.  Prints the replayed messages.')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='Replay speed, 1.0 is real time.  Default is as fast as possible')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='Flag.  If set, runs code in quiet mode.')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    products = args.products
+    channels = args.channels
+    replay_dates = args.replay
+    speed = args.speed
+    quiet = args.quiet
+
+    return products, channels, replay_dates, speed, quiet
+
+
+#####   Classes   #####
+class TickRecorder:
+    """Appends websocket messages to the tick files, in batches.
+
+    Inputs:
+    -------
+    channels: list
+        channels to record, messages of other channels are ignored
+    root_dir: str
+        Directory of the recordings.  Default is data/ticks/
+    batch_size, flush_seconds:
+        a file is written when it has batch_size records waiting or its oldest record waited flush_seconds
+    """
+    def __init__(self, channels=('ticker',), root_dir=None, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.channels = set(channels)
+        self.root_dir = root_dir if root_dir is not None else get_default_root_dir()
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        # (product, channel) -> [date_string, file, rows, time of the oldest row]
+        self._pending = {}
+        self.record_count = 0
+        self.lock = threading.Lock()
+
+    def record(self, msg):
+        """Records one websocket message, returns True if it belongs to a recorded channel"""
+        channel = get_message_channel(msg)
+        if channel not in self.channels:
+            return False
+        now = time.time()
+        receive_us = int(now * 1e6)
+        rows = get_message_rows(msg, channel, receive_us)
+        date_string = msg['time'][:10] if 'time' in msg else format_utc_epoch_us(receive_us)[:10]
+
+        with self.lock:
+            key = (msg['product_id'], channel)
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] != date_string:
+                # new UTC day, new file
+                self._flush(key)
+                pending[1].close()
+                pending = None
+            if pending is None:
+                filename = get_tick_filename(msg['product_id'], date_string, channel, self.root_dir)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                pending = [date_string, open(filename, 'ab'), [], now]
+                self._pending[key] = pending
+            if not pending[2]:
+                pending[3] = now
+            pending[2].extend(rows)
+            self.record_count += len(rows)
+            if len(pending[2]) >= self.batch_size or now - pending[3] >= self.flush_seconds:
+                self._flush(key)
+        return True
+
+    def _flush(self, key):
+        """Writes the waiting records of one file.  Call with self.lock held."""
+        pending = self._pending[key]
+        if not pending[2]:
+            return
+        np.array(pending[2], dtype=DTYPES[key[1]]).tofile(pending[1])
+        pending[1].flush()
+        pending[2] = []
+
+    def flush(self):
+        """Writes all the waiting records"""
+        with self.lock:
+            for key in self._pending:
+                self._flush(key)
+
+    def close(self):
+        """Writes all the waiting records and closes the files"""
+        with self.lock:
+            for key, pending in self._pending.items():
+                self._flush(key)
+                pending[1].close()
+            self._pending = {}
+
+class RecorderClient(cbpro.WebsocketClient):
+    """Websocket client which only records the messages"""
+    def __init__(self, products, channels, url=None):
+        if url is None:
+            url = get_websocket_url()
+        super().__init__(url=url, products=products, channels=list(channels), should_print=False)
+        self.recorder = TickRecorder(channels)
+
+    def on_message(self, msg):
+        self.recorder.record(msg)
+
+    def on_close(self):
+        self.recorder.close()
+
+    def on_error(self, e, data=None):
+        self.error = e
+        self.stop = True
+        print(f"recorder websocket error: {e}")
+
+
+if __name__ == "__main__":
+    products, channels, replay_dates, speed, quiet = parse_args()
+
+    if replay_dates is not None:
+        message_count = replay(print, products, replay_dates, channels, speed)
+        print(f"replayed {message_count} messages", file=sys.stderr)
+        sys.exit(0)
+
+    recorder_client = RecorderClient(products, channels)
+
+    def signal_handler(sig, frame):
+        recorder_client.close()
+        sys.exit(0)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    recorder_client.start()
+    while True:
+        time.sleep(10)
+        if not quiet:
+            print(f"{recorder_client.recorder.record_count} records written to {recorder_client.recorder.root_dir}")
+        if recorder_client.stop:
+            # the websocket dropped, reconnect
+            recorder_client.recorder.close()
+            recorder_client = RecorderClient(products, channels)
+            recorder_client.start()
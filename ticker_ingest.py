@@ -0,0 +1,132 @@
+"""ticker_ingest.py
+
+Fast path from "ticker" websocket messages to TickBuffer ticks, for the streaming clients.
+
+The "time" of Coinbase Pro messages always has the fixed format '2021-11-25T22:52:29.119195Z',
+so it is parsed by slicing into an integer number of microseconds since the epoch,
+with the epoch of each calendar day cached, instead of calling datetime.strptime() on every tick.
+Price and size are converted to float once, and debug printing is done by a separate thread,
+so the websocket thread never waits on the terminal.  The debug queue is bounded by DEBUG_QUEUE_CAPACITY:
+when the terminal falls behind, the newest messages are dropped instead of piling up in memory.
+"""
+import json
+import queue
+import datetime
+import threading
+
+from tick_buffer import TickBuffer, TickQueue
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# messages waiting to be printed in debug mode, at most
+DEBUG_QUEUE_CAPACITY = 10000
+
+# epoch seconds at 00:00:00 UTC of each 'YYYY-MM-DD' seen so far
+_day_start_seconds = {}
+
+###   Functions   ###
+def get_day_start_seconds(date_string):
+    """Epoch seconds at the start of the UTC day date_string, like '2021-11-25'"""
+    day_start = _day_start_seconds.get(date_string)
+    if day_start is None:
+        ordinal = datetime.date(int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10])).toordinal()
+        day_start = (ordinal - EPOCH_ORDINAL) * 86400
+        _day_start_seconds[date_string] = day_start
+    return day_start
+
+def parse_utc_epoch_us(utc_date_string):
+    """Takes in utc_date_string, like '2021-11-25T22:52:29.119195Z' or '2021-11-25T22:52:29Z'
+    Returns the corresponding integer number of microseconds since 1970-01-01T00:00:00Z.
+    """
+    seconds = (get_day_start_seconds(utc_date_string[:10])
+               + int(utc_date_string[11:13]) * 3600
+               + int(utc_date_string[14:16]) * 60
+               + int(utc_date_string[17:19]))
+    fraction = utc_date_string[20:-1]
+    if fraction:
+        microseconds = int(fraction[:6].ljust(6, '0'))
+    else:
+        microseconds = 0
+    return seconds * 1000000 + microseconds
+
+def parse_ticker(msg):
+    """Decodes a "ticker" message.
+
+    Output:
+    -------
+    tick: tuple or None
+        (product_id, epoch_us, price, size), or None if msg is not a ticker message with a time
+    """
+    if msg.get('type') != 'ticker' or 'time' not in msg:
+        return None
+    return (msg['product_id'], parse_utc_epoch_us(msg['time']),
+            float(msg['price']), float(msg.get('last_size', 0.0)))
+
+
+#####   Classes   #####
+class TickerIngest:
+    """Appends the ticker messages of several products to one TickBuffer per product.
+    Tick times are seconds since the first tick received, as in the plotting scripts.
+
+    Inputs:
+    -------
+    products: list
+        products to keep ticks for, e.g. ["ETH-USD", "BTC-USD"]
+    capacity, window_seconds:
+        passed to every TickBuffer
+    debug: bool
+        If set, every message is also printed, from a separate thread.
+        Messages arriving while DEBUG_QUEUE_CAPACITY are waiting are not printed, only counted in self.debug_dropped
+    queue_capacity: int
+        If set, every tick is also put on a TickQueue per product, in self.queues, for a GUI thread to drain
+    """
+    def __init__(self, products, capacity=100000, window_seconds=None, debug=False, queue_capacity=None):
+        self.buffers = {product: TickBuffer(capacity, window_seconds) for product in products}
+        self.queues = None
+        if queue_capacity is not None:
+            self.queues = {product: TickQueue(queue_capacity) for product in products}
+        self.start_us = None
+        self.message_count = 0
+        self.tick_count = 0
+        self.debug = debug
+        self.debug_dropped = 0
+        self._debug_queue = None
+        if debug:
+            self._debug_queue = queue.Queue(maxsize=DEBUG_QUEUE_CAPACITY)
+            threading.Thread(target=self._print_debug, daemon=True).start()
+
+    def on_message(self, msg):
+        """Handles one websocket message, returns True if it was a tick of one of the products"""
+        self.message_count += 1
+        if self._debug_queue is not None:
+            try:
+                self._debug_queue.put_nowait(msg)
+            except queue.Full:
+                self.debug_dropped += 1
+        if msg.get('type') != 'ticker':
+            return False
+        product = msg.get('product_id')
+        buffer = self.buffers.get(product)
+        if buffer is None or 'time' not in msg:
+            return False
+
+        epoch_us = parse_utc_epoch_us(msg['time'])
+        if self.start_us is None:
+            self.start_us = epoch_us
+        tick_time = (epoch_us - self.start_us) * 1e-6
+        price = float(msg['price'])
+        buffer.append(tick_time, price)
+        if self.queues is not None:
+            self.queues[product].put(tick_time, price)
+        self.tick_count += 1
+        return True
+
+    def _print_debug(self):
+        reported_dropped = 0
+        while True:
+            msg = self._debug_queue.get()
+            dropped = self.debug_dropped
+            if dropped != reported_dropped:
+                print(f"-- {dropped - reported_dropped} messages not printed, the terminal is too slow --")
+                reported_dropped = dropped
+            print(json.dumps(msg, indent=4, sort_keys=True))
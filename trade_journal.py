@@ -0,0 +1,468 @@
+"""trade_journal.py
+
+Structured journal of what cron_roberto.py, roberto_daemon.py, multi_roberto.py and dca_within_cbpro.py do,
+replacing the prose of log/limit_orders_record_*.txt, log/failure_log_*.txt and log/dca_within_cbpro_log.txt.
+
+Every event is one JSON Lines record, e.g.
+{"time": 1637880749.1, "event": "pair_placed", "product": "ETH-USD", "order_ids": [...], "level": 0, "buy": {...}, "sell": {...}}
+Records are buffered in memory and written in batches: once per cron_roberto.py run or multi_roberto.py cycle,
+every BATCH_SIZE records, and at exit.
+
+The records go to segments in log/journal/, e.g. 2021-11-25_000.jsonl.
+A segment is closed and gzipped once it is MAX_SEGMENT_BYTES long or the UTC day changes.
+The SQLite index log/journal/index.sqlite3 keeps the segment and offset of every record by product,
+event, order id and time, so finding when a pair filled reads a few lines instead of grepping every log.
+
+Events:
+pair_placed, placement_failed, pair_done, no_new_orders, dca_start, dca_succeeded, dca_failed
+
+Examples:
+python trade_journal.py --import
+python trade_journal.py --product ETH-USD --event pair_done --since 2021-11-25
+python trade_journal.py --order-id 8a5f7c1e-2d3b-4f6a-9c8d-7e6f5a4b3c2d
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import atexit
+import shutil
+import sqlite3
+import argparse
+import datetime
+import threading
+
+from order_state import transaction
+
+JOURNAL_DIRNAME = "journal"
+INDEX_FILENAME = "index.sqlite3"
+
+# a segment is closed and compressed past this size
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+
+# buffered records written at once
+BATCH_SIZE = 1000
+
+# milliseconds to wait for another process writing the journal
+BUSY_TIMEOUT_MS = 10000
+
+# time format of the old .txt logs, in local time
+TEXT_LOG_TIME_FORMAT = '%Y %m %d, %H:%M:%S'
+
+# one Journal per log directory in this process
+_journals = {}
+_journals_lock = threading.Lock()
+
+#####   Classes   #####
+class Journal:
+    """Buffered writer of the journal of log_dir.
+    Safe to share between threads, and between processes: batches are written under the write lock of the index.
+
+    Inputs:
+    -------
+    log_dir: str
+        log/ directory, the journal lives in log_dir/journal/
+    max_segment_bytes: int
+        size past which a segment is closed and compressed
+    batch_size: int
+        number of buffered records which triggers a write
+    """
+    def __init__(self, log_dir, max_segment_bytes=MAX_SEGMENT_BYTES, batch_size=BATCH_SIZE):
+        self.journal_dir = get_journal_dir(log_dir)
+        self.max_segment_bytes = max_segment_bytes
+        self.batch_size = batch_size
+        self.records = []
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def write(self, event, product=None, order_ids=(), record_time=None, **fields):
+        """Buffers one record.
+
+        Inputs:
+        -------
+        event: str
+            kind of record, e.g. pair_placed
+        product: str
+            Cryptocurrency product, e.g. ETH-USD
+        order_ids: list
+            order ids the record is about, indexed
+        record_time: float
+            epoch seconds of the event, default now
+        fields:
+            other JSON serializable fields of the record
+        """
+        record = get_record(event, product, order_ids, record_time, **fields)
+        with self.lock:
+            self.records.append(record)
+            if len(self.records) >= self.batch_size:
+                self.write_batch()
+
+    def flush(self):
+        """Writes the buffered records"""
+        with self.lock:
+            if self.records:
+                self.write_batch()
+
+    def write_import(self, filename, records):
+        """Writes the records of the old log filename, see import_text_logs(),
+        and marks filename imported in the same index transaction, so a crash can't import it twice.
+
+        Output:
+        -------
+        imported: bool
+            False if filename was already imported, then nothing is written
+        """
+        with self.lock:
+            if self.records:
+                self.write_batch()
+            self.records = records
+            return self.write_batch(imported_filename=filename)
+
+    def write_batch(self, imported_filename=None):
+        """Appends the buffered records to the active segment and indexes them, in one index transaction.
+        If imported_filename is given, it is recorded as imported in that transaction, unless it already was.
+        Called with self.lock held.  Returns False if nothing was written because imported_filename was already imported.
+        """
+        if self.conn is None:
+            self.conn = connect(self.journal_dir, check_same_thread=False)
+        conn = self.conn
+        lines = [(json.dumps(record, separators=(',', ':')) + "\n").encode() for record in self.records]
+        with transaction(conn):
+            if imported_filename is not None:
+                if conn.execute("SELECT 1 FROM imports WHERE filename = ?", (imported_filename,)).fetchone() is not None:
+                    self.records = []
+                    return False
+                conn.execute("INSERT INTO imports (filename, imported_at) VALUES (?, ?)", (imported_filename, time.time()))
+            segment_id, name, size = self.get_active_segment(conn)
+            path = os.path.join(self.journal_dir, name)
+            with open(path, "ab") as file1:
+                # drop what a writer killed before committing its batch left after the indexed end
+                file1.truncate(size)
+                file1.seek(size)
+                offsets = []
+                for line in lines:
+                    offsets.append(size)
+                    size += len(line)
+                file1.write(b"".join(lines))
+            for record, offset in zip(self.records, offsets):
+                entry_id = conn.execute("INSERT INTO entries (segment_id, offset, time, product, event) VALUES (?, ?, ?, ?, ?)",
+                                        (segment_id, offset, record['time'], record['product'], record['event'])).lastrowid
+                conn.executemany("INSERT INTO entry_orders (order_id, entry_id) VALUES (?, ?)",
+                                 [(order_id, entry_id) for order_id in record.get('order_ids', ())])
+            conn.execute("UPDATE segments SET size = ? WHERE segment_id = ?", (size, segment_id))
+        self.records = []
+        return True
+
+    def get_active_segment(self, conn):
+        """Returns (segment_id, name, size) of the segment to append to,
+        compressing the open segments which are full or from an older UTC day.
+        Called inside the index transaction.
+        """
+        day = time.strftime('%Y-%m-%d', time.gmtime())
+        active = None
+        for segment_id, name, segment_day, size in conn.execute(
+                "SELECT segment_id, name, day, size FROM segments WHERE compressed = 0 ORDER BY segment_id").fetchall():
+            if segment_day == day and size < self.max_segment_bytes and active is None:
+                active = (segment_id, name, size)
+            else:
+                self.compress_segment(conn, segment_id, name)
+        if active is not None:
+            return active
+
+        count = conn.execute("SELECT COUNT(*) FROM segments WHERE day = ?", (day,)).fetchone()[0]
+        name = f"{day}_{count:03d}.jsonl"
+        segment_id = conn.execute("INSERT INTO segments (name, day, size, compressed) VALUES (?, ?, 0, 0)",
+                                  (name, day)).lastrowid
+        return segment_id, name, 0
+
+    def compress_segment(self, conn, segment_id, name):
+        """Gzips a closed segment, the offsets of its records stay valid in the uncompressed stream"""
+        path = os.path.join(self.journal_dir, name)
+        size = conn.execute("SELECT size FROM segments WHERE segment_id = ?", (segment_id,)).fetchone()[0]
+        if os.path.exists(path):
+            with open(path, "r+b") as file1:
+                file1.truncate(size)
+            with open(path, "rb") as file1, gzip.open(path + ".gz", "wb") as file2:
+                shutil.copyfileobj(file1, file2)
+        conn.execute("UPDATE segments SET name = ?, compressed = 1 WHERE segment_id = ?", (name + ".gz", segment_id))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+###   Functions   ###
+def get_record(event, product=None, order_ids=(), record_time=None, **fields):
+    """One journal record, see Journal.write()"""
+    record = {'time': time.time() if record_time is None else record_time, 'event': event, 'product': product}
+    if order_ids:
+        record['order_ids'] = list(order_ids)
+    record.update(fields)
+    return record
+
+def get_journal_dir(log_dir):
+    journal_dir = os.path.join(log_dir, JOURNAL_DIRNAME)
+    if not os.path.exists(journal_dir):
+        os.makedirs(journal_dir, exist_ok=True)
+    return journal_dir
+
+def connect(journal_dir, check_same_thread=True):
+    """Opens the journal index, creating the tables if needed.
+
+    Output:
+    -------
+    conn: sqlite3.Connection
+        connection in autocommit mode, use order_state.transaction() to write
+    """
+    conn = sqlite3.connect(os.path.join(journal_dir, INDEX_FILENAME), timeout=BUSY_TIMEOUT_MS / 1000.0,
+                           isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS segments (
+            segment_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            day TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            compressed INTEGER NOT NULL
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS entries (
+            entry_id INTEGER PRIMARY KEY,
+            segment_id INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            time REAL NOT NULL,
+            product TEXT,
+            event TEXT NOT NULL
+        )"""
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS entry_orders (order_id TEXT NOT NULL, entry_id INTEGER NOT NULL)")
+    # old .txt logs already imported
+    conn.execute("CREATE TABLE IF NOT EXISTS imports (filename TEXT PRIMARY KEY, imported_at REAL NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_time ON entries (time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_product_time ON entries (product, time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS entry_orders_order_id ON entry_orders (order_id)")
+    return conn
+
+def get_journal(log_dir):
+    """Returns the Journal of log_dir in this process.  The first call registers the exit hook writing its last records."""
+    with _journals_lock:
+        journal = _journals.get(log_dir)
+        if journal is None:
+            journal = _journals[log_dir] = Journal(log_dir)
+            atexit.register(journal.flush)
+        return journal
+
+def flush_all():
+    """Writes the buffered records of every Journal of this process"""
+    with _journals_lock:
+        journals = list(_journals.values())
+    for journal in journals:
+        journal.flush()
+
+def get_order_record(order):
+    """Fields of a Coinbase Pro order response kept in the journal: its error message, or its id, price and size"""
+    if 'message' in order:
+        return {'error': order['message']}
+    return {'id': order['id'], 'price': order['price'], 'size': order['size']}
+
+def find_records(log_dir, product=None, event=None, order_id=None, start=None, end=None):
+    """Looks records up through the index.
+
+    Inputs:
+    -------
+    product, event, order_id: str
+        only the records matching all of the ones set are returned
+    start, end: float
+        epoch seconds, only the records with start <= time < end are returned
+
+    Output:
+    -------
+    records: list
+        dicts, oldest first
+    """
+    journal_dir = get_journal_dir(log_dir)
+    conn = connect(journal_dir)
+    query = "SELECT segments.name, entries.offset FROM entries JOIN segments USING (segment_id)"
+    conditions = []
+    values = []
+    if order_id is not None:
+        query += " JOIN entry_orders USING (entry_id)"
+        conditions.append("entry_orders.order_id = ?")
+        values.append(order_id)
+    for column, value in (('product', product), ('event', event)):
+        if value is not None:
+            conditions.append(f"entries.{column} = ?")
+            values.append(value)
+    if start is not None:
+        conditions.append("entries.time >= ?")
+        values.append(start)
+    if end is not None:
+        conditions.append("entries.time < ?")
+        values.append(end)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY entries.time, entries.entry_id"
+    rows = conn.execute(query, values).fetchall()
+    conn.close()
+
+    # read every segment in offset order, so a gzipped segment is decompressed once
+    lines = {}
+    for name in set(name for name, offset in rows):
+        path = os.path.join(journal_dir, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "rb") as file1:
+            for offset in sorted(offset for row_name, offset in rows if row_name == name):
+                file1.seek(offset)
+                lines[name, offset] = file1.readline()
+    return [json.loads(lines[row]) for row in rows]
+
+def parse_text_log_time(line):
+    """Epoch seconds of the '... at 2021 11 25, 22:52:29' ending a line of the old .txt logs"""
+    return time.mktime(time.strptime(line.rsplit(' at ', 1)[1].strip(), TEXT_LOG_TIME_FORMAT))
+
+def parse_limit_orders_record(filename, product):
+    """Records of an old limit_orders_record_{product}.txt file"""
+    records = []
+    attempt = None
+
+    def finish_attempt():
+        if attempt is None:
+            return
+        record_time, pairs, failed = attempt
+        if failed or not pairs:
+            records.append(('placement_failed', record_time, [], {}))
+        for level, pair in sorted(pairs.items()):
+            order_ids = [pair[side]['id'] for side in ('buy', 'sell') if 'id' in pair.get(side, {})]
+            records.append(('pair_placed', record_time, order_ids,
+                            {'level': level, 'buy': pair.get('buy', {}), 'sell': pair.get('sell', {})}))
+
+    level, side = 0, None
+    with open(filename, "r") as file1:
+        for line in file1:
+            line = line.strip()
+            if line.startswith("New ") and " creation attempt at " in line:
+                finish_attempt()
+                attempt = (parse_text_log_time(line), {}, False)
+            elif attempt is None:
+                continue
+            elif line.startswith("Failed"):
+                attempt = (attempt[0], attempt[1], True)
+            elif line.endswith(" error:") or " error: " in line:
+                side, message = line.split(" error:", 1)
+                attempt[1].setdefault(0, {})[side] = {'error': message.strip()}
+            elif line.endswith(":") and ("imit buy" in line or "imit sell" in line):
+                fields = line[:-1].split()
+                side = fields[-1]
+                level = int(fields[1]) if fields[0] == "Level" else 0
+                attempt[1].setdefault(level, {})[side] = {}
+            elif side is not None and line.startswith(("Price:", "Size:", "ID:")):
+                key, value = line.split(":", 1)
+                value = value.split()[0] if key != "ID" else value.strip()
+                attempt[1][level][side][key.lower()] = value
+    finish_attempt()
+    return records
+
+def parse_simple_log(filename, events):
+    """Records of an old log with one '... at {time}' event per line,
+    events maps the start of a line to the event name and product
+    """
+    records = []
+    with open(filename, "r") as file1:
+        for line in file1:
+            for prefix, (event, product) in events.items():
+                if line.startswith(prefix):
+                    records.append((event, parse_text_log_time(line), [], {'product': product}))
+                    break
+    return records
+
+def import_text_logs(log_dir, quiet=False):
+    """One-time import of the old limit_orders_record_*.txt, failure_log_*.txt and dca_within_cbpro_log.txt logs.
+    Every file is imported once, the files are left in place.
+
+    Output:
+    -------
+    imported: int
+        number of records imported
+    """
+    journal = Journal(log_dir)
+    conn = connect(journal.journal_dir)
+    imported = 0
+    for filename in sorted(os.listdir(log_dir)):
+        path = os.path.join(log_dir, filename)
+        if conn.execute("SELECT 1 FROM imports WHERE filename = ?", (filename,)).fetchone() is not None:
+            continue
+        if filename.startswith("limit_orders_record_") and filename.endswith(".txt"):
+            product = filename[len("limit_orders_record_"):-len(".txt")].replace('_', '-')
+            records = [(event, record_time, order_ids, dict(fields, product=product))
+                       for event, record_time, order_ids, fields in parse_limit_orders_record(path, product)]
+        elif filename.startswith("failure_log_") and filename.endswith(".txt"):
+            product = filename[len("failure_log_"):-len(".txt")].replace('_', '-')
+            records = parse_simple_log(path, {"No new limit orders set": ('no_new_orders', product)})
+        elif filename == "dca_within_cbpro_log.txt":
+            records = []
+            with open(path, "r") as file1:
+                for line in file1:
+                    fields = line.split()
+                    for prefix, event in (("dca_within_cbpro.py run", 'dca_start'), ("DCA succeeded", 'dca_succeeded'), ("DCA failed", 'dca_failed')):
+                        if line.startswith(prefix):
+                            product = fields[fields.index('for') + 1].replace('_', '-')
+                            records.append((event, parse_text_log_time(line), [], {'product': product}))
+        else:
+            continue
+
+        # the records and the imports row are committed together
+        if not journal.write_import(filename, [get_record(event, order_ids=order_ids, record_time=record_time, imported=True, **fields)
+                                               for event, record_time, order_ids, fields in records]):
+            continue
+        imported += len(records)
+        if not quiet:
+            print(f"{filename}: {len(records)} records imported")
+    conn.close()
+    return imported
+
+def parse_time(text):
+    """Epoch seconds of a local date or date and time, e.g. 2021-11-25 or 2021-11-25T22:52:29"""
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+def parse_args():
+    """Parses the user command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Looks up the trade journal, or imports the old .txt logs into it.\nExample:\npython trade_journal.py --product ETH-USD --event pair_done --since 2021-11-25')
+    parser.add_argument('--import', dest='import_logs', action='store_true',
+                        help='Flag.  If set, imports the old limit_orders_record, failure_log and dca_within_cbpro_log .txt files of log/')
+    parser.add_argument('--product', type=str, default=None,
+                        help='Only show the records of this product, e.g. ETH-USD')
+    parser.add_argument('--event', type=str, default=None,
+                        help='Only show the records of this event, e.g. pair_done')
+    parser.add_argument('--order-id', type=str, default=None,
+                        help='Only show the records about this order id')
+    parser.add_argument('--since', type=str, default=None,
+                        help='Only show the records from this local date or time on, e.g. 2021-11-25 or 2021-11-25T22:00')
+    parser.add_argument('--until', type=str, default=None,
+                        help='Only show the records before this local date or time')
+
+    args = parser.parse_args()
+
+    # Don't use namespaces
+    import_logs = args.import_logs
+    product = args.product
+    event = args.event
+    order_id = args.order_id
+    start = parse_time(args.since) if args.since else None
+    end = parse_time(args.until) if args.until else None
+
+    return import_logs, product, event, order_id, start, end
+
+
+if __name__ == "__main__":
+    import_logs, product, event, order_id, start, end = parse_args()
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')
+
+    if import_logs:
+        imported = import_text_logs(log_dir)
+        print(f"{imported} records imported")
+        sys.exit(0)
+
+    for record in find_records(log_dir, product, event, order_id, start, end):
+        print(json.dumps(record))